@@ -24,7 +24,12 @@ def training_params(**kwargs):
         'prior_m': None,
         'analytic_kl': False,
         'accumulate_gradient': True,
-        'batch_mc': None
+        'batch_mc': None,
+        'checkpoint': None,
+        'checkpoint_every': None,
+        'checkpoint_time': None,
+        'resume_from': None,
+        'callbacks': None
     }
 
     for key, value in kwargs.items():
@@ -56,6 +61,11 @@ def train_model(mod, data, params):
         prior_m=params['prior_m'],
         analytic_kl=params['analytic_kl'],
         accumulate_gradient=params['accumulate_gradient'],
-        batch_mc=params['batch_mc'])
+        batch_mc=params['batch_mc'],
+        checkpoint=params['checkpoint'],
+        checkpoint_every=params['checkpoint_every'],
+        checkpoint_time=params['checkpoint_time'],
+        resume_from=params['resume_from'],
+        callbacks=params['callbacks'])
 
     return trained_mod
@@ -1,2 +1,3 @@
 from .toeplitz import sym_toeplitz_matmul, sym_toeplitz, toeplitz_matmul, toeplitz
 from .linear_cg import linear_cg
+from .kalman import matern_ssm, ssm_transitions, kalman_log_prob
@@ -0,0 +1,256 @@
+import math
+import torch
+from torch import Tensor
+from typing import Tuple
+
+
+def matern_ssm(nu: float, ell: Tensor,
+               scale_sqr: Tensor) -> Tuple[Tensor, Tensor]:
+    """
+    State-space representation of a one-dimensional Matern kernel
+
+    Parameters
+    ----------
+    nu : float
+        smoothness parameter (0.5, 1.5 or 2.5)
+    ell : Tensor
+        length scales (...)
+    scale_sqr : Tensor
+        kernel variances (...)
+
+    Returns
+    -------
+    F : Tensor
+        feedback matrix of the SDE (... x s x s) with s = nu + 1/2
+    Pinf : Tensor
+        stationary state covariance (... x s x s)
+
+    Notes
+    -----
+    The first state component is the GP itself; see Hartikainen & Sarkka (2010)
+    'Kalman filtering and smoothing solutions to temporal Gaussian process
+    regression models'.
+    """
+    lam = math.sqrt(2 * nu) / ell
+    zero = torch.zeros_like(lam)
+    one = torch.ones_like(lam)
+    if nu == 0.5:
+        F = -lam[..., None, None]
+        Pinf = scale_sqr[..., None, None]
+    elif nu == 1.5:
+        F = torch.stack([
+            torch.stack([zero, one], dim=-1),
+            torch.stack([-lam**2, -2 * lam], dim=-1)
+        ],
+                        dim=-2)
+        Pinf = torch.diag_embed(
+            torch.stack([scale_sqr, lam**2 * scale_sqr], dim=-1))
+    elif nu == 2.5:
+        F = torch.stack([
+            torch.stack([zero, one, zero], dim=-1),
+            torch.stack([zero, zero, one], dim=-1),
+            torch.stack([-lam**3, -3 * lam**2, -3 * lam], dim=-1)
+        ],
+                        dim=-2)
+        kappa = lam**2 * scale_sqr / 3
+        Pinf = torch.stack([
+            torch.stack([scale_sqr, zero, -kappa], dim=-1),
+            torch.stack([zero, kappa, zero], dim=-1),
+            torch.stack([-kappa, zero, lam**4 * scale_sqr], dim=-1)
+        ],
+                           dim=-2)
+    else:
+        raise Exception("only nu=0.5, 1.5, 2.5 implemented")
+    return F, Pinf
+
+
+def ssm_transitions(F: Tensor, Pinf: Tensor,
+                    dts: Tensor) -> Tuple[Tensor, Tensor]:
+    """
+    Discretize a stationary linear SDE
+
+    Parameters
+    ----------
+    F : Tensor
+        feedback matrix (... x s x s)
+    Pinf : Tensor
+        stationary state covariance (... x s x s)
+    dts : Tensor
+        time steps (... x m)
+
+    Returns
+    -------
+    A : Tensor
+        transition matrices exp(F dt) (... x m x s x s)
+    Q : Tensor
+        process noise covariances Pinf - A Pinf A^T (... x m x s x s)
+    """
+    A = torch.matrix_exp(F[..., None, :, :] * dts[..., None, None])
+    Pinf = Pinf[..., None, :, :]
+    Q = Pinf - A @ Pinf @ A.transpose(-1, -2)
+    return A, Q
+
+
+def _combine(earlier, later):
+    """
+    associative operator of the parallel Kalman filter (Sarkka &
+    Garcia-Fernandez, 2021); each element (A, b, C, eta, J) is the filtering
+    map from the state before the first step of a segment to the state after
+    its last step, with A, C, J (... x k x s x s) and b, eta (... x k x s x 1)
+    """
+    A1, b1, C1, eta1, J1 = earlier
+    A2, b2, C2, eta2, J2 = later
+    I = torch.eye(A1.shape[-1]).to(A1)
+    M = torch.inverse(I + C1 @ J2)  #(I + J2 C1)^-1 = M^T
+    A2M, A1TMT = A2 @ M, A1.transpose(-1, -2) @ M.transpose(-1, -2)
+    A = A2M @ A1
+    b = A2M @ (b1 + C1 @ eta2) + b2
+    C = A2M @ C1 @ A2.transpose(-1, -2) + C2
+    eta = A1TMT @ (eta2 - J2 @ b1) + eta1
+    J = A1TMT @ J2 @ A1 + J1
+    return A, b, C, eta, J
+
+
+def _associative_scan(fn, elems):
+    """
+    inclusive scan of fn over dimension -3 of a tuple of tensors in
+    O(log m) sequential steps
+    """
+    m = elems[0].shape[-3]
+    if m < 2:
+        return elems
+    #combine adjacent pairs and scan the result to get the odd prefixes
+    odd = _associative_scan(
+        fn,
+        fn([e[..., 0:-1:2, :, :] for e in elems],
+           [e[..., 1::2, :, :] for e in elems]))
+    #even prefixes (except the first) extend the preceding odd prefix
+    if m % 2 == 0:
+        even = fn([o[..., :-1, :, :] for o in odd],
+                  [e[..., 2::2, :, :] for e in elems])
+    else:
+        even = fn(odd, [e[..., 2::2, :, :] for e in elems])
+    even = [torch.cat([e[..., :1, :, :], ev], -3) for e, ev in zip(elems, even)]
+
+    #interleave even and odd prefixes
+    k = odd[0].shape[-3]
+    out = []
+    for ev, o in zip(even, odd):
+        pairs = torch.stack([ev[..., :k, :, :], o], -3)  #(... x k x 2 x s x r)
+        pairs = pairs.reshape(pairs.shape[:-4] + (2 * k,) + pairs.shape[-2:])
+        out.append(torch.cat([pairs, ev[..., k:, :, :]], -3))
+    return out
+
+
+def kalman_log_prob(x: Tensor,
+                    A: Tensor,
+                    Q: Tensor,
+                    mu: Tensor,
+                    P: Tensor,
+                    jitter: float = 1e-6) -> Tuple[Tensor, Tensor, Tensor]:
+    """
+    Log density of noiseless observations of the first state component of a
+    linear Gaussian state-space model, computed by Kalman filtering in O(m)
+
+    Parameters
+    ----------
+    x : Tensor
+        observations (... x m)
+    A : Tensor
+        transition matrices into each time point (... x m x s x s)
+    Q : Tensor
+        process noise covariances into each time point (... x m x s x s)
+    mu : Tensor
+        filtering mean prior to the first transition (... x s)
+    P : Tensor
+        filtering covariance prior to the first transition (... x s x s)
+    jitter : float
+        observation noise variance added for numerical stability
+
+    Returns
+    -------
+    lp : Tensor
+        log density of the observations (...)
+    mu : Tensor
+        filtering mean after the last observation (... x s)
+    P : Tensor
+        filtering covariance after the last observation (... x s x s)
+
+    Notes
+    -----
+    The returned (mu, P) can be passed back in to continue the filter on the
+    next chunk of a long time series.
+    For a one-dimensional state (Matern 1/2) the observations fully determine the
+    state and the density is computed without a sequential loop.
+    Otherwise the filtering distributions are computed with the parallel
+    (associative) scan of Sarkka & Garcia-Fernandez (2021) 'Temporal
+    parallelization of Bayesian smoothers', which takes O(log m) sequential
+    steps with O(m) total work.
+    """
+    if A.shape[-1] == 1:
+        a, q = A[..., 0, 0], Q[..., 0, 0]  #(... x m)
+        #previous state is the previous observation after the first time step
+        x_prev = torch.cat([mu.expand(x.shape[:-1] + (1,)), x[..., :-1]], -1)
+        v_prev = torch.cat([
+            P[..., 0].expand(x.shape[:-1] + (1,)),
+            torch.zeros_like(x[..., 1:])
+        ], -1)
+        S = a**2 * v_prev + q + jitter
+        r = x - a * x_prev
+        lp = -0.5 * (torch.log(2 * math.pi * S) + r**2 / S)
+        return lp.sum(-1), x[..., -1:], torch.zeros_like(P)
+
+    s = A.shape[-1]
+    y = x[..., None, None]  #(... x m x 1 x 1)
+    I = torch.eye(s).to(A)
+    #batch shapes of the covariances and of the means
+    P_t = P[..., None, 0, 0]  #(... x 1)
+    cov = torch.broadcast_tensors(A[..., 0, 0], Q[..., 0, 0], P_t)[0]
+    cov_shape = cov.shape[:-1]
+    mean_shape = torch.broadcast_tensors(cov, x, mu[..., None, 0])[0].shape[:-1]
+
+    #first time point: predict from (mu, P) and update
+    A0, At = A[..., :1, :, :], A[..., 1:, :, :]
+    Q0, Qt = Q[..., :1, :, :], Q[..., 1:, :, :]
+    mu0 = A0 @ mu[..., None, :, None]  #(... x 1 x s x 1)
+    P0 = A0 @ P[..., None, :, :] @ A0.transpose(-1, -2) + Q0  #(... x 1 x s x s)
+    S0 = P0[..., :1, :1] + jitter
+    K0 = P0[..., :, :1] / S0
+    first = (torch.zeros_like(P0),
+             mu0 + K0 * (y[..., :1, :, :] - mu0[..., :1, :]),
+             P0 - K0 @ K0.transpose(-1, -2) * S0, torch.zeros_like(mu0),
+             torch.zeros_like(P0))
+
+    #subsequent time points: filtering maps from the previous state
+    St = Qt[..., :1, :1] + jitter
+    Kt = Qt[..., :, :1] / St
+    IKH = I - Kt @ I[:1, :]
+    a = At[..., :1, :]  #observed row of the transitions (... x m-1 x 1 x s)
+    rest = (IKH @ At, Kt * y[..., 1:, :, :],
+            IKH @ Qt, a.transpose(-1, -2) * y[..., 1:, :, :] / St,
+            a.transpose(-1, -2) @ a / St)
+
+    shapes = [cov_shape, mean_shape, cov_shape, mean_shape, cov_shape]
+    elems = [
+        torch.cat([
+            e0.expand(shape + (1,) + e0.shape[-2:]),
+            e.expand(shape + e.shape[-3:])
+        ], -3) for e0, e, shape in zip(first, rest, shapes)
+    ]
+    _, mus, Ps, _, _ = _associative_scan(_combine, elems)  #filtering moments
+
+    #predictive densities of the observations
+    mu_pred = At @ mus[..., :-1, :, :]
+    P_pred = At @ Ps[..., :-1, :, :] @ At.transpose(-1, -2) + Qt
+    S = torch.cat([
+        S0[..., 0, 0].expand(cov_shape + (1,)),
+        P_pred[..., 0, 0].expand(cov_shape + (-1,)) + jitter
+    ], -1)
+    mu_obs = torch.cat([
+        mu0[..., 0, 0].expand(mean_shape + (1,)),
+        mu_pred[..., 0, 0].expand(mean_shape + (-1,))
+    ], -1)
+    r = x - mu_obs
+    lp = -0.5 * (torch.log(2 * math.pi * S) + r**2 / S)
+
+    return lp.sum(-1), mus[..., -1, :, 0], Ps[..., -1, :, :]
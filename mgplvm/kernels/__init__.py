@@ -1,3 +1,3 @@
-from .kernel import Kernel
+from .kernel import Kernel, Sum, Product
 from .stationary import (QuadExp, Exp, Matern)
 from .linear import Linear
\ No newline at end of file
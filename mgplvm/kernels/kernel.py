@@ -1,6 +1,8 @@
 import abc
+import torch
+from torch import nn, Tensor
 from ..base import Module
-from torch import Tensor
+from typing import List, Optional, Tuple
 
 
 class Kernel(Module, metaclass=abc.ABCMeta):
@@ -11,15 +13,15 @@ class Kernel(Module, metaclass=abc.ABCMeta):
     def __init__(self):
         super().__init__()
 
-    @abc.abstractstaticmethod
+    @abc.abstractmethod
     def K(self, x: Tensor, y: Tensor) -> Tensor:
         pass
 
-    @abc.abstractstaticmethod
+    @abc.abstractmethod
     def trK(self, x: Tensor) -> Tensor:
         pass
 
-    @abc.abstractstaticmethod
+    @abc.abstractmethod
     def diagK(self, x: Tensor) -> Tensor:
         pass
 
@@ -27,63 +29,73 @@ class Kernel(Module, metaclass=abc.ABCMeta):
         return self.K(x, y)
 
 
-#class Combination(Kernel):
-#
-#    def __init__(self, kernels: List[Kernel]):
-#        """
-#        Combination Kernels
-#
-#        Parameters
-#        ----------
-#        kernels : list of kernels
-#
-#        Notes
-#        -----
-#        Implementation largely follows thats described in
-#        https://github.com/GPflow/GPflow/blob/develop/gpflow/kernels/base.py
-#        """
-#        super().__init__()
-#        self.kernels = kernels
-#
-#    def forward(self, x: List[Tensor], y: List[Tensor]) -> Tensor:
-#        return self._reduce([k(x, y) for (k, x, y) in zip(self.kernels, x, y)])
-#
-#    @abc.abstractmethod
-#    def _reduce(self, x: List[Tensor]) -> Tensor:
-#        pass
-#
-#    @property
-#    def prms(self) -> List[Tuple[Tensor]]:
-#        return [k.prms for k in self.kernels]
-#
-#
-#class Sum(Combination):
-#
-#    def _reduce(self, x: List[Tensor]) -> Tensor:
-#        return torch.sum(torch.stack(x, dim=0), dim=0)
-#
-#    def trK(self, x: Tensor) -> Tensor:
-#        """
-#        sum_i(alpha_1^2 + alpha_2^2)
-#        """
-#        alphas = [k.prms[0] for k in self.kernels]
-#        sqr_alphas = [torch.square(alpha) for alpha in alphas]
-#        sqr_alpha = torch.stack(sqr_alphas).sum(dim=0)
-#        return torch.ones(x[0].shape[:-2]).to(
-#            sqr_alpha.device) * sqr_alpha * x[0].shape[-1]
-#
-#
-#class Product(Combination):
-#
-#    def _reduce(self, x: List[Tensor]):
-#        return torch.prod(torch.stack(x, dim=0), dim=0)
-#
-#    def trK(self, x: Tensor) -> Tensor:
-#        """
-#        sum_i(alpha_1^2 * alpha_2^2)
-#        """
-#        alphas = [k.prms[0] for k in self.kernels]
-#        sqr_alphas = [torch.square(alpha) for alpha in alphas]
-#        sqr_alpha = torch.stack(sqr_alphas).prod(dim=0)
-#        return torch.ones(x[0].shape[:-2]).to(
-#            sqr_alpha.device) * sqr_alpha * x[0].shape[-1]
+class Combination(Kernel):
+
+    def __init__(self, kernels: List[Kernel], dims: Optional[List[int]] = None):
+        """
+        Combination Kernels
+
+        Parameters
+        ----------
+        kernels : list of kernels
+        dims : Optional[List[int]]
+            number of input dimensions seen by each kernel
+            (e.g. manifolds.Product.d2s); the inputs (... n x d x mx) are split
+            along d and passed to the kernels in order.
+            If None, every kernel sees all input dimensions.
+
+        Notes
+        -----
+        Implementation largely follows thats described in
+        https://github.com/GPflow/GPflow/blob/develop/gpflow/kernels/base.py
+        """
+        super().__init__()
+        self.kernels = nn.ModuleList(kernels)
+        self.dims = dims
+
+    def split(self, x: Tensor) -> List[Tensor]:
+        if self.dims is None:
+            return [x for _ in self.kernels]
+        return list(torch.split(x, self.dims, dim=-2))
+
+    def K(self, x: Tensor, y: Tensor) -> Tensor:
+        xs, ys = self.split(x), self.split(y)
+        return self._reduce(
+            [k.K(x, y) for (k, x, y) in zip(self.kernels, xs, ys)])
+
+    def diagK(self, x: Tensor) -> Tensor:
+        xs = self.split(x)
+        return self._reduce([k.diagK(x) for (k, x) in zip(self.kernels, xs)])
+
+    def trK(self, x: Tensor) -> Tensor:
+        return self.diagK(x).sum(-1)
+
+    @abc.abstractmethod
+    def _reduce(self, x: List[Tensor]) -> Tensor:
+        pass
+
+    @property
+    def prms(self) -> List[Tuple[Tensor]]:
+        return [k.prms for k in self.kernels]
+
+    @property
+    def msg(self):
+        return ''.join([k.msg for k in self.kernels])
+
+
+class Sum(Combination):
+
+    def _reduce(self, x: List[Tensor]) -> Tensor:
+        res = x[0]
+        for xi in x[1:]:
+            res = res + xi
+        return res
+
+
+class Product(Combination):
+
+    def _reduce(self, x: List[Tensor]) -> Tensor:
+        res = x[0]
+        for xi in x[1:]:
+            res = res * xi
+        return res
@@ -204,8 +204,14 @@ class QuadExp(Stationary):
         else:
             ell = ell[:, None, None]  #(n x 1 x 1)
         distance = self.distance(x, y, ell=ell)  # dims (... n x mx x my)
-        kxy = scale_sqr[:, None, None] * torch.exp(-0.5 * distance)
-        return kxy
+        # scale_sqr * exp(-0.5 * distance) in place on the distance matrix
+        log_scale_sqr = torch.log(scale_sqr)[:, None, None]
+        kxy = distance.mul_(-0.5)
+        if torch.broadcast_shapes(kxy.shape, log_scale_sqr.shape) == kxy.shape:
+            kxy = kxy.add_(log_scale_sqr)
+        else:
+            kxy = kxy + log_scale_sqr
+        return kxy.exp_()
 
 
 class Exp(QuadExp):
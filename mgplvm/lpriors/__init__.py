@@ -1,3 +1,3 @@
 from .common import Uniform, Brownian, ARP, Null, Gaussian
 from . import torus
-from .euclidean import GP, DS
\ No newline at end of file
+from .euclidean import GP, DS, SSGP
\ No newline at end of file
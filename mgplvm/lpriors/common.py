@@ -163,8 +163,7 @@ class Brownian(Lprior):
 
     def forward(self, g, batch_idxs=None):
         brownian_c, brownian_eta = self.prms
-        ginv = self.manif.inverse(g)
-        dg = self.manif.gmul(ginv[..., 0:-1, :], g[..., 1:, :])
+        dg = self.manif.inverse_gmul(g[..., 0:-1, :], g[..., 1:, :])
         dx = self.manif.logmap(dg)
         normal = dists.Normal(loc=brownian_c, scale=torch.sqrt(brownian_eta))
         diagn = dists.Independent(normal, 1)
@@ -224,34 +223,29 @@ class ARP(Lprior):
     def forward(self, g, batch_idxs=None):
         p = self.p
         ar_c, ar_phi, ar_eta = self.prms
-        ginv = self.manif.inverse(g)  # n_b x n_samplex mx x d2 (on group)
-        dg = self.manif.gmul(
-            ginv[..., 0:-1, :],
+        dg = self.manif.inverse_gmul(
+            g[..., 0:-1, :],
             g[..., 1:, :])  # n_b x n_samples x (mx-1) x d2 (on group)
         dx = self.manif.logmap(dg)  # n_b x n_samplex (mx-1) x d (on algebra)
-        delta = ar_phi * torch.stack(
-            [dx[..., p - j - 1:-j - 1, :] for j in range(p)], dim=-1)
-        dy = dx[..., p:, :] - delta.sum(
-            -1)  # n_b x n_samples x (mx-1-p) x d (on alegbra)
 
-        scale = torch.sqrt(ar_eta)
+        #strided view of the p lags and current value of each dx_t
+        lags = dx.unfold(-2, p + 1, 1)  # n_b x n_samples x (mx-1-p) x d x (p+1)
+        #dx_t - sum_j phi_j dx_(t-j) where the last entry of each window is dx_t
+        delta = (lags[..., :p] * ar_phi.flip(-1)).sum(-1)
+        dy = lags[..., p] - delta  # n_b x n_samples x (mx-1-p) x d (on alegbra)
 
-        if self.diagonal:  #diagonal covariance
-            lq = torch.stack([
-                self.manif.log_q(dists.Normal(ar_c[j], scale[j]).log_prob,
-                                 dy[..., j, None],
-                                 1,
-                                 kmax=self.kmax).sum(-1) for j in range(self.d)
-            ])  #(d x n_b x n_samples x m-p-1)
-            lq = lq.sum(0)  #(n_b x n_samples x m-p-1)
+        scale = torch.sqrt(ar_eta)
+        normal = dists.Normal(loc=ar_c, scale=scale)
+        if self.diagonal:  #wrap each dimension separately
+            log_prob = normal.log_prob
         else:  #not diagonal (e.g. SO(3))
-            normal = dists.Normal(loc=ar_c, scale=scale)
-            diagn = dists.Independent(normal, 1)
-            lq = self.manif.log_q(diagn.log_prob,
-                                  dy,
-                                  self.manif.d,
-                                  kmax=self.kmax)
-            # (n_b x n_samplesx m-p-1)
+            log_prob = dists.Independent(normal, 1).log_prob
+        lq = self.manif.log_q(log_prob,
+                              dy,
+                              self.manif.d,
+                              self.kmax,
+                              diagonal=self.diagonal)
+        # (n_b x n_samplesx m-p-1)
 
         lq = lq.sum(-1).sum(-1)
 
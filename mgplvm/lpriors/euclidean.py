@@ -3,7 +3,7 @@ import torch
 import torch.nn as nn
 import torch.distributions as dists
 from torch.distributions import transform_to, constraints
-from ..kernels import Kernel
+from ..kernels import Kernel, Matern
 from ..manifolds import Euclid
 from ..manifolds.base import Manifold
 from ..models import Svgp
@@ -11,7 +11,9 @@ from ..inducing_variables import InducingPoints
 from ..likelihoods import Gaussian
 from .common import Lprior
 from ..utils import softplus, inv_softplus
-from typing import Optional
+from ..fast_utils.kalman import matern_ssm, ssm_transitions, kalman_log_prob
+from torch.utils.checkpoint import checkpoint
+from typing import Optional, Tuple
 
 
 class LpriorEuclid(Lprior):
@@ -118,6 +120,133 @@ class GP(LpriorEuclid):
             ell.item(), noise.item())
 
 
+class SSGP(LpriorEuclid):
+    name = "SSGP"
+
+    def __init__(self,
+                 manif: Manifold,
+                 kernel: Matern,
+                 ts: torch.Tensor,
+                 jitter: float = 1e-6,
+                 chunk_size: Optional[int] = None):
+        """
+        __init__ method for state-space GP prior class (only works for Euclidean manif)
+        Parameters
+        ----------
+        manif : mgplvm.manifolds.Manifold
+            latent manifold
+        kernel : mgplvm.kernels.Matern
+            Matern kernel with one batch dimension per latent dimension (n = d)
+        ts: Tensor
+            input timepoints for each sample (n_samples x 1 x m)
+        jitter : Optional[float]
+            noise variance added to the latents for numerical stability
+        chunk_size : Optional[int]
+            number of time points filtered at a time in the forward pass
+            (defaults to all time points); chunks are recomputed in the
+            backward pass so that autograd only stores the filter states
+            between chunks
+
+        Notes
+        -----
+        The Matern prior is written as a linear SDE and its log density is
+        computed with a Kalman filter in O(m) time and memory rather than
+        building the m x m prior covariance.
+        Long recordings can be streamed through log_prob in chunks by passing
+        the returned filter state back in.
+        """
+        super().__init__(manif)
+        if not isinstance(kernel, Matern):
+            raise Exception("SSGP prior requires a Matern kernel")
+        self.kernel = kernel
+        self.ts = ts
+        self.jitter = jitter
+        self.chunk_size = chunk_size
+
+    @property
+    def prms(self):
+        scale_sqr, ell = self.kernel.prms
+        return scale_sqr, ell.reshape(self.d)
+
+    def init_state(self, ts: torch.Tensor):
+        """
+        stationary filter state at the first time point of each sample
+        ts is (n_samples x 1 x m)
+        """
+        scale_sqr, ell = self.prms
+        _, Pinf = matern_ssm(self.kernel.nu, ell, scale_sqr)  #(d x s x s)
+        mu = torch.zeros(Pinf.shape[:-1]).to(ts.device)  #(d x s)
+        return mu, Pinf, ts[..., :1]
+
+    def log_prob(self, x: torch.Tensor, ts: torch.Tensor, state=None):
+        """
+        Parameters
+        ----------
+        x : Tensor
+            latents (n_mc x n_samples x m x d)
+        ts : Tensor
+            corresponding timepoints (n_samples x 1 x m)
+        state : Optional[Tuple[Tensor, Tensor, Tensor]]
+            filter state returned by a previous call on the preceding chunk
+
+        Returns
+        -------
+        lp : Tensor
+            log prior density (n_mc x n_samples)
+        state : Tuple[Tensor, Tensor, Tensor]
+            filter mean, covariance and last timepoint for the next chunk
+        """
+        scale_sqr, ell = self.prms
+        F, Pinf = matern_ssm(self.kernel.nu, ell, scale_sqr)  #(d x s x s)
+        mu, P, t0 = self.init_state(ts) if state is None else state
+
+        #time steps into each time point (n_samples x 1 x m)
+        dts = ts - torch.cat([t0, ts[..., :-1]], dim=-1)
+        A, Q = ssm_transitions(F, Pinf, dts)  #(n_samples x d x m x s x s)
+
+        lp, mu, P = kalman_log_prob(x.transpose(-1, -2),
+                                    A,
+                                    Q,
+                                    mu,
+                                    P,
+                                    jitter=self.jitter)  #(n_mc x n_samples x d)
+        return lp.sum(-1), (mu, P, ts[..., -1:])
+
+    def _chunk_log_prob(self, x, ts, mu, P, t0):
+        lp, (mu, P, _) = self.log_prob(x, ts, state=(mu, P, t0))
+        return lp, mu, P
+
+    def forward(self, x, batch_idxs=None):
+        """
+        x is a latent of shape (n_mc x n_samples x mx x d)
+        """
+        ts = self.ts.to(x.device)
+        if batch_idxs is not None:
+            ts = ts[..., batch_idxs]
+        m = x.shape[-2]
+        chunk_size = m if self.chunk_size is None else self.chunk_size
+
+        lps, state = [], self.init_state(ts)
+        for i in range(0, m, chunk_size):
+            x_i, ts_i = x[..., i:i + chunk_size, :], ts[..., i:i + chunk_size]
+            if (self.chunk_size is not None) and x.requires_grad and \
+                    torch.is_grad_enabled():
+                lp, mu, P = checkpoint(self._chunk_log_prob, x_i, ts_i, *state)
+            else:
+                lp, mu, P = self._chunk_log_prob(x_i, ts_i, *state)
+            lps.append(lp)
+            state = (mu, P, ts_i[..., -1:])
+        lp = torch.stack(lps).sum(0)
+        return lp.sum(-1)  #sum over samples
+
+    @property
+    def msg(self):
+        scale_sqr, ell = self.prms
+        return (' prior nu {:.1f} | prior ell {:.3f} |').format(
+            self.kernel.nu,
+            ell.mean().item())
+
+
 def fio_id(x):
     return x
 
@@ -142,6 +271,14 @@ class DS(LpriorEuclid):
         x_t = f(A*x_(t-1)) + N(0, Q)
         where A is Hurwitz and Q is diagonal
         f can be the identity (default; LDS prior) or some non-linear function.
+
+        Notes
+        -----
+        A = diag(lam) O diag(1/sqrt(lam^2 + 1)) with O = exp(W - W^T) a rotation.
+        The matrix exponential is a smooth map onto the rotations, so unlike a
+        QR decomposition of an unconstrained matrix it needs no factorisation or
+        sign corrections. The derived A is cached until the parameters change
+        and is reused by calls without gradients (e.g. msg).
         """
         super().__init__(manif)
         d = self.d
@@ -150,23 +287,29 @@ class DS(LpriorEuclid):
         self.Q = nn.Parameter(data=Q, requires_grad=False
                              )  # fixes the scale and orientation of the latents
 
-        A = torch.diag_embed(torch.ones(d))
-        self.A = nn.Parameter(data=A, requires_grad=True)
+        #generator of the rotation (only the strict upper triangle is used)
+        self._W = nn.Parameter(data=torch.zeros(d, d), requires_grad=True)
+        self._lam = nn.Parameter(data=torch.ones(d), requires_grad=True)
+        self._cache: Optional[Tuple[tuple, torch.Tensor]] = None
         print('initialized DS')
 
+    def _transition(self):
+        W = torch.triu(self._W, diagonal=1)
+        O = torch.linalg.matrix_exp(W - W.T)
+        lam = self._lam
+        L_I = torch.sqrt(torch.square(lam) + 1)**(-1)
+        return lam[:, None] * O * L_I[None, :]
+
     @property
     def prms(self):
-        O, R = torch.qr(self.A)
-        signs = torch.diag_embed(torch.sign(torch.diag(R)))
-        O = O @ signs
-        R = signs @ R
-
-        Lsqrt = torch.diag(R)
-        L_I = torch.sqrt(torch.square(Lsqrt) + 1)**(-1)
-
-        A = torch.diag_embed(Lsqrt) @ O @ torch.diag_embed(L_I)
-        Q = self.Q
-        return A, Q
+        if torch.is_grad_enabled():
+            #the graph of a cached A would be freed by the first backward pass
+            return self._transition(), self.Q
+        key = (self._W._version, self._lam._version, self._W.device,
+               self._W.dtype)
+        if self._cache is None or self._cache[0] != key:
+            self._cache = (key, self._transition())
+        return self._cache[1], self.Q
 
     def forward(self, x, batch_idxs=None):
         """
@@ -177,9 +320,11 @@ class DS(LpriorEuclid):
         xA = torch.matmul(x, A)  #(n_mc, n_samples, m, d)
         dx = x[..., 1:, :] - xA[..., :-1, :]
 
-        mu = torch.zeros(self.d).to(x.device)
-        normal = dists.MultivariateNormal(mu, scale_tril=Q)
-        lq = normal.log_prob(dx)  #(n_mc x n_samplesx m-1)
+        #Q is diagonal, so score dx with independent Gaussians
+        q = torch.diagonal(Q)
+        lq = -0.5 * torch.square(dx / q).sum(-1) - (
+            torch.log(q).sum() + 0.5 * self.d * np.log(2 * np.pi)
+        )  #(n_mc x n_samples x m-1)
         lq = lq.sum(-1).sum(-1)  #(n_mc)
 
         #in the future, we may want an explicit prior over the initial point
@@ -187,6 +332,7 @@ class DS(LpriorEuclid):
 
     @property
     def msg(self):
-        A, Q = self.prms
+        with torch.no_grad():
+            A, Q = self.prms
         lp_msg = (' A {:.3f} |').format(torch.diag(A).mean().item())
         return lp_msg
@@ -35,8 +35,7 @@ class VonMises(LpriorTorus):
 
     def forward(self, g, batch_idxs=None):
         concentration = self.prms
-        ginv = self.manif.inverse(g)
-        dg = self.manif.gmul(ginv[..., 0:-1, :], g[..., 1:, :])
+        dg = self.manif.inverse_gmul(g[..., 0:-1, :], g[..., 1:, :])
         vm = dists.VonMises(loc=torch.zeros(self.d).to(g.device),
                             concentration=concentration)
         vm_all = dists.Independent(vm, 1)
@@ -48,38 +47,100 @@ class VonMises(LpriorTorus):
         return ('concentration {:.3f}').format(concentration.item())
 
 
-class IARP(LpriorTorus):
-    name = "IARP"
+def _logits_link(x):
+    return np.pi * 2 * dists.utils.logits_to_probs(x)
+
+
+def _logits_inv_link(x):
+    return dists.utils.probs_to_logits(x / (2 * np.pi))
+
+
+def _atan_link(x):
+    return (2 * torch.atan(x)) + np.pi
+
+
+def _atan_inv_link(x):
+    return torch.tan((0.5 * x) - np.pi)
+
+
+links = {
+    "logits": (_logits_link, _logits_inv_link),
+    "atan": (_atan_link, _atan_inv_link)
+}
+
+
+class CircularAR(LpriorTorus):
 
     def __init__(self,
                  p,
                  manif,
                  mu=None,
                  phi=None,
-                 concentration=None,
                  fixed_mu=False,
-                 fixed_concentration=False,
                  link="logits"):
+        """
+        Parameters
+        ----------
+        p : int
+            number of lags
+        manif : Torus
+            latent manifold
+        mu : Optional[Tensor]
+            offset of the angles (d)
+        phi : Optional[Tensor]
+            AR coefficients (d x p) with phi[:, j] multiplying lag j+1
+        fixed_mu : bool
+            whether mu is fixed
+        link : str
+            link function mapping the real line to [0, 2pi) ('logits' or 'atan')
+
+        Notes
+        -----
+        Base class of the AR priors on the link scale. The inverse link is
+        applied once to the whole trajectory and the lags are read out as a
+        strided view (Tensor.unfold), so there is no loop over p.
+        """
         super().__init__(manif)
         d = manif.d
         self.p = p
         phi = 0.0 * torch.ones(d, p) if phi is None else phi
         self.phi = nn.Parameter(data=phi, requires_grad=True)
 
-        if link == "atan":
-            self.link = lambda x: (2 * torch.atan(x)) + np.pi
-            self.inv_link = lambda x: torch.tan((0.5 * x) - np.pi)
-        elif link == "logits":
-            self.link = lambda x: np.pi * 2 * dists.utils.logits_to_probs(x)
-            self.inv_link = lambda x: dists.utils.probs_to_logits(x /
-                                                                  (2 * np.pi))
-        else:
+        if link not in links:
             raise Exception("Link function not implemented for %s" % link)
+        self.link, self.inv_link = links[link]
 
         mu = torch.zeros(d) if mu is None else mu
-
         self.mu = nn.Parameter(data=self.inv_link(mu),
                                requires_grad=(not fixed_mu))
+
+    def ar_mean(self, g, mu, phi):
+        """
+        g: (..., m, d)
+        returns the angles centered on mu (..., m-p, d) and the AR predictions
+        sum_j phi_j inv_link(g_(t-j)) (..., m-p, d) for t = p, ..., m-1
+        """
+        p = self.p
+        g = (g - mu) % (np.pi * 2)  # make sure it's on the circle
+        lags = self.inv_link(g[..., :-1, :]).unfold(-2, p, 1)  #(..., m-p, d, p)
+        hat = (lags * phi.flip(-1)).sum(-1)
+        return g[..., p:, :], hat
+
+
+class IARP(CircularAR):
+    name = "IARP"
+
+    def __init__(self,
+                 p,
+                 manif,
+                 mu=None,
+                 phi=None,
+                 concentration=None,
+                 fixed_mu=False,
+                 fixed_concentration=False,
+                 link="logits"):
+        super().__init__(p, manif, mu=mu, phi=phi, fixed_mu=fixed_mu, link=link)
+        d = manif.d
         concentration = torch.ones(
             d) if concentration is None else concentration
         self.concentration = nn.Parameter(
@@ -96,15 +157,11 @@ class IARP(LpriorTorus):
 
     def forward(self, g, batch_idxs=None):
         mu, phi, concentration = self.prms
-        p = self.p
-        g = (g - mu) % (np.pi * 2)  # make sure it's
-        delta = phi * torch.stack(
-            [self.inv_link(g[..., p - j - 1:-j - 1, :]) for j in range(p)],
-            dim=-1)
-        hat = self.link(delta.sum(-1))
-        vm = dists.VonMises(loc=hat, concentration=concentration)
-        vm_all = dists.Independent(vm, 1)
-        return vm_all.log_prob(g[..., p:, :])
+        g, hat = self.ar_mean(g, mu, phi)
+        #von Mises log density with log(I0(k)) = log(i0e(k)) + k
+        lp = concentration * (torch.cos(g - self.link(hat)) - 1) - torch.log(
+            2 * np.pi * torch.special.i0e(concentration))
+        return lp.sum(-1)
 
     @property
     def msg(self):
@@ -114,7 +171,7 @@ class IARP(LpriorTorus):
             torch.mean(phi).item(), concentration.item())
 
 
-class LARP(LpriorTorus):
+class LARP(CircularAR):
     name = "LinkedARP"
 
     def __init__(self,
@@ -126,28 +183,10 @@ class LARP(LpriorTorus):
                  fixed_mu=False,
                  fixed_eta=False,
                  link="logits"):
-        super().__init__(manif)
+        super().__init__(p, manif, mu=mu, phi=phi, fixed_mu=fixed_mu, link=link)
         d = manif.d
-        self.p = p
-        phi = 0.0 * torch.ones(d, p) if phi is None else phi
-        self.phi = nn.Parameter(data=phi, requires_grad=True)
-
-        if link == "atan":
-            self.link = lambda x: (2 * torch.atan(x)) + np.pi
-            self.inv_link = lambda x: torch.tan((0.5 * x) - np.pi)
-        elif link == "logits":
-            self.link = lambda x: np.pi * 2 * dists.utils.logits_to_probs(x)
-            self.inv_link = lambda x: dists.utils.probs_to_logits(x /
-                                                                  (2 * np.pi))
-        else:
-            raise Exception("Linke function not implemented for %s" % link)
-
-        mu = torch.zeros(d) if mu is None else mu
-
-        self.mu = nn.Parameter(data=self.inv_link(mu),
-                               requires_grad=(not fixed_mu))
         eta = torch.ones(d) if eta is None else torch.sqrt(eta)
-        self.eta = nn.Parameter(requires_grad=(not fixed_eta))
+        self.eta = nn.Parameter(data=eta, requires_grad=(not fixed_eta))
 
     @property
     def prms(self):
@@ -156,15 +195,10 @@ class LARP(LpriorTorus):
 
     def forward(self, g, batch_idxs=None):
         mu, phi, eta = self.prms
-        p = self.p
-        g = (g - mu) % (np.pi * 2)  # make sure it's on the circle
-        delta = phi * torch.stack(
-            [self.inv_link(g[..., p - j - 1:-j - 1, :]) for j in range(p)],
-            dim=-1)
-        hat = delta.sum(-1)
-        normal = dists.Normal(hat, scale=torch.sqrt(eta))
-        normal_all = dists.Independent(normal, 1)
-        return normal_all.log_prob(g[..., p:, :])
+        g, hat = self.ar_mean(g, mu, phi)
+        lp = -0.5 * (torch.square(g - hat) / eta + torch.log(eta) +
+                     np.log(2 * np.pi))
+        return lp.sum(-1)
 
     @property
     def msg(self):
@@ -1,4 +1,6 @@
 from .euclid import Euclid
 from .so3 import So3
 from .torus import Torus
-from .s3 import S3
\ No newline at end of file
+from .s3 import S3
+from .sphere import Sphere
+from .product import Product
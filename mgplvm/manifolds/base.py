@@ -4,6 +4,46 @@ import torch.nn as nn
 from torch import Tensor
 from ..base import Module
 from typing import Optional
+import numpy as np
+from ..utils import Noise
+
+
+def shell_kmax(theta: Tensor,
+               kmax: int,
+               period: float,
+               scale: Optional[Tensor] = None,
+               n_std: float = 8.) -> int:
+    """
+    number of shells theta + k*period needed on either side for a wrapped density
+
+    Parameters
+    ----------
+    theta : Tensor
+        magnitudes of the points in the tangent space (... x 1)
+    kmax : int
+        maximum number of shells on either side
+    period : float
+        distance between shells
+    scale : Optional[Tensor]
+        marginal standard deviations of the base distribution (... x d)
+    n_std : float
+        shells further than n_std standard deviations beyond the nearest shell
+        are dropped
+
+    Notes
+    -----
+    The standard deviation along any direction is bounded by the norm of the
+    marginal standard deviations, so each dropped shell has a base density below
+    exp(-n_std^2/2) times that of the nearest shell.
+    """
+    if scale is None:
+        return kmax
+    sig = torch.sqrt(torch.square(scale).sum(-1, keepdim=True))
+    #distance of the nearest shell from the origin
+    r0 = torch.abs(torch.remainder(theta + period / 2, period) - period / 2)
+    #shell k contributes if |k|*period - theta < r0 + n_std * sig
+    reach = (theta + r0 + n_std * sig).max()
+    return min(kmax, int(torch.floor(reach / period).item()))
 
 
 class Manifold(metaclass=abc.ABCMeta):
@@ -33,6 +73,10 @@ class Manifold(metaclass=abc.ABCMeta):
     def inverse(self, x: Tensor) -> Tensor:
         pass
 
+    def inverse_gmul(self, x: Tensor, y: Tensor) -> Tensor:
+        '''x^(-1) y; manifolds can override this to avoid forming x^(-1)'''
+        return self.gmul(self.inverse(x), y)
+
     @staticmethod
     @abc.abstractmethod
     def parameterise(x: Tensor) -> Tensor:
@@ -40,7 +84,8 @@ class Manifold(metaclass=abc.ABCMeta):
 
     @staticmethod
     @abc.abstractmethod
-    def expmap(x: Tensor) -> Tensor:
+    def expmap(x: Tensor, *, noise: Optional[Noise] = None) -> Tensor:
+        '''noise is the noise source of manifolds with a stochastic expmap'''
         pass
 
     @staticmethod
@@ -50,12 +95,17 @@ class Manifold(metaclass=abc.ABCMeta):
 
     @staticmethod
     @abc.abstractmethod
-    def log_q(p, x: Tensor, d: int, kmax: int) -> Tensor:
+    def log_q(p,
+              x: Tensor,
+              d: int,
+              kmax: int,
+              scale: Optional[Tensor] = None,
+              diagonal: bool = False) -> Tensor:
         pass
 
     @staticmethod
     @abc.abstractmethod
-    def distance(x: Tensor, y: Tensor) -> Tensor:
+    def distance(x: Tensor, y: Tensor, ell: Optional[Tensor] = None) -> Tensor:
         pass
 
     @abc.abstractmethod
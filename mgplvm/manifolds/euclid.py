@@ -5,6 +5,7 @@ from torch import Tensor
 from .base import Manifold
 from ..inducing_variables import InducingPoints
 from typing import Optional, List
+from ..utils import Noise
 from sklearn import decomposition
 
 
@@ -56,19 +57,26 @@ class Euclid(Manifold):
     def lprior(self, g):
         '''need empirical data here. g is (n_b x n_samples x m x d)'''
         ps = -0.5 * torch.square(g) - 0.5 * np.log(2 * np.pi)
-        return ps.sum(2)  # sum over d
+        return ps.sum(-1)  # sum over d
 
     @staticmethod
     def parameterise(x) -> Tensor:
         return x
 
     @staticmethod
-    def log_q(log_base_prob, x, d=None, kmax=None):
+    def log_q(log_base_prob,
+              x,
+              d=None,
+              kmax=None,
+              scale: Optional[Tensor] = None,
+              diagonal: bool = False):
         lp = log_base_prob(x)
+        if diagonal:  #sum over per-dimension log densities
+            lp = lp.sum(-1)
         return lp
 
     @staticmethod
-    def expmap(x: Tensor) -> Tensor:
+    def expmap(x: Tensor, noise: Optional[Noise] = None) -> Tensor:
         return x
 
     @staticmethod
@@ -93,13 +101,11 @@ class Euclid(Manifold):
             y = y / ell
 
         # Compute squared distance matrix using quadratic expansion
-        x_norm = x.pow(2).sum(dim=-2, keepdim=True)
-        x_pad = torch.ones_like(x_norm)
-        y_norm = y.pow(2).sum(dim=-2, keepdim=True)
-        y_pad = torch.ones_like(y_norm)
-        x_ = torch.cat([-2.0 * x, x_norm, x_pad], dim=-2)
-        y_ = torch.cat([y, y_pad, y_norm], dim=-2)
-        res = x_.transpose(-1, -2).matmul(y_)
+        # |x|^2 + |y|^2 - 2 x^T y with a single (mx x my) allocation
+        x_norm = x.pow(2).sum(dim=-2)[..., None]  #(... mx x 1)
+        y_norm = y.pow(2).sum(dim=-2, keepdim=True)  #(... 1 x my)
+        res = (-2.0 * x).transpose(-1, -2).matmul(y)
+        res = res.add_(x_norm).add_(y_norm)
 
         # Zero out negative values
         res.clamp_min_(0)
@@ -0,0 +1,227 @@
+import numpy as np
+import torch
+from torch import Tensor
+from .base import Manifold
+from ..inducing_variables import InducingPoints
+from typing import Optional, List
+from ..utils import Noise
+
+
+class Product(Manifold):
+
+    def __init__(self, manifs: List[Manifold]):
+        """
+        Parameters
+        ----------
+        manifs : List[Manifold]
+            factor manifolds (e.g. [Torus(m, 1), Euclid(m, 1)] for T^1 x R^1)
+
+        Notes
+        -----
+        Points are represented by concatenating the factors along the last
+        dimension, both in the tangent space (d = sum of the factor d) and on
+        the group (d2 = sum of the factor d2).
+        Every operation is applied to all samples of a factor at once, so the
+        only Python loop is over the (few) factors.
+        The operations depend on the factors, so the static methods of Manifold
+        are overridden by instance methods.
+        """
+        super().__init__(sum([manif.d for manif in manifs]))
+        self.manifs = manifs
+        self.ds = [manif.d for manif in manifs]  #tangent space dimensions
+        self.d2s = [manif.d2 for manif in manifs]  #group dimensions
+        self.d2 = sum(self.d2s)
+
+    def split(self, x: Tensor, dim: int = -1) -> List[Tensor]:
+        '''split points on the group (... x d2) into factors'''
+        return list(torch.split(x, self.d2s, dim=dim))
+
+    def split_tangent(self, x: Tensor, dim: int = -1) -> List[Tensor]:
+        '''split tangent vectors (... x d) into factors'''
+        return list(torch.split(x, self.ds, dim=dim))
+
+    def initialize(  # type: ignore[override]
+            self, initialization, n_samples, m, d, Y):
+        '''initializes the latents of each factor separately'''
+        mudata = [
+            manif.initialize(initialization, n_samples, m, manif.d, Y)
+            for manif in self.manifs
+        ]
+        return torch.cat(mudata, dim=-1)
+
+    def parameterise_inducing(self, x):
+        zs = self.split(x, dim=-2)  #(n x d2 x n_z)
+        return torch.cat([
+            z if ip.parameterise is None else ip.parameterise(z)
+            for (z, ip) in zip(zs, self.inducing_factors)
+        ],
+                         dim=-2)
+
+    def inducing_points(self, n, n_z, z=None):
+        #keep track of each factor's parameterisation of the inducing points
+        self.inducing_factors = [
+            manif.inducing_points(n, n_z) for manif in self.manifs
+        ]
+        if z is None:
+            z = torch.cat([ip.z.data for ip in self.inducing_factors], dim=-2)
+
+        return InducingPoints(n,
+                              self.d2,
+                              n_z,
+                              z=z,
+                              parameterise=self.parameterise_inducing)
+
+    def lprior(self, g):
+        gs = self.split(g)
+        return sum([manif.lprior(g) for (manif, g) in zip(self.manifs, gs)])
+
+    def parameterise(self, x) -> Tensor:  # type: ignore[override]
+        xs = self.split(x)
+        return torch.cat(
+            [manif.parameterise(x) for (manif, x) in zip(self.manifs, xs)],
+            dim=-1)
+
+    def expmap(  # type: ignore[override]
+            self,
+            x: Tensor,
+            noise: Optional[Noise] = None) -> Tensor:
+        xs = self.split_tangent(x)
+        return torch.cat([
+            manif.expmap(x, noise=noise) for (manif, x) in zip(self.manifs, xs)
+        ],
+                         dim=-1)
+
+    def logmap(self, x: Tensor) -> Tensor:  # type: ignore[override]
+        xs = self.split(x)
+        return torch.cat(
+            [manif.logmap(x) for (manif, x) in zip(self.manifs, xs)], dim=-1)
+
+    def inverse(self, x: Tensor) -> Tensor:
+        xs = self.split(x)
+        return torch.cat(
+            [manif.inverse(x) for (manif, x) in zip(self.manifs, xs)], dim=-1)
+
+    def gmul(self, x: Tensor, y: Tensor) -> Tensor:
+        xs, ys = self.split(x), self.split(y)
+        return torch.cat(
+            [manif.gmul(x, y) for (manif, x, y) in zip(self.manifs, xs, ys)],
+            dim=-1)
+
+    def inverse_gmul(self, x: Tensor, y: Tensor) -> Tensor:
+        xs, ys = self.split(x), self.split(y)
+        return torch.cat([
+            manif.inverse_gmul(x, y)
+            for (manif, x, y) in zip(self.manifs, xs, ys)
+        ],
+                         dim=-1)
+
+    @staticmethod
+    def _join(xs: List[Tensor]) -> Tensor:
+        '''concatenate factors with broadcasting over the leading dimensions'''
+        shape = torch.broadcast_shapes(*[x.shape[:-1] for x in xs])
+        return torch.cat([x.expand(shape + x.shape[-1:]) for x in xs], dim=-1)
+
+    def log_q(  # type: ignore[override]
+            self,
+            log_base_prob,
+            x,
+            d=None,
+            kmax=5,
+            scale: Optional[Tensor] = None,
+            diagonal: bool = False):
+        """
+        log of the variational distribution (~-H(Q))
+
+        Parameters
+        ----------
+        log_base_prob : Callable
+            log density of the base distribution in the tangent space
+        x : Tensor
+            points in the tangent space (... x d)
+        d : int
+            dimensionality (unused; each factor uses its own)
+        kmax : int
+            maximum number of copies/shells on either side for each factor
+        scale : Optional[Tensor]
+            marginal standard deviations of the base distribution (... x d)
+            used by the factors to truncate their sums over copies
+        diagonal : bool
+            if True, log_base_prob returns per-dimension log densities (... x d)
+            and each factor is wrapped independently
+
+        Returns
+        -------
+        lp : Tensor
+            log density (...)
+
+        Notes
+        -----
+        Each factor adds a leading dimension of copies of its own coordinates.
+        For a joint base density the factors are nested, so the density is
+        summed over the product of the copies of all factors.
+        """
+        xs = self.split_tangent(x)
+        scales = [None] * len(xs) if scale is None else self.split_tangent(
+            scale)
+        idxs = np.cumsum([0] + self.ds)
+
+        if diagonal:  #sum of independently wrapped factors
+            lps = []
+            for i, manif in enumerate(self.manifs):
+
+                def lp_i(y, i=i):
+                    y = self._join(xs[:i] + [y] + xs[i + 1:])
+                    return log_base_prob(y)[..., idxs[i]:idxs[i + 1]]
+
+                lps.append(
+                    manif.log_q(lp_i,
+                                xs[i],
+                                manif.d,
+                                kmax,
+                                scale=scales[i],
+                                diagonal=True))
+            return sum(lps)
+
+        def nested_log_q(ys):
+            i = len(ys)
+            if i == len(self.manifs):  #all factors have been wrapped
+                return log_base_prob(self._join(ys))
+            #copies of the previous factors are leading dimensions of ys[-1]
+            shape = xs[i].shape
+            if i > 0:
+                shape = ys[-1].shape[:-1] + shape[-1:]
+            return self.manifs[i].log_q(lambda y: nested_log_q(ys + [y]),
+                                        xs[i].expand(shape),
+                                        self.ds[i],
+                                        kmax,
+                                        scale=scales[i])
+
+        return nested_log_q([])
+
+    def distance(  # type: ignore[override]
+            self,
+            x: Tensor,
+            y: Tensor,
+            ell: Optional[Tensor] = None) -> Tensor:
+        """
+        sum of the squared distances on each factor
+        x, y: (... n x d2 x m)
+        ell is shared between factors unless there is one per group dimension
+        (... x d2 x 1), in which case it is split between the factors
+        """
+        xs, ys = self.split(x, dim=-2), self.split(y, dim=-2)
+        ells: List[Optional[Tensor]] = [ell] * len(self.manifs)
+        if (ell is not None) and ell.shape[-2] == self.d2 and self.d2 > 1:
+            ells = list(self.split(ell, dim=-2))
+        dists = [
+            manif.distance(x, y, ell=ell)
+            for (manif, x, y, ell) in zip(self.manifs, xs, ys, ells)
+        ]
+        res = dists[0]
+        for dist in dists[1:]:
+            res = res.add_(dist)
+        return res
+
+    @property
+    def name(self):
+        return 'x'.join([manif.name for manif in self.manifs])
@@ -1,22 +1,57 @@
+'''
+Quaternion operations on tensors with the components along the last dimension
+(... x 4). The functions are compiled with TorchScript, which fuses the
+elementwise operations and avoids most of the intermediate allocations of the
+equivalent eager code.
+'''
 import torch
+from torch import Tensor
 
 
-def conj(x):
-    a = torch.tensor([1, -1, -1, -1]).to(x.device)
-    return a * x
+@torch.jit.script
+def conj(x: Tensor) -> Tensor:
+    return torch.cat((x[..., :1], -x[..., 1:]), dim=-1)
 
 
-def product(x, y):
-    x0 = x[..., 0]
-    x1 = x[..., 1]
-    x2 = x[..., 2]
-    x3 = x[..., 3]
-    y0 = y[..., 0]
-    y1 = y[..., 1]
-    y2 = y[..., 2]
-    y3 = y[..., 3]
+@torch.jit.script
+def product(x: Tensor, y: Tensor) -> Tensor:
+    x0, x1, x2, x3 = x.unbind(-1)
+    y0, y1, y2, y3 = y.unbind(-1)
     z = ((x0 * y0) - (x1 * y1) - (x2 * y2) - (x3 * y3),
          (x0 * y1) + (x1 * y0) - (x2 * y3) + (x3 * y2),
          (x0 * y2) + (x1 * y3) + (x2 * y0) - (x3 * y1),
          (x0 * y3) - (x1 * y2) + (x2 * y1) + (x3 * y0))
     return torch.stack(z, dim=-1)
+
+
+@torch.jit.script
+def conj_product(x: Tensor, y: Tensor) -> Tensor:
+    '''product(conj(x), y) without forming conj(x)'''
+    x0, x1, x2, x3 = x.unbind(-1)
+    y0, y1, y2, y3 = y.unbind(-1)
+    z = ((x0 * y0) + (x1 * y1) + (x2 * y2) + (x3 * y3),
+         (x0 * y1) - (x1 * y0) + (x2 * y3) - (x3 * y2),
+         (x0 * y2) - (x1 * y3) - (x2 * y0) + (x3 * y1),
+         (x0 * y3) + (x1 * y2) - (x2 * y1) - (x3 * y0))
+    return torch.stack(z, dim=-1)
+
+
+@torch.jit.script
+def exp(x: Tensor, dim: int = -1) -> Tensor:
+    '''
+    x (... x 3) -> (cos|x|, sin|x| x/|x|) (... x 4)
+    '''
+    theta = torch.linalg.vector_norm(x, dim=dim, keepdim=True)
+    return torch.cat((torch.cos(theta), (torch.sin(theta) / theta) * x),
+                     dim=dim)
+
+
+@torch.jit.script
+def log(q: Tensor) -> Tensor:
+    '''
+    q (... x 4) -> atan2(|v|, w) v/|v| (... x 3) for q = (w, v)
+    inverse of exp for unit quaternions
+    '''
+    w, v = q[..., :1], q[..., 1:]
+    y = torch.linalg.vector_norm(v, dim=-1, keepdim=True)
+    return (torch.atan2(y, w) / y) * v
@@ -5,9 +5,10 @@ import torch
 from torch import Tensor
 import torch.nn as nn
 import torch.nn.functional as F
-from .base import Manifold
+from .base import Manifold, shell_kmax
 from typing import Tuple, Optional, List
 from ..inducing_variables import InducingPoints
+from ..utils import Noise
 
 
 class S3(Manifold):
@@ -64,12 +65,11 @@ class S3(Manifold):
         return x / norms
 
     @staticmethod
-    def expmap(x: Tensor, dim: int = -1) -> Tensor:
+    def expmap(x: Tensor,
+               dim: int = -1,
+               noise: Optional[Noise] = None) -> Tensor:
         '''same as SO(3)'''
-        theta = torch.norm(x, dim=dim, keepdim=True)
-        v = x / theta
-        y = torch.cat((torch.cos(theta), torch.sin(theta) * v), dim=dim)
-        return y  # , theta, v
+        return quaternion.exp(x, dim)
 
     @staticmethod
     def expmap2(x: Tensor, dim: int = -1) -> Tensor:
@@ -78,10 +78,7 @@ class S3(Manifold):
     @staticmethod
     def logmap(q: Tensor, dim: int = -1) -> Tensor:
         '''same as SO(3)'''
-        x = q[..., 0]
-        y = torch.norm(q[..., 1:], dim=dim)
-        theta = 2 * torch.atan2(y, x)
-        return theta * (q[..., 1:] / y)
+        return 2 * quaternion.log(q)
 
     @staticmethod
     def inverse(q: Tensor) -> Tensor:
@@ -93,21 +90,32 @@ class S3(Manifold):
         return quaternion.product(x, y)
 
     @staticmethod
-    def log_q(log_base_prob, x, d, kmax, dim=-1):
+    def inverse_gmul(x: Tensor, y: Tensor) -> Tensor:
+        '''same as SO(3)'''
+        return quaternion.conj_product(x, y)
+
+    @staticmethod
+    def log_q(log_base_prob,
+              x,
+              d,
+              kmax,
+              scale=None,
+              diagonal: bool = False,
+              dim=-1):
         '''
         theta = |x|/2
+        if scale (marginal standard deviations of the base distribution) is
+        provided, only shells within 8 standard deviations are summed (see shell_kmax)
+        if diagonal, log_base_prob returns per-dimension log densities (... x d)
         '''
 
-        theta = torch.norm(x, dim=dim, keepdim=True)  #vector magintudes
+        theta = torch.norm(x, dim=dim, keepdim=True)  #vector magnitudes
         v = x / theta  #unit vectors
-        ks = np.arange(-kmax, kmax + 1)
-        zs = np.meshgrid(
-            *(ks for _ in range(1)))  #construct equivalent elements
-        zs = np.stack([z.flatten() for z in zs
-                      ]).T * 2 * np.pi  #need to add multiples of 2pi
-        zs = torch.tensor(zs, dtype=torch.get_default_dtype()).to(theta.device)
-        theta = theta + zs[:, None, None, None,
-                           ...]  # (nk, n_b, n_samples, m, 1)
+        kmax = shell_kmax(theta, kmax, 2 * np.pi, scale=scale)
+        #equivalent elements are shifted by multiples of 2pi
+        zs = torch.arange(-kmax, kmax + 1).to(theta.device) * 2 * np.pi
+        zs = zs.to(theta.dtype).reshape((-1,) + (1,) * theta.dim())
+        theta = theta + zs  # (nk, n_b, n_samples, m, 1)
         x = theta * v
 
         # |J|->1 as phi -> 0; cap at 1e-5 for numerical stability
@@ -117,7 +125,10 @@ class S3(Manifold):
         # |J^(-1)| = phi^2/(2 - 2*cos(phi)) = 2|x|^2/(1-cos(2|x|))
         ljac = torch.log(l0) - torch.log(l1)
 
-        lp = torch.logsumexp(log_base_prob(x) + ljac[..., 0], dim=0)
+        lp = log_base_prob(x)
+        if diagonal:  #sum over per-dimension log densities
+            lp = lp.sum(-1)
+        lp = torch.logsumexp(lp + ljac[..., 0], dim=0)
         return lp
 
     @staticmethod
@@ -128,6 +139,6 @@ class S3(Manifold):
             ell = torch.ones(1, 1, 1)
 
         z = x.transpose(-1, -2).matmul(y)
-        res = 2 * (1 - z) / ell**2
+        res = z.neg_().add_(1).div(ell**2 / 2)
         res.clamp_min_(0)
         return res
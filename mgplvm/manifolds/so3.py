@@ -5,9 +5,10 @@ import torch
 from torch import Tensor
 import torch.nn as nn
 import torch.nn.functional as F
-from .base import Manifold
+from .base import Manifold, shell_kmax
 from typing import Tuple, Optional, List
 from ..inducing_variables import InducingPoints
+from ..utils import Noise, default_noise
 from sklearn import decomposition
 
 
@@ -86,15 +87,17 @@ class So3(Manifold):
         return x / norms
 
     @staticmethod
-    def expmap(x: Tensor, dim: int = -1, jitter=1e-8) -> Tensor:
+    def expmap(x: Tensor,
+               dim: int = -1,
+               jitter=1e-8,
+               noise: Optional[Noise] = None) -> Tensor:
         '''
         x \\in R^3 -> q \\in R^4 s.t. ||q|| = 1
         '''
-        x = x + (jitter * torch.randn(x.shape)).to(x.device)  #avoid nans
-        theta = torch.norm(x, dim=dim, keepdim=True)
-        v = x / theta
-        y = torch.cat((torch.cos(theta), torch.sin(theta) * v), dim=dim)
-        return y  # , theta, v
+        noise = default_noise if noise is None else noise
+        eps = noise.randn(x.shape, x.device, x.dtype)
+        x = x + jitter * eps  #avoid nans
+        return quaternion.exp(x, dim)
 
     @staticmethod
     def expmap2(x: Tensor, dim: int = -1) -> Tensor:
@@ -107,10 +110,8 @@ class So3(Manifold):
         '''
         #make first index positive as convention -- this gives theta \in [0, pi] and u on the hemisphere
         q = torch.sign(q[..., :1]) * q
-        a = q[..., :1]
-        theta = 2 * torch.acos(a)  #magnitude of rotation; ||x|| = theta/2
-        u = q[..., 1:] / torch.norm(q[..., 1:], dim=dim, keepdim=True)
-        return 0.5 * theta * u
+        #magnitude of rotation is 2||x||
+        return quaternion.log(q)
 
     @staticmethod
     def inverse(q: Tensor) -> Tensor:
@@ -121,19 +122,31 @@ class So3(Manifold):
         return quaternion.product(x, y)
 
     @staticmethod
-    def log_q(log_base_prob, x, d, kmax, dim=-1):
+    def inverse_gmul(x: Tensor, y: Tensor) -> Tensor:
+        return quaternion.conj_product(x, y)
+
+    @staticmethod
+    def log_q(log_base_prob,
+              x,
+              d,
+              kmax,
+              scale=None,
+              diagonal: bool = False,
+              dim=-1):
         '''
         phi = |x|/2
+        if scale (marginal standard deviations of the base distribution) is
+        provided, only shells within 8 standard deviations are summed (see shell_kmax)
+        if diagonal, log_base_prob returns per-dimension log densities (... x d)
         '''
 
-        theta = torch.norm(x, dim=dim, keepdim=True)
-        v = x / theta
-        ks = np.arange(-kmax, kmax + 1)
-        zs = np.meshgrid(*(ks for _ in range(1)))
-        zs = np.stack([z.flatten() for z in zs]).T * np.pi
-        zs = torch.tensor(zs, dtype=torch.get_default_dtype()).to(theta.device)
-        theta = theta + zs[:, None, None, None,
-                           ...]  # (nk, n_b, n_samples, m, 1)
+        theta = torch.norm(x, dim=dim, keepdim=True)  #vector magnitudes
+        v = x / theta  #unit vectors
+        kmax = shell_kmax(theta, kmax, np.pi, scale=scale)
+        #equivalent elements are shifted by multiples of pi
+        zs = torch.arange(-kmax, kmax + 1).to(theta.device) * np.pi
+        zs = zs.to(theta.dtype).reshape((-1,) + (1,) * theta.dim())
+        theta = theta + zs  # (nk, n_b, n_samples, m, 1)
         x = theta * v
 
         # |J|->1 as phi -> 0; cap at 1e-5 for numerical stability
@@ -143,7 +156,10 @@ class So3(Manifold):
         # |J^(-1)| = phi^2/(2 - 2*cos(phi))
         ljac = torch.log(l0) - torch.log(l1)
 
-        lp = torch.logsumexp(log_base_prob(x) + ljac[..., 0], dim=0)
+        lp = log_base_prob(x)
+        if diagonal:  #sum over per-dimension log densities
+            lp = lp.sum(-1)
+        lp = torch.logsumexp(lp + ljac[..., 0], dim=0)
         return lp
 
     @staticmethod
@@ -155,6 +171,6 @@ class So3(Manifold):
             ell = torch.ones(1, 1, 1)
 
         z = x.transpose(-1, -2).matmul(y)  # (..., n, m, m)
-        res = 4 * (1 - z.square()) / ell**2
+        res = z.square().neg_().add_(1).div(ell**2 / 4)
         res.clamp_min_(0)
         return res
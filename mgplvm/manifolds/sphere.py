@@ -0,0 +1,184 @@
+import numpy as np
+import torch
+from torch import Tensor
+import torch.nn.functional as F
+from scipy import special
+from .base import Manifold, shell_kmax
+from ..inducing_variables import InducingPoints
+from typing import Optional
+from ..utils import Noise
+from sklearn import decomposition
+
+
+class Sphere(Manifold):
+
+    def __init__(self, m: int, d: int):
+        """
+        Parameters
+        ----------
+        m : int
+            number of conditions/timepoints
+        d : int
+            latent dimensionality (S^d is embedded in R^(d+1))
+
+        Notes
+        -----
+        Spheres other than S^1 and S^3 are not groups. Tangent vectors live at
+        the pole e_0 = (1, 0, ..., 0), and gmul(x, y) moves y with the
+        reflection H_x that swaps e_0 and x. H_x is an isometry and its own
+        inverse, so inverse(x) = x, and the wrapped densities and kernels used by
+        the variational distributions and priors are unchanged.
+        """
+        super().__init__(d)
+        self.m = m
+        self.d2 = d + 1  # dimensionality of the embedding space
+
+        # per condition (negative log surface area)
+        self.lprior_const = torch.tensor(
+            special.loggamma((d + 1) / 2) - np.log(2) -
+            (d + 1) / 2 * np.log(np.pi))
+
+    @staticmethod
+    def initialize(initialization, n_samples, m, d, Y):
+        '''initializes latents - can add more exciting initializations as well'''
+        if initialization in ['fa', 'FA']:
+            #Y is n_samples x n x m; reduce to n_samples x m x (d+1)
+            if Y is None:
+                print('user must provide data for FA initialization')
+            else:
+                n = Y.shape[1]
+                pca = decomposition.FactorAnalysis(n_components=d + 1)
+                Y = Y.transpose(0, 2, 1).reshape(n_samples * m, n)
+                mudata = pca.fit_transform(Y)  #m*n_samples x (d+1)
+                mudata = torch.tensor(mudata.reshape(n_samples, m, d + 1),
+                                      dtype=torch.get_default_dtype())
+                return Sphere.parameterise(mudata)
+        elif initialization in ['random', 'Random']:
+            mudata = Sphere.expmap(torch.randn(n_samples, m, d) * 0.1)
+            return mudata
+        else:
+            print('initialization not recognized')
+        return
+
+    def parameterise_inducing(self, x):
+        return F.normalize(x, dim=-2)
+
+    def inducing_points(self, n, n_z, z=None):
+        if z is None:
+            z = torch.randn(n, self.d2, n_z)
+            z = z / torch.norm(z, dim=1, keepdim=True)
+
+        return InducingPoints(n,
+                              self.d2,
+                              n_z,
+                              z=z,
+                              parameterise=self.parameterise_inducing)
+
+    @property
+    def name(self):
+        return 'Sphere(' + str(self.d) + ')'
+
+    def lprior(self, g):
+        return self.lprior_const * torch.ones(g.shape[:-1])
+
+    @staticmethod
+    def parameterise(x) -> Tensor:
+        return F.normalize(x, dim=-1)
+
+    @staticmethod
+    def expmap(x: Tensor, noise: Optional[Noise] = None) -> Tensor:
+        '''
+        x \\in R^d -> (cos|x|, sin|x| x/|x|) \\in S^d
+        '''
+        theta = torch.linalg.vector_norm(x, dim=-1, keepdim=True)
+        #sin(theta)/theta without a singularity at theta = 0
+        return torch.cat((torch.cos(theta), torch.sinc(theta / np.pi) * x),
+                         dim=-1)
+
+    @staticmethod
+    def logmap(y: Tensor) -> Tensor:
+        '''
+        y \\in S^d -> x \\in R^d with |x| = theta \\in [0, pi]
+        '''
+        v = y[..., 1:]
+        theta = torch.atan2(torch.linalg.vector_norm(v, dim=-1, keepdim=True),
+                            y[..., :1])
+        #theta/sin(theta) = theta/|v| on the sphere
+        return v / torch.sinc(theta / np.pi)
+
+    @staticmethod
+    def inverse(x: Tensor) -> Tensor:
+        return x
+
+    @staticmethod
+    def gmul(x: Tensor, y: Tensor) -> Tensor:
+        '''
+        reflect y in the hyperplane orthogonal to u = e_0 - x
+        H_x y = y - 2 u (u.y) / |u|^2
+        '''
+        u = -x
+        u[..., 0] = u[..., 0] + 1
+        usq = torch.square(u).sum(-1, keepdim=True).clamp_min(1e-16)
+        uy = (u * y).sum(-1, keepdim=True)
+        return y - (2 * uy / usq) * u
+
+    @staticmethod
+    def log_q(log_base_prob,
+              x,
+              d,
+              kmax,
+              scale: Optional[Tensor] = None,
+              diagonal: bool = False):
+        '''
+        log density of the pushforward of the base distribution through expmap
+
+        The preimages of expmap(x) lie on the line through x and are shifted by
+        multiples of 2pi, so the cost grows with the number of shells (not
+        with a grid in d dimensions). If scale (marginal standard deviations of
+        the base distribution) is provided, only shells within 8 standard
+        deviations are summed (see shell_kmax).
+        If diagonal, log_base_prob returns per-dimension log densities (... x d).
+        '''
+        theta = torch.linalg.vector_norm(x, dim=-1, keepdim=True)
+        v = x / theta  #unit vectors
+        kmax = shell_kmax(theta, kmax, 2 * np.pi, scale=scale)
+        zs = torch.arange(-kmax, kmax + 1).to(theta.device) * 2 * np.pi
+        zs = zs.to(theta.dtype).reshape((-1,) + (1,) * theta.dim())
+        theta = theta + zs  # (nk, n_b, n_samples, m, 1)
+        x = theta * v
+
+        # |J^(-1)| = |theta/sin(theta)|^(d-1); cap at 1e-5 for numerical stability
+        ljac = -(d - 1) * torch.log(torch.abs(torch.sinc(theta / np.pi)) + 1e-5)
+
+        lp = log_base_prob(x)
+        if diagonal:  #sum over per-dimension log densities
+            lp = lp.sum(-1)
+        lp = torch.logsumexp(lp + ljac[..., 0], dim=0)
+        return lp
+
+    @staticmethod
+    def distance(x: Tensor, y: Tensor, ell: Optional[Tensor] = None) -> Tensor:
+        """
+        squared chordal distance |x - y|^2 = 2 - 2 (x dot y)
+        x, y: (..., n x d+1 x m)
+
+        The chordal distance is a monotonic function of the geodesic distance
+        (see geodesic) and, unlike the geodesic distance, gives a positive
+        definite quadratic exponential kernel on S^d.
+        """
+        if ell is None:
+            ell = torch.ones(1, 1, 1)
+
+        z = x.transpose(-1, -2).matmul(y)  # (..., n, m, m)
+        res = z.neg_().add_(1).div(ell**2 / 2)
+        res.clamp_min_(0)
+        return res
+
+    @staticmethod
+    def geodesic(x: Tensor, y: Tensor) -> Tensor:
+        """
+        great-circle distance acos(x dot y)
+        x, y: (..., n x d+1 x m)
+        """
+        z = x.transpose(-1, -2).matmul(y)  # (..., n, m, m)
+        return torch.acos(z.clamp(-1, 1))
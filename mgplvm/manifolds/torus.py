@@ -2,9 +2,11 @@ import numpy as np
 import torch
 import torch.nn as nn
 from torch import Tensor
+from torch.utils.checkpoint import checkpoint
 from .base import Manifold
 from ..inducing_variables import InducingPoints
-from typing import Optional
+from typing import Optional, List
+from ..utils import Noise
 from sklearn import decomposition
 
 
@@ -72,7 +74,7 @@ class Torus(Manifold):
         return x
 
     @staticmethod
-    def expmap(x: Tensor) -> Tensor:
+    def expmap(x: Tensor, noise: Optional[Noise] = None) -> Tensor:
         '''move to [-pi, pi]'''
         return (x + np.pi) % (2 * np.pi) - np.pi
 
@@ -82,16 +84,110 @@ class Torus(Manifold):
         return (x + np.pi) % (2 * np.pi) - np.pi
 
     @staticmethod
-    def log_q(log_base_prob, x, d, kmax):
-        """ log of the variational distribution (~-H(Q))"""
-        ks = np.arange(-kmax, kmax + 1)
-        zs = np.meshgrid(*(ks for _ in range(d)))
-        zs = np.stack([z.flatten() for z in zs]).T * 2. * np.pi
-        zs = torch.tensor(zs, dtype=torch.get_default_dtype())
-        zs = zs.to(x.device)  # meshgrid shape (2kmax+1)^n
-        y = x + zs[:, None, None, None,
-                   ...]  # meshgrid x n_b x n_samples, m x d
-        lp = torch.logsumexp(log_base_prob(y), dim=0)  # n_b x n_samples, m
+    def wrap_kmax(x: Tensor,
+                  d: int,
+                  kmax: int,
+                  scale: Optional[Tensor] = None,
+                  n_std: float = 8.) -> List[int]:
+        """
+        number of wrapped copies needed in each dimension
+
+        Parameters
+        ----------
+        x : Tensor
+            points in the tangent space (... x d)
+        d : int
+            dimensionality
+        kmax : int
+            maximum number of copies on either side
+        scale : Optional[Tensor]
+            marginal standard deviations of the base distribution (... x d)
+        n_std : float
+            copies further than n_std standard deviations beyond the nearest
+            copy are dropped; their relative contribution is below
+            exp(-n_std^2/2) each
+
+        Returns
+        -------
+        kmaxs : List[int]
+            number of copies on either side for each dimension
+        """
+        if scale is None:
+            return [kmax for _ in range(d)]
+        #distance of the nearest copy from the origin
+        r0 = torch.abs(Torus.expmap(x))
+        #a copy 2*pi*k contributes if 2*pi*|k| - |x| < r0 + n_std * scale
+        reach = (torch.abs(x) + r0 + n_std * scale).reshape(-1, d).amax(0)
+        ks = torch.floor(reach / (2 * np.pi)).long().clamp(max=kmax)
+        return ks.tolist()
+
+    @staticmethod
+    def log_q(log_base_prob,
+              x,
+              d,
+              kmax,
+              scale: Optional[Tensor] = None,
+              diagonal: bool = False,
+              chunk_size: int = 64):
+        """
+        log of the variational distribution (~-H(Q))
+
+        Parameters
+        ----------
+        log_base_prob : Callable
+            log density of the base distribution in the tangent space
+        x : Tensor
+            points in the tangent space (... x d)
+        d : int
+            dimensionality
+        kmax : int
+            maximum number of copies on either side in each dimension
+        scale : Optional[Tensor]
+            marginal standard deviations of the base distribution (... x d)
+            used to truncate the number of copies (see wrap_kmax)
+        diagonal : bool
+            if True, log_base_prob returns per-dimension log densities (... x d)
+            and the wrapped sums are computed separately for each dimension
+            with (2kmax+1)d rather than (2kmax+1)^d evaluations
+        chunk_size : int
+            number of copies evaluated at a time; each chunk is recomputed in
+            the backward pass so that memory is bounded by chunk_size copies
+
+        Returns
+        -------
+        lp : Tensor
+            log density (...)
+        """
+        kmaxs = Torus.wrap_kmax(x, d, kmax, scale=scale)
+        if diagonal:
+            k = max(kmaxs)
+            zs = torch.arange(-k, k + 1).to(x.device) * 2. * np.pi
+            zs = zs.to(x.dtype).reshape((-1,) + (1,) * x.dim())
+            lp = torch.logsumexp(log_base_prob(x + zs), dim=0)  #(... x d)
+            return lp.sum(-1)
+
+        grids = np.meshgrid(*(np.arange(-k, k + 1) for k in kmaxs))
+        zs = torch.tensor(np.stack([g.flatten() for g in grids]).T * 2. * np.pi,
+                          dtype=x.dtype)
+        zs = zs.to(x.device)  # meshgrid shape prod(2kmax+1) x d
+        zs = zs.reshape((-1,) + (1,) * (x.dim() - 1) + (d,))
+
+        def chunk_lp(x, zs):
+            return torch.logsumexp(log_base_prob(x + zs), dim=0)
+
+        def lp_copies(i):
+            if torch.is_grad_enabled() and zs.shape[0] > chunk_size:
+                #recompute the copies in the backward pass
+                return checkpoint(chunk_lp,
+                                  x,
+                                  zs[i:i + chunk_size],
+                                  use_reentrant=False)
+            return chunk_lp(x, zs[i:i + chunk_size])
+
+        #running logsumexp over chunks of copies
+        lp = lp_copies(0)
+        for i in range(chunk_size, zs.shape[0], chunk_size):
+            lp = torch.logaddexp(lp, lp_copies(i))
         return lp
 
     @staticmethod
@@ -121,6 +217,8 @@ class Torus(Manifold):
         const = d * ell.square().reciprocal().mean(
             -2)  # (1/n x 1/d x 1) -> (1/n x 1)
 
-        res = 2 * (const[..., None] - z1_.transpose(-1, -2).matmul(z2_))
+        #2 * (const - z1_^T z2_) computed in place
+        res = z1_.transpose(-1, -2).matmul(z2_)
+        res = res.neg_().add_(const[..., None]).mul_(2)
         res.clamp_min_(0)
         return res
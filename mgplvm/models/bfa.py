@@ -134,8 +134,49 @@ class Bfa(GpBase):
         return dist
 
     def log_prob(self, y, x):
-        """compute prior p(y) = N(y|0, X^T X)"""
-        lp = self._dist(x).log_prob(y)  #(n_mc x n_samples x n)
+        """
+        compute prior p(y) = N(y|0, X^T X + sigma^2 I)
+
+        Parameters
+        ----------
+        y : Tensor
+            data tensor with dimensions (n_samples x n x m)
+        x : Tensor
+            latents with dimensions ((n_mc) x n_samples x d x m)
+
+        Returns
+        -------
+        lp : Tensor
+            log marginal likelihood ((n_mc) x n_samples x n)
+
+        Notes
+        -----
+        The covariance of neuron i is sigma_i^2 (I_m + a_i X^T X) with
+        a_i = s_i^2 / sigma_i^2, where s_i is the neuron scale. With the
+        Woodbury identity and the matrix determinant lemma, all neurons share
+        G = X X^T (d x d), and only the d x d matrices M_i = I_d + a_i G are
+        factorised:
+        log|C_i| = m log sigma_i^2 + log|M_i| and
+        y_i^T C_i^-1 y_i = (y_i^T y_i - a_i b_i^T M_i^-1 b_i) / sigma_i^2
+        with b_i = X y_i.
+        """
+        m, d = x.shape[-1], x.shape[-2]
+        x = self.scale * self.dim_scale * x  #((n_mc) x n_samples x d x m)
+        variance = self.prms  #(n)
+        a = torch.square(self.neuron_scale[:, 0]) / variance  #(n)
+
+        G = x.matmul(x.transpose(-1, -2))  #((n_mc) x n_samples x d x d)
+        b = y.matmul(x.transpose(-1, -2))  #((n_mc) x n_samples x n x d)
+        M = a[:, None, None] * G[..., None, :, :] + torch.eye(d).to(
+            x.device)  #((n_mc) x n_samples x n x d x d)
+        L = torch.linalg.cholesky(M)
+        Lb = torch.linalg.solve_triangular(L, b[..., None], upper=False)[..., 0]
+
+        logdet = m * torch.log(variance) + 2 * torch.log(
+            torch.diagonal(L, dim1=-1, dim2=-2)).sum(-1)
+        quad = (torch.square(y).sum(-1) -
+                a * torch.square(Lb).sum(-1)) / variance
+        lp = -0.5 * (m * log2pi + logdet + quad)  #((n_mc) x n_samples x n)
         return lp
 
     def elbo(self,
@@ -329,6 +370,11 @@ class Bvfa(GpBase):
         self._q_mu = nn.Parameter(q_mu, requires_grad=True)
         self._q_sqrt = nn.Parameter(q_sqrt, requires_grad=True)
 
+        #prior over the scaled loadings is N(0, I) unless replaced by a
+        #previous posterior (see posterior_as_prior)
+        self.register_buffer('prior_mu', None)
+        self.register_buffer('prior_sqrt', None)
+
         self.likelihood = likelihood
 
     @property
@@ -353,18 +399,59 @@ class Bvfa(GpBase):
 
     def prior_kl(self, sample_idxs=None):
         """
-        KL(p(f) || q(f))
+        KL(q(f) || p(f)) with p(f) = N(prior_mu, prior_sqrt prior_sqrt^T) for
+        each neuron (N(0, I) by default)
+        (1 x n) if tied_samples otherwise (n_samples x n)
         """
         q_mu, q_sqrt = self.prms
         assert (q_mu.shape[0] == q_sqrt.shape[0])
         if not self.tied_samples and sample_idxs is not None:
             q_mu = q_mu[sample_idxs]
             q_sqrt = q_sqrt[sample_idxs]
-        q = MultivariateNormal(q_mu, scale_tril=q_sqrt)
-        e = torch.eye(self.d).to(q_mu.device)
-        p_mu = torch.zeros(self.n, self.d).to(q_mu.device)
-        prior = MultivariateNormal(p_mu, scale_tril=e)
-        return kl_divergence(q, prior)  ##consider implementing this directly
+
+        LogTerm = 2 * torch.log(torch.diagonal(q_sqrt, dim1=-1,
+                                               dim2=-2)).sum(-1)
+        if self.prior_mu is not None:  #whiten with respect to the prior
+            q_sqrt = torch.linalg.solve_triangular(self.prior_sqrt,
+                                                   q_sqrt,
+                                                   upper=False)
+            q_mu = torch.linalg.solve_triangular(self.prior_sqrt,
+                                                 (q_mu - self.prior_mu)[...,
+                                                                        None],
+                                                 upper=False)[..., 0]
+            LogTerm = LogTerm - 2 * torch.log(
+                torch.diagonal(self.prior_sqrt, dim1=-1, dim2=-2)).sum(-1)
+
+        TrTerm = torch.square(q_sqrt).sum((-1, -2))
+        MeanTerm = torch.square(q_mu).sum(-1)
+        return 0.5 * (TrTerm + MeanTerm - self.d - LogTerm)
+
+    def posterior_as_prior(self):
+        """
+        Use the current posterior over the loadings as the prior for new data.
+        This is the streaming variational Bayes update: fitting the model to a
+        new chunk of data then approximates the posterior given all chunks,
+        at a cost that only depends on the new data.
+        """
+        if not self.tied_samples:
+            raise Exception(
+                "posterior_as_prior requires loadings shared across samples (tied_samples=True)"
+            )
+        q_mu, q_sqrt = self.prms
+        self.prior_mu = q_mu.detach().clone()  #(1 x n x d)
+        self.prior_sqrt = q_sqrt.detach().clone()  #(1 x n x d x d)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        #the prior buffers are only present after posterior_as_prior, so
+        #take them from the state dict whenever it has them
+        for name in ['prior_mu', 'prior_sqrt']:
+            value = state_dict.get(prefix + name)
+            if value is None:
+                setattr(self, name, None)
+            elif getattr(self, name) is None:
+                setattr(self, name, torch.empty(value.shape).to(self._q_mu))
+        super(Bvfa, self)._load_from_state_dict(state_dict, prefix, *args,
+                                                **kwargs)
 
     def elbo(self,
              y: Tensor,
@@ -414,6 +501,73 @@ class Bvfa(GpBase):
         lik = lik * scale
         return lik, prior_kl
 
+    def elbo_moments(self,
+                     y: Tensor,
+                     x_mu: Tensor,
+                     x_cov: Tensor,
+                     sample_idxs: Optional[List[int]] = None,
+                     m: Optional[int] = None) -> Tuple[Tensor, Tensor]:
+        """
+        Parameters
+        ----------
+        y : Tensor
+            data tensor with dimensions (n_samples x n x m)
+        x_mu : Tensor
+            means of the latents with dimensions (n_samples x d x m)
+        x_cov : Tensor
+            covariances of the latents with dimensions (n_samples x m x d x d)
+        m : Optional int
+            used to scale the likelihood (see elbo)
+
+        Returns
+        -------
+        lik, prior_kl : Tuple[torch.Tensor, torch.Tensor]
+            lik has dimensions (n)
+            prior_kl has dimensions (n)
+
+        Notes
+        -----
+        f = w^T x with independent w ~ q(w) = N(mu, L L^T) and x ~ N(x_mu, x_cov)
+        has mean mu^T x_mu and variance
+        mu^T x_cov mu + |L^T x_mu|^2 + tr(L L^T x_cov).
+        The expected Gaussian log likelihood only depends on these two moments,
+        so for Gaussian likelihoods this is the exact expectation of elbo under
+        the latent distribution, without Monte Carlo samples of x.
+        """
+        if self.likelihood.name != "Gaussian":
+            raise Exception(
+                "elbo_moments is only exact for Gaussian likelihoods")
+        batch_size = x_mu.shape[-1]
+        sample_size = x_mu.shape[-3]
+
+        prior_kl = self.prior_kl(sample_idxs).sum(-2)
+        if not self.tied_samples:
+            prior_kl = prior_kl * (self.n_samples / sample_size)
+
+        q_mu, q_sqrt = self.prms
+        if (not self.tied_samples) and sample_idxs is not None:
+            q_mu = q_mu[sample_idxs]
+            q_sqrt = q_sqrt[sample_idxs]
+
+        a = self.scale * self.dim_scale  #prior scale of each dimension (d x 1)
+        x_mu = a * x_mu  #(n_samples x d x m)
+        x_cov = a[..., 0] * x_cov * a[..., 0, None]  #(n_samples x m x d x d)
+
+        f_mean = q_mu.matmul(x_mu)  #(n_samples x n x m)
+        l = x_mu[..., None, :, :].transpose(-1, -2).matmul(
+            q_sqrt)  #(n_samples x n x m x d)
+        qcov = q_sqrt.matmul(q_sqrt.transpose(-1, -2))  #(... x n x d x d)
+        f_var = torch.square(l).sum(-1) + torch.einsum(
+            '...nd,...mde,...ne->...nm', q_mu, x_cov, q_mu) + torch.einsum(
+                '...nde,...mde->...nm', qcov, x_cov)
+
+        lik = self.likelihood.variational_expectation(y, f_mean[None, ...],
+                                                      f_var[None, ...])[0]
+        m = (self.m if m is None else m)
+        scale = (m / batch_size) * (self.n_samples / sample_size)
+        lik = lik.sum(-2) * scale  #(n)
+        return lik, prior_kl
+
     def sample(self,
                query: Tensor,
                n_mc: int = 1000,
@@ -8,12 +8,15 @@ from torch import nn, Tensor
 from torch.distributions.multivariate_normal import MultivariateNormal
 import torch.nn.functional as F
 import pickle
+import copy
+import itertools
 from .. import lpriors
 from ..inducing_variables import InducingPoints
 from ..kernels import Kernel
 from ..likelihoods import Likelihood
 from ..lpriors.common import Lprior
 from ..rdist import Rdist
+from typing import Optional
 
 
 class Gplvm(nn.Module):
@@ -57,7 +60,8 @@ class Gplvm(nn.Module):
              sample_idxs=None,
              neuron_idxs=None,
              m=None,
-             analytic_kl=False):
+             analytic_kl=False,
+             analytic_lik=False):
         """
         Parameters
         ----------
@@ -82,6 +86,12 @@ class Gplvm(nn.Module):
             If not provided, self.m is used which is provided at initialization.
             This parameter is useful if we subsample data but want to weight the prior as if it was the full dataset.
             We use this e.g. in crossvalidation
+        analytic_lik : bool
+            if True, the expected log likelihood is computed exactly from the
+            means and covariances of q(x) (lat_dist.moments) with obs.elbo_moments
+            instead of from Monte Carlo samples of x. This requires a Gaussian
+            variational distribution with an analytic KL and an observation model
+            with a Gaussian likelihood (e.g. Bvfa)
 
         Returns
         -------
@@ -99,7 +109,8 @@ class Gplvm(nn.Module):
         n_samples, n = self.n_samples, self.n
         m = (self.m if m is None else m)
 
-        g, lq = self.lat_dist.sample(torch.Size([n_mc]),
+        #only the KL is needed from lat_dist.sample if analytic_lik
+        g, lq = self.lat_dist.sample(torch.Size([1 if analytic_lik else n_mc]),
                                      data,
                                      batch_idxs=batch_idxs,
                                      sample_idxs=sample_idxs,
@@ -112,19 +123,39 @@ class Gplvm(nn.Module):
         #data = data if sample_idxs is None else data[..., sample_idxs, :, :]
         #data = data if batch_idxs is None else data[..., batch_idxs]
 
-        # note that [ obs.elbo ] recognizes inputs of dims (n_mc x d x m)
-        # and so we need to permute [ g ] to have the right dimensions
-        #(n_mc x n), (1 x n)
-        svgp_lik, svgp_kl = self.obs.elbo(data,
-                                          g.transpose(-1, -2),
-                                          sample_idxs,
-                                          m=m)  #p(Y|g)
+        if analytic_lik:
+            #(n_samples x m x d), (n_samples x m x d x d)
+            x_mu, x_cov = self.lat_dist.moments(batch_idxs=batch_idxs,
+                                                sample_idxs=sample_idxs)
+            #(n), (n)
+            svgp_lik, svgp_kl = self.obs.elbo_moments(data,
+                                                      x_mu.transpose(-1, -2),
+                                                      x_cov,
+                                                      sample_idxs,
+                                                      m=m)
+            svgp_lik = svgp_lik.expand(n_mc, svgp_lik.shape[-1])  #(n_mc x n)
+        else:
+            # note that [ obs.elbo ] recognizes inputs of dims (n_mc x d x m)
+            # and so we need to permute [ g ] to have the right dimensions
+            #(n_mc x n), (1 x n)
+            svgp_lik, svgp_kl = self.obs.elbo(data,
+                                              g.transpose(-1, -2),
+                                              sample_idxs,
+                                              m=m)  #p(Y|g)
         if neuron_idxs is not None:
             svgp_lik = svgp_lik[..., neuron_idxs]
             svgp_kl = svgp_kl[..., neuron_idxs]
         lik = svgp_lik - svgp_kl
 
-        if analytic_kl or ('GP' in self.lat_dist.name):
+        #GP and LDS (with a DS prior) variational distributions return the KL
+        analytic = ('GP'
+                    in self.lat_dist.name) or (self.lat_dist.name == 'LDS' and
+                                               self.lprior.name == 'DS')
+        if analytic_lik and not analytic:
+            raise Exception(
+                "analytic_lik requires a variational distribution with an analytic KL"
+            )
+        if analytic_kl or analytic:
             #print('analytic KL')
             #kl per MC sample; lq already represents the full KL
             kl = (torch.ones(n_mc).to(data.device)) * lq.sum()
@@ -150,7 +181,8 @@ class Gplvm(nn.Module):
                 sample_idxs=None,
                 neuron_idxs=None,
                 m=None,
-                analytic_kl=False):
+                analytic_kl=False,
+                analytic_lik=False):
         """
         Parameters
         ----------
@@ -175,6 +207,8 @@ class Gplvm(nn.Module):
             If not provided, self.m is used which is provided at initialization.
             This parameter is useful if we subsample data but want to weight the prior as if it was the full dataset.
             We use this e.g. in crossvalidation
+        analytic_lik : bool
+            compute the expected log likelihood from the moments of q(x) (see elbo)
 
         Returns
         -------
@@ -190,7 +224,8 @@ class Gplvm(nn.Module):
                             sample_idxs=sample_idxs,
                             neuron_idxs=neuron_idxs,
                             m=m,
-                            analytic_kl=analytic_kl)
+                            analytic_kl=analytic_kl,
+                            analytic_lik=analytic_lik)
         #sum over neurons and mean over  MC samples
         lik = lik.sum(-1).mean()
         kl = kl.mean()
@@ -229,3 +264,117 @@ class Gplvm(nn.Module):
         LL = (torch.logsumexp(LLs, 0) - np.log(n_mc)) / np.prod(data.shape)
 
         return LL.detach().cpu()
+
+    def infer_latents(self,
+                      Y: Tensor,
+                      lat_dist: Optional[Rdist] = None,
+                      n_mc: int = 32,
+                      max_steps: int = 100,
+                      lrate: float = 1.,
+                      seed: int = 0,
+                      analytic_kl: bool = False) -> Rdist:
+        """
+        Infer the latents of new trials with the observation model and the
+        prior over latents kept fixed.
+
+        Parameters
+        ----------
+        Y : Tensor
+            data of the new trials (n_samples x n x m)
+        lat_dist : Optional[Rdist]
+            variational distribution for the new trials, used as the starting
+            point of the optimization (e.g. the latents inferred for a previous
+            session). If None, a copy of the trained lat_dist is used
+            (this requires the new data to have the same shape).
+        n_mc : int
+            number of MC samples used to estimate the ELBO
+        max_steps : int
+            maximum number of L-BFGS iterations
+        lrate : float
+            learning rate of L-BFGS
+        seed : int
+            seed of the MC samples, which are kept fixed during the optimization
+        analytic_kl : bool
+            passed to elbo
+
+        Returns
+        -------
+        lat_dist : Rdist
+            variational distribution over the latents of the new trials
+
+        Notes
+        -----
+        Only the parameters of lat_dist are updated; GP variational
+        distributions take the prior length scales from the trained model.
+        For linear-Gaussian models (an Fa observation model with GP_diag or
+        GP_circ latents) the optimal latents are computed in closed form
+        (optimisers.em.e_step). Otherwise the ELBO is maximized with L-BFGS
+        over all trials at once, using the same MC samples in every evaluation
+        so that the objective is deterministic.
+        """
+        from ..optimisers.em import e_step  #optimisers import models
+        from .lgplvm import Lgplvm
+
+        n_samples, n, m = Y.shape
+        if lat_dist is None:
+            if (n_samples, m) != (self.n_samples, self.m):
+                raise Exception(
+                    "lat_dist must be provided for data with a different number of samples or conditions"
+                )
+            lat_dist = copy.deepcopy(self.lat_dist)
+        if ('GP' in lat_dist.name) and ('GP' in self.lat_dist.name):
+            lat_dist._ell.data = self.lat_dist._ell.data.clone()
+
+        #temporarily replace the latents and the size of the data
+        old = (self.lat_dist, self.n_samples, self.m)
+        old_obs = {k: getattr(self.obs, k, None) for k in ['n_samples', 'm']}
+        old_noise = getattr(lat_dist, 'noise', None)
+        requires_grad = [(p, p.requires_grad) for p in itertools.chain(
+            self.obs.parameters(), self.lprior.parameters())]
+        self.lat_dist, self.n_samples, self.m = lat_dist, n_samples, m
+        for k, v in old_obs.items():
+            if v is not None:
+                setattr(self.obs, k, {'n_samples': n_samples, 'm': m}[k])
+
+        try:
+            if isinstance(self, Lgplvm) and (self.obs.name == 'Fa') and (
+                    lat_dist.name in ['GP_diag', 'GP_circ']):
+                with torch.no_grad():
+                    e_step(Y, self)
+            else:
+                for p, _ in requires_grad:  #freeze obs and lprior
+                    p.requires_grad = False
+                params = [
+                    p for (name, p) in lat_dist.named_parameters()
+                    if p.requires_grad and name != '_ell'
+                ]
+                if old_noise is not None:  #fixed MC samples
+                    setattr(lat_dist, 'noise', utils.Noise(seed))
+                opt = torch.optim.LBFGS(params,
+                                        lr=lrate,
+                                        max_iter=max_steps,
+                                        line_search_fn='strong_wolfe')
+
+                def closure():
+                    opt.zero_grad()
+                    if old_noise is not None:
+                        lat_dist.noise.manual_seed(seed)
+                    svgp_elbo, kl = self.forward(Y,
+                                                 n_mc,
+                                                 analytic_kl=analytic_kl)
+                    loss = kl - svgp_elbo
+                    loss.backward()
+                    return loss
+
+                opt.step(closure)
+        finally:
+            for p, r in requires_grad:
+                p.requires_grad = r
+            if old_noise is not None:
+                lat_dist.noise = old_noise
+            self.lat_dist, self.n_samples, self.m = old
+            for k, v in old_obs.items():
+                if v is not None:
+                    setattr(self.obs, k, v)
+
+        return lat_dist
@@ -115,3 +115,31 @@ class Lvgplvm(Gplvm):
                       C=C)
 
         super().__init__(obs, lat_dist, lprior, n, m, n_samples)
+
+    def new_trials(self, m: int, n_samples: int, lat_dist: Rdist,
+                   lprior: Lprior):
+        """
+        Prepare the model for a new chunk of trials in a recording.
+        The current posterior over the loadings becomes their prior and the
+        latents of the new trials are inferred with lat_dist, so the model can
+        be kept up to date by fitting it to each new chunk (n_samples x n x m)
+        with svgp.fit instead of refitting all data.
+
+        Parameters
+        ----------
+        m : int
+            number of conditions/timepoints of the new trials
+        n_samples : int
+            number of new trials
+        lat_dist : Rdist
+            variational distribution over the latents of the new trials
+        lprior : Lprior
+            prior over the latents of the new trials
+        """
+        if self.obs.name != "Bvfa":
+            raise Exception(
+                "new_trials requires a Bayesian observation model (Bvfa)")
+        self.obs.posterior_as_prior()
+        self.obs.m, self.obs.n_samples = m, n_samples
+        self.m, self.n_samples = m, n_samples
+        self.lat_dist, self.lprior = lat_dist, lprior
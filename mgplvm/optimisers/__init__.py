@@ -1,2 +1,6 @@
 from .stopping_criterions import (LossMarginStop)
-from . import svgp
\ No newline at end of file
+from . import svgp, em, distributed, callbacks
+from .callbacks import (Callback, HeldOutElbo, PlateauStop, ReduceLROnPlateau,
+                        BestModel)
+from .em import fit_em
+from .distributed import fit_distributed
@@ -0,0 +1,353 @@
+import numpy as np
+import torch
+from torch import Tensor
+from .data import DataLoader
+from ..utils import Noise
+from typing import List, Optional
+
+
+class Callback():
+    '''
+    Base class of the callbacks of svgp.fit. The event methods return True
+    to stop training.
+
+    Events
+    ------
+    on_train_begin(model, opt, scheduler)
+        before the first iteration
+    on_step(model, i, loss)
+        after each optimizer step; loss is the (detached) loss of the step
+        (training stops at the end of the iteration)
+    on_epoch(model, i, loss)
+        after each iteration (a pass over the dataloader); loss is the
+        (detached) loss of the iteration
+    on_eval(model, i, elbo)
+        after a callback has evaluated the model (see evaluate)
+    on_train_end(model)
+        after the last iteration
+
+    Notes
+    -----
+    Losses are passed as tensors on the device of the model; calling .item()
+    waits for the device, so callbacks should only do so when they need
+    the value.
+    Callbacks with a state that changes during training return it in
+    state_dict, which is saved in the checkpoints of svgp.fit and restored
+    with load_state_dict when training is resumed.
+    '''
+
+    def on_train_begin(self, model, opt, scheduler) -> None:
+        pass
+
+    def on_step(self, model, i: int, loss: Tensor) -> bool:
+        return False
+
+    def on_epoch(self, model, i: int, loss: Tensor) -> bool:
+        return False
+
+    def evaluate(self, model, i: int) -> Optional[float]:
+        '''held-out ELBO to be passed to on_eval (None if not evaluated)'''
+        return None
+
+    def on_eval(self, model, i: int, elbo: float) -> bool:
+        return False
+
+    def on_train_end(self, model) -> None:
+        pass
+
+    def state_dict(self) -> dict:
+        return {}
+
+    def load_state_dict(self, state: dict) -> None:
+        pass
+
+
+class CallbackList(Callback):
+
+    def __init__(self, callbacks: List[Callback]):
+        '''dispatch the events of svgp.fit to a list of callbacks'''
+        self.callbacks = callbacks
+
+    def on_train_begin(self, model, opt, scheduler):
+        for cb in self.callbacks:
+            cb.on_train_begin(model, opt, scheduler)
+
+    def on_step(self, model, i, loss):
+        #every callback sees the event, even if an earlier one stops training
+        return any([bool(cb.on_step(model, i, loss)) for cb in self.callbacks])
+
+    def on_epoch(self, model, i, loss):
+        stop = any([bool(cb.on_epoch(model, i, loss)) for cb in self.callbacks])
+        for cb in self.callbacks:
+            elbo = cb.evaluate(model, i)
+            if elbo is not None:
+                stop = self.on_eval(model, i, elbo) or stop
+        return stop
+
+    def on_eval(self, model, i, elbo):
+        return any([bool(cb.on_eval(model, i, elbo)) for cb in self.callbacks])
+
+    def on_train_end(self, model):
+        for cb in self.callbacks:
+            cb.on_train_end(model)
+
+    def state_dict(self):
+        return {'callbacks': [cb.state_dict() for cb in self.callbacks]}
+
+    def load_state_dict(self, state):
+        if len(state['callbacks']) != len(self.callbacks):
+            raise Exception(
+                "the callbacks must be the same as when the checkpoint was saved"
+            )
+        for cb, cb_state in zip(self.callbacks, state['callbacks']):
+            cb.load_state_dict(cb_state)
+
+
+class StopCallback(Callback):
+
+    def __init__(self, stop):
+        '''
+        stop : Callable
+            stop(model, i, loss_val) returns True to stop training
+            (e.g. LossMarginStop)
+        '''
+        self.stop = stop
+
+    def on_epoch(self, model, i, loss):
+        return self.stop(model, i, loss.item())
+
+    #attributes of stopping criteria such as LossMarginStop
+    def state_dict(self):
+        return dict(getattr(self.stop, '__dict__', {}))
+
+    def load_state_dict(self, state):
+        for (k, v) in state.items():
+            setattr(self.stop, k, v)
+
+
+class HeldOutElbo(Callback):
+
+    def __init__(self,
+                 dataloader: DataLoader,
+                 every: int = 10,
+                 n_mc: int = 32,
+                 neuron_idxs: Optional[List[int]] = None,
+                 seed: int = 0):
+        '''
+        Parameters
+        ----------
+        dataloader : DataLoader
+            validation data
+        every : int
+            evaluate the ELBO every [every] iterations
+        n_mc : int
+            number of MC samples used to estimate the ELBO
+        neuron_idxs : Optional[List[int]]
+            only evaluate the ELBO of these neurons
+        seed : int
+            seed of the MC samples, which are the same in every evaluation
+
+        Notes
+        -----
+        The validation data is passed to the model with the sample and batch
+        indices of the dataloader, so it must consist of samples and
+        conditions of the model (e.g. held-out time points or neurons as in
+        crossval, selected with the batch_pool of a BatchDataLoader).
+        The ELBO per data point is stored in elbos.
+        '''
+        self.dataloader = dataloader
+        self.every = every
+        self.n_mc = n_mc
+        self.neuron_idxs = neuron_idxs
+        self.seed = seed
+        self.elbos: List[float] = []
+
+    def evaluate(self, model, i):
+        if i % self.every != 0:
+            return None
+        dataloader = self.dataloader
+        m = dataloader.batch_pool_size
+        n = dataloader.n if self.neuron_idxs is None else len(self.neuron_idxs)
+
+        #common random numbers
+        lat_dist = model.lat_dist
+        noise = getattr(lat_dist, 'noise', None)
+        if noise is not None:
+            lat_dist.noise = Noise(self.seed)
+        try:
+            with torch.no_grad():
+                elbo = torch.zeros(())
+                for sample_idxs, batch_idxs, batch in dataloader:
+                    weight = 1 if batch_idxs is None else len(batch_idxs) / m
+                    svgp_elbo, kl = model(batch,
+                                          self.n_mc,
+                                          batch_idxs=batch_idxs,
+                                          sample_idxs=sample_idxs,
+                                          neuron_idxs=self.neuron_idxs)
+                    elbo = elbo + weight * (svgp_elbo - kl)
+        finally:
+            if noise is not None:
+                lat_dist.noise = noise
+
+        self.elbos.append(elbo.item() / (n * m * model.n_samples))
+        return self.elbos[-1]
+
+    def state_dict(self):
+        return {'elbos': list(self.elbos)}
+
+    def load_state_dict(self, state):
+        self.elbos = list(state['elbos'])
+
+
+class _Monitor(Callback):
+
+    def __init__(self,
+                 monitor: str = 'loss',
+                 smoothing: float = 0.,
+                 patience: int = 10,
+                 rel_tol: float = 1e-4):
+        '''
+        Parameters
+        ----------
+        monitor : str
+            'loss' (training loss after every iteration) or 'elbo'
+            (held-out ELBO, see HeldOutElbo)
+        smoothing : float
+            the monitored value is smoothed with an exponential moving average
+            s = smoothing * s + (1 - smoothing) * value
+        patience : int
+            number of values without improvement tolerated
+        rel_tol : float
+            minimum relative improvement
+        '''
+        if monitor not in ['loss', 'elbo']:
+            raise Exception("monitor must be 'loss' or 'elbo'")
+        self.monitor = monitor
+        self.smoothing = smoothing
+        self.patience = patience
+        self.rel_tol = rel_tol
+        self.smoothed = None
+        self.best = None
+        self.wait = 0
+
+    def update(self, model, i, value) -> bool:
+        '''update with a value to be minimized and return True to stop'''
+        if self.smoothed is None:
+            self.smoothed = value
+        else:
+            self.smoothed = self.smoothing * self.smoothed + (
+                1 - self.smoothing) * value
+        if (self.best is None) or (self.smoothed < self.best -
+                                   self.rel_tol * np.abs(self.best)):
+            self.best = self.smoothed
+            self.wait = 0
+            return self.on_improvement(model, i)
+        self.wait += 1
+        return self.on_plateau(model, i)
+
+    def on_improvement(self, model, i) -> bool:
+        return False
+
+    def on_plateau(self, model, i) -> bool:
+        return False
+
+    def on_epoch(self, model, i, loss):
+        if self.monitor == 'loss':
+            return self.update(model, i, loss.item())
+        return False
+
+    def on_eval(self, model, i, elbo):
+        if self.monitor == 'elbo':
+            return self.update(model, i, -elbo)
+        return False
+
+    def state_dict(self):
+        return {'smoothed': self.smoothed, 'best': self.best, 'wait': self.wait}
+
+    def load_state_dict(self, state):
+        self.smoothed = state['smoothed']
+        self.best = state['best']
+        self.wait = state['wait']
+
+
+class PlateauStop(_Monitor):
+    '''
+    stop training when the smoothed training loss or held-out ELBO has not
+    improved by rel_tol for [patience] iterations or evaluations
+    '''
+
+    def on_plateau(self, model, i):
+        return self.wait >= self.patience
+
+
+class ReduceLROnPlateau(_Monitor):
+
+    def __init__(self,
+                 monitor: str = 'loss',
+                 smoothing: float = 0.,
+                 patience: int = 10,
+                 rel_tol: float = 1e-4,
+                 factor: float = 0.5,
+                 min_lr: float = 0.):
+        '''
+        multiply the learning rates by [factor] (down to min_lr) when the
+        monitored value has not improved for [patience] iterations or
+        evaluations (see _Monitor for the other parameters)
+        '''
+        super(ReduceLROnPlateau, self).__init__(monitor, smoothing, patience,
+                                                rel_tol)
+        self.factor = factor
+        self.min_lr = min_lr
+
+    def on_train_begin(self, model, opt, scheduler):
+        self.opt = opt
+        self.scheduler = scheduler
+
+    def on_plateau(self, model, i):
+        if self.wait >= self.patience:
+            #the scheduler sets lr = base_lr * lambda so both are scaled
+            for k, group in enumerate(self.opt.param_groups):
+                base = self.scheduler.base_lrs[k]
+                new = max(base * self.factor, self.min_lr)
+                if base > 0:
+                    group['lr'] *= new / base
+                self.scheduler.base_lrs[k] = new
+            self.wait = 0
+        return False
+
+
+class BestModel(_Monitor):
+    '''
+    keep a copy of the parameters with the lowest smoothed training loss or
+    the highest held-out ELBO and restore them at the end of training
+    '''
+
+    def __init__(self, monitor: str = 'elbo', smoothing: float = 0.):
+        #patience is not used since training continues on a plateau
+        super(BestModel, self).__init__(monitor,
+                                        smoothing,
+                                        patience=0,
+                                        rel_tol=0)
+        self.state: Optional[dict] = None
+        self.best_iter: Optional[int] = None
+
+    def on_improvement(self, model, i):
+        self.state = {
+            k: v.detach().clone() for (k, v) in model.state_dict().items()
+        }
+        self.best_iter = i
+        return False
+
+    def on_train_end(self, model):
+        if self.state is not None:
+            model.load_state_dict(self.state)
+
+    def state_dict(self):
+        state = super(BestModel, self).state_dict()
+        state.update({'state': self.state, 'best_iter': self.best_iter})
+        return state
+
+    def load_state_dict(self, state):
+        super(BestModel, self).load_state_dict(state)
+        self.state = state['state']
+        self.best_iter = state['best_iter']
@@ -13,6 +13,12 @@ class DataLoader:
         self.batch_pool_size = m
         self.data = data
 
+    def state_dict(self):
+        return {}
+
+    def load_state_dict(self, state):
+        pass
+
     def __iter__(self):
         self.i = 0
         return self
@@ -60,6 +66,22 @@ class BatchDataLoader(DataLoader):
             raise Exception(
                 "sample size greater than number of samples in pool")
 
+    def state_dict(self):
+        '''order of the (possibly shuffled) samples and conditions'''
+        return {
+            'sample_pool': list(self.sample_pool),
+            'batch_pool': list(self.batch_pool)
+        }
+
+    def load_state_dict(self, state):
+        '''reorder the data to the order of a previous state_dict'''
+        sample_pos = {s: i for (i, s) in enumerate(self.sample_pool)}
+        batch_pos = {b: k for (k, b) in enumerate(self.batch_pool)}
+        self.data = self.data[[sample_pos[s] for s in state['sample_pool']]]
+        self.data = self.data[:, :, [batch_pos[b] for b in state['batch_pool']]]
+        self.sample_pool = list(state['sample_pool'])
+        self.batch_pool = list(state['batch_pool'])
+
     def __iter__(self):
         self.i = 0
         self.k = 0
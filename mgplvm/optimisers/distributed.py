@@ -0,0 +1,257 @@
+from __future__ import print_function
+import io
+import copy
+import os
+import sys
+import socket
+import queue as queues
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch import Tensor, optim
+from .data import BatchDataLoader
+from . import svgp
+from .callbacks import Callback
+from ..models import SvgpLvm
+from typing import List, Optional
+
+
+def shard(n_samples: int, world_size: int, rank: int) -> List[int]:
+    '''contiguous block of trials assigned to worker [rank]'''
+    return [
+        int(i) for i in np.array_split(np.arange(n_samples), world_size)[rank]
+    ]
+
+
+def local_parameters(model: SvgpLvm) -> List[Tensor]:
+    '''
+    parameters with one entry per trial along their first dimension
+    (variational parameters of the latents and, if the observation model has
+    untied samples, of q(u)); these are only updated by the worker holding the
+    trial
+    '''
+    n_samples = model.n_samples
+    prms: List[Tensor] = []
+    if 'Amortised' not in model.lat_dist.name:  #encoder weights are shared
+        prms += [
+            p for (name, p) in model.lat_dist.named_parameters()
+            if name != '_ell' and p.dim() > 0 and p.shape[0] == n_samples
+        ]
+    if not getattr(model.obs, 'tied_samples', True):
+        prms += [model.obs.q_mu, model.obs.q_sqrt]
+    return prms
+
+
+def _synchronised(optimizer, shared: List[Tensor], local: List[Tensor],
+                  weight: float):
+    '''
+    optimizer class that sums the gradients of the shared parameters across
+    workers before each step; the loss of each worker is an estimate of the
+    loss of the full dataset, so the gradients are weighted by the fraction
+    of trials held by the worker
+    '''
+
+    class SyncOptimizer(optimizer):
+
+        def step(self, closure=None):
+            grads = [
+                torch.zeros_like(p) if p.grad is None else p.grad
+                for p in shared
+            ]
+            if len(grads) > 0:  #a single all-reduce for all parameters
+                flat = torch.cat([g.reshape(-1) for g in grads]) * weight
+                dist.all_reduce(flat)
+                for p, g in zip(shared, flat.split([g.numel() for g in grads])):
+                    p.grad = g.view_as(p)
+            for p in local:
+                if p.grad is not None:
+                    p.grad.mul_(weight)
+            return super(SyncOptimizer, self).step(closure)
+
+    return SyncOptimizer
+
+
+def _gather(local: List[Tensor], idxs: List[int], n_samples: int) -> None:
+    '''collect the local parameters of all trials from the workers'''
+    mask = torch.zeros(n_samples, dtype=torch.bool)
+    mask[idxs] = True
+    with torch.no_grad():
+        for p in local:
+            p.data = p.data * mask.reshape((-1,) + (1,) * (p.dim() - 1)).to(p)
+            dist.all_reduce(p.data)
+
+
+class _Checkpoint(Callback):
+
+    def __init__(self, path: str, every: int, rank: int, idxs: List[int]):
+        '''
+        write the parameters of the model every [every] iterations; the local
+        parameters are collected in a copy of the model and only the first
+        worker writes the checkpoint
+        '''
+        self.path = path
+        self.every = every
+        self.rank = rank
+        self.idxs = idxs
+
+    def on_epoch(self, model, i, loss):
+        if (i + 1) % self.every == 0:
+            model = copy.deepcopy(model)
+            _gather(local_parameters(model), self.idxs, model.n_samples)
+            if self.rank == 0:
+                svgp.save_checkpoint(self.path, {
+                    'step': i + 1,
+                    'model': model.state_dict()
+                })
+        return False
+
+
+def _worker(rank, world_size, port, model, data, batch_size, seed, n_threads,
+            dtype, fit_kwargs, queue):
+    dist.init_process_group('gloo',
+                            init_method='tcp://127.0.0.1:{}'.format(port),
+                            rank=rank,
+                            world_size=world_size)
+    torch.set_num_threads(n_threads)
+    torch.set_default_dtype(dtype)
+    torch.manual_seed(seed + rank)
+    np.random.seed(seed + rank)
+    #tensors passed to the workers are in shared memory
+    model = copy.deepcopy(model)
+    noise = getattr(model.lat_dist, 'noise', None)
+    if (noise is not None) and (noise.seed is not None):
+        noise.manual_seed(noise.seed + rank)
+    if rank > 0:  #only the first worker prints progress
+        sys.stdout = open(os.devnull, 'w')
+
+    n_samples = data.shape[0]
+    idxs = shard(n_samples, world_size, rank)
+    weight = len(idxs) / n_samples
+    local = local_parameters(model)
+    shared = [
+        p for p in model.parameters()
+        if p.requires_grad and not any(p is q for q in local)
+    ]
+    optimizer = fit_kwargs.pop('optimizer', optim.Adam)
+    #every worker would write the same file, so checkpoints are written here
+    checkpoint = fit_kwargs.pop('checkpoint', None)
+    checkpoint_every = fit_kwargs.pop('checkpoint_every', None)
+    if (checkpoint is not None) and (checkpoint_every is not None):
+        fit_kwargs['callbacks'] = [
+            _Checkpoint(checkpoint, checkpoint_every, rank, idxs)
+        ]
+    dataloader = BatchDataLoader(data, batch_size=batch_size, sample_pool=idxs)
+    progress = svgp.fit(dataloader,
+                        model,
+                        optimizer=_synchronised(optimizer, shared, local,
+                                                weight),
+                        **fit_kwargs)
+
+    with torch.no_grad():
+        #loss of the full dataset
+        progress = torch.tensor(progress) * weight
+        dist.all_reduce(progress)
+    _gather(local, idxs, n_samples)
+
+    if (rank == 0) and (checkpoint is not None) and (len(progress) > 0):
+        svgp.save_checkpoint(checkpoint, {
+            'step': len(progress),
+            'model': model.state_dict()
+        })
+    if rank == 0:
+        buffer = io.BytesIO()
+        torch.save(model.state_dict(), buffer)
+        queue.put((buffer.getvalue(), progress.tolist()))
+    dist.barrier()
+    dist.destroy_process_group()
+
+
+def fit_distributed(data: Tensor,
+                    model: SvgpLvm,
+                    world_size: int = 2,
+                    batch_size: Optional[int] = None,
+                    port: Optional[int] = None,
+                    seed: Optional[int] = None,
+                    n_threads: Optional[int] = None,
+                    **kwargs):
+    '''
+    Data-parallel version of svgp.fit on CPUs
+
+    Parameters
+    ----------
+    data : Tensor
+        data matrix of dimensions (n_samples x n x m)
+    model : SvgpLvm
+        model to be trained; it is updated in place with the trained parameters
+    world_size : int
+        number of worker processes
+    batch_size : Optional[int]
+        number of time points per batch (all time points if None)
+    port : Optional[int]
+        localhost port used to set up the process group (a free port if None)
+    seed : Optional[int]
+        workers are seeded with seed + rank (drawn from the global random state if None)
+    n_threads : Optional[int]
+        number of intra-op threads of each worker (the available threads are split between workers if None)
+    kwargs
+        passed to svgp.fit (e.g. optimizer, n_mc, lrate, max_steps)
+
+    Returns
+    -------
+    progress : List[float]
+        loss of the full dataset after each iteration
+
+    Notes
+    -----
+    Workers are spawned with torch.multiprocessing and communicate with the gloo
+    backend of torch.distributed. The trials are split into contiguous shards and
+    each worker fits its shard (sample_idxs) with svgp.fit, so the loss of
+    each worker is an unbiased estimate of the loss of the full dataset.
+    Before each optimizer step, the gradients of the shared parameters (e.g.
+    the observation model and the prior) are summed across workers with
+    weights given by the fraction of trials of each worker, which gives the
+    gradient of the full loss. Parameters with one entry per trial (see
+    local_parameters) are only updated by their worker and collected at the end.
+    The printed progress is the estimate of the first worker.
+    The checkpoints written with checkpoint and checkpoint_every only contain
+    the step and the parameters of the model (with the local parameters of all
+    trials), written by the first worker; checkpoint_time and resume_from are
+    not supported.
+    '''
+    if ('stop' in kwargs) or ('callbacks' in kwargs):
+        raise Exception(
+            "stopping criteria and callbacks are not supported by fit_distributed since all workers must take the same steps"
+        )
+    if ('checkpoint_time' in kwargs) or ('resume_from' in kwargs):
+        raise Exception(
+            "checkpoint_time and resume_from are not supported by fit_distributed since the workers checkpoint at the same steps and their states are not saved"
+        )
+    if world_size > data.shape[0]:
+        raise Exception("world_size cannot exceed the number of trials")
+    if port is None:  #find a free port
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+    if seed is None:
+        seed = int(torch.randint(2**30, (1,)))
+    if n_threads is None:
+        n_threads = max(1, torch.get_num_threads() // world_size)
+
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    context = mp.spawn(_worker,
+                       args=(world_size, port, model, data.cpu(),
+                             batch_size, seed, n_threads,
+                             torch.get_default_dtype(), kwargs, queue),
+                       nprocs=world_size,
+                       join=False)
+    while True:
+        try:
+            state, progress = queue.get(timeout=1)
+            break
+        except queues.Empty:
+            context.join(timeout=0)  #raises if a worker failed
+    context.join()
+    model.load_state_dict(torch.load(io.BytesIO(state)))
+    return progress
@@ -0,0 +1,216 @@
+from __future__ import print_function
+import numpy as np
+import torch
+from torch import Tensor
+from ..models import Lgplvm
+from ..models.bfa import Fa
+from ..utils import inv_softplus
+from ..fast_utils.toeplitz import sym_toeplitz_matmul
+
+
+def _toeplitz_mul(K_half, v):
+    '''K_half (1 x d x m) is the first column of each K2, v is (... x d x m)'''
+    return sym_toeplitz_matmul(K_half, v[..., None])[..., 0]
+
+
+def _to_grid(lat_dist, x):
+    '''
+    scatter x (n_samples x d x m) onto the grid of lat_dist (n_samples x d x m_grid)
+    and return the mask of observed grid points (n_samples x 1 x m_grid)
+    '''
+    if lat_dist.grid_idxs is None:
+        return x, torch.ones_like(x[..., :1, :])
+    n_samples, d, _ = x.shape
+    idxs = lat_dist.grid_idxs[:, None, :]
+    xgrid = torch.zeros(n_samples, d, lat_dist.m_grid).to(x)
+    mask = torch.zeros(n_samples, 1, lat_dist.m_grid).to(x)
+    return xgrid.scatter(-1, idxs.expand(x.shape), x), mask.scatter(-1, idxs, 1)
+
+
+def pcg(A_mul, b: Tensor, Minv: Tensor, x0: Tensor, tol: float,
+        max_iter: int) -> Tensor:
+    '''
+    preconditioned conjugate gradients for A x = b with a diagonal
+    preconditioner Minv = diag(A)^-1; b, Minv and x0 are (... x p)
+    '''
+    x = x0
+    r = b - A_mul(x)
+    z = Minv * r
+    p = z
+    rz = (r * z).sum(-1, keepdim=True)
+    bnorm = torch.linalg.vector_norm(b, dim=-1).clamp_min(1e-30)
+    for _ in range(max_iter):
+        if torch.all(torch.linalg.vector_norm(r, dim=-1) < tol * bnorm):
+            break
+        Ap = A_mul(p)
+        alpha = rz / (p * Ap).sum(-1, keepdim=True)
+        x = x + alpha * p
+        r = r - alpha * Ap
+        z = Minv * r
+        rz_new = (r * z).sum(-1, keepdim=True)
+        p = z + (rz_new / rz) * p
+        rz = rz_new
+    return x
+
+
+def e_step(Y: Tensor,
+           model: Lgplvm,
+           cg_tol: float = 1e-6,
+           max_cg: int = 1000) -> None:
+    '''
+    update the variational distribution of the latents in closed form
+
+    Notes
+    -----
+    In the whitened coordinates u = K2^-1 x, the ELBO is quadratic in the
+    variational mean nu and in the diagonal scale S of lat_dist:
+    ELBO = -1/2 nu^T L nu + b^T nu - 1/2 tr(L S^2) + sum(log S) + const
+    where L = I + K2 (C^T R^-1 C kron O) K2, b = K2 C^T R^-1 Y, R is the noise
+    covariance and O selects the observed grid points.
+    The optimum is nu = L^-1 b and S^2 = diag(L)^-1. L is applied with Toeplitz
+    matrix products and inverted with preconditioned conjugate gradients.
+    '''
+    lat_dist, obs = model.lat_dist, model.obs
+    n_samples, d = Y.shape[0], lat_dist.d
+    m_grid = lat_dist.m_grid
+
+    K_half = lat_dist.K_half()  #(1 x d x m_grid)
+    C, variance = obs.C, obs.prms  #(n x d), (n)
+    CtRinv = (C / variance[:, None]).T  #(d x n)
+    B = CtRinv @ C  #(d x d)
+    r, mask = _to_grid(lat_dist, CtRinv @ Y)  #(n_samples x d x m_grid)
+    b = _toeplitz_mul(K_half, r)
+
+    def L_mul(v):
+        v = v.reshape(n_samples, d, m_grid)
+        Kv = mask * _toeplitz_mul(K_half, v)
+        Lv = v + _toeplitz_mul(K_half, torch.einsum('kl,sln->skn', B, Kv))
+        return Lv.reshape(n_samples, d * m_grid)
+
+    #diag(L) = 1 + B_kk (K2 o K2) O
+    L_diag = 1 + torch.diagonal(B)[:, None] * _toeplitz_mul(
+        torch.square(K_half), mask.expand(n_samples, d, m_grid))
+
+    nu = pcg(L_mul,
+             b.reshape(n_samples, d * m_grid),
+             1 / L_diag.reshape(n_samples, d * m_grid),
+             lat_dist.nu.reshape(n_samples, d * m_grid),
+             tol=cg_tol,
+             max_iter=max_cg)
+
+    lat_dist._nu.data = nu.reshape(n_samples, d, m_grid)
+    lat_dist._scale.data = inv_softplus(L_diag**(-0.5))
+    if lat_dist.name == 'GP_circ':  #C = I (the diagonal sub-family)
+        lat_dist._c.data = inv_softplus(torch.ones_like(lat_dist._c))
+
+
+def sufficient_statistics(Y: Tensor, model: Lgplvm):
+    '''
+    Returns
+    -------
+    Sxx : Tensor
+        sum_t E[x_t x_t^T] over samples and time points (d x d)
+    Syx : Tensor
+        sum_t y_t E[x_t]^T over samples and time points (n x d)
+    '''
+    #(n_samples x m x d), (n_samples x m x d x d)
+    mu, cov = model.lat_dist.moments()
+    Sxx = (mu.transpose(-1, -2) @ mu).sum(0) + cov.sum((0, 1))
+    Syx = (Y @ mu).sum(0)
+    return Sxx, Syx
+
+
+def m_step(Y: Tensor, model: Lgplvm) -> None:
+    '''
+    update C and the noise variances of the Fa observation model in closed form
+    '''
+    obs = model.obs
+    Sxx, Syx = sufficient_statistics(Y, model)
+    C = torch.linalg.solve(Sxx, Syx.T).T  #(n x d)
+    obs.C.data = C
+    if obs._sigma.requires_grad:  #only update learnable noise
+        N = Y.shape[0] * Y.shape[-1]
+        variance = (torch.square(Y).sum(
+            (0, -1)) - 2 * (C * Syx).sum(-1) + ((C @ Sxx) * C).sum(-1)) / N
+        obs._sigma.data = variance.clamp_min(1e-10).sqrt()
+
+
+def elbo(Y: Tensor, model: Lgplvm) -> Tensor:
+    '''
+    exact ELBO of an Lgplvm with an Fa observation model and GP latents
+    '''
+    obs = model.obs
+    C, variance = obs.C, obs.prms  #(n x d), (n)
+    N = Y.shape[0] * Y.shape[-1]
+    Sxx, Syx = sufficient_statistics(Y, model)
+    sq = torch.square(Y).sum(
+        (0, -1)) - 2 * (C * Syx).sum(-1) + ((C @ Sxx) * C).sum(-1)  #(n)
+    lik = -0.5 * (N * torch.log(2 * np.pi * variance) + sq / variance).sum()
+    return lik - model.lat_dist.kl().sum()
+
+
+def fit_em(Y: Tensor,
+           model: Lgplvm,
+           max_steps: int = 100,
+           tol: float = 1e-6,
+           print_every: int = 10,
+           cg_tol: float = 1e-6,
+           max_cg: int = 1000):
+    '''
+    Fit a linear GPLVM by variational EM with closed-form updates
+
+    Parameters
+    ----------
+    Y : Tensor
+        data matrix of dimensions (n_samples x n x m)
+    model : Lgplvm
+        model with a non-Bayesian (Fa) observation model and a GP_diag or
+        GP_circ variational distribution
+    max_steps : int
+        maximum number of EM iterations
+    tol : float
+        stop when the ELBO per data point changes by less than tol
+    print_every : int
+        print the ELBO every print_every iterations
+    cg_tol : float
+        tolerance of the conjugate gradient solves in the E step
+    max_cg : int
+        maximum number of conjugate gradient iterations in the E step
+
+    Returns
+    -------
+    progress : List[float]
+        exact ELBO per data point (n_samples x n x m) after each iteration
+
+    Notes
+    -----
+    Each iteration maximizes the ELBO of svgp.fit exactly, first with respect
+    to the variational distribution of the latents (see e_step) and then with
+    respect to C and the noise variances (see m_step), so the ELBO increases
+    monotonically. For GP_circ, the E step optimizes within the diagonal
+    sub-family (C = I). The length scales of the GP prior are not updated.
+    '''
+    if not isinstance(model.obs, Fa):
+        raise Exception(
+            "fit_em requires an Lgplvm with a non-Bayesian (Fa) observation model"
+        )
+    if model.lat_dist.name not in ['GP_diag', 'GP_circ']:
+        raise Exception(
+            "fit_em requires a GP_diag or GP_circ variational distribution")
+
+    n_samples, n, m = Y.shape
+    Z = n * m * n_samples
+    progress = []
+    with torch.no_grad():
+        for i in range(max_steps):
+            e_step(Y, model, cg_tol=cg_tol, max_cg=max_cg)
+            m_step(Y, model)
+            progress.append(elbo(Y, model).item() / Z)
+            if i % print_every == 0:
+                print((
+                    '\riter {:>3d} | elbo {:> .3f} |').format(i, progress[-1]) +
+                      model.lat_dist.msg(Y, None, None) + model.obs.msg)
+            if i > 0 and abs(progress[-1] - progress[-2]) < tol:
+                break
+
+    return progress
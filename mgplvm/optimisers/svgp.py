@@ -1,10 +1,15 @@
 from __future__ import print_function
+import os
+import time
+import random
 import numpy as np
 import torch
 from torch import Tensor, optim
 from torch.optim.lr_scheduler import LambdaLR
 from .data import DataLoader
 from ..models import SvgpLvm
+from ..utils import Noise
+from .callbacks import Callback, CallbackList, StopCallback
 import itertools
 from typing import Union, List, Optional
 
@@ -63,6 +68,48 @@ def print_progress(model,
             model.lprior.msg,)
 
 
+def _noises(model) -> List[Noise]:
+    '''noise sources of the model'''
+    return [
+        mod.noise
+        for mod in model.modules()
+        if isinstance(getattr(mod, 'noise', None), Noise)
+    ]
+
+
+def rng_state(model) -> dict:
+    '''state of all random number generators used during training'''
+    state = {
+        'torch': torch.get_rng_state(),
+        'numpy': np.random.get_state(),
+        'random': random.getstate(),
+        'noise': [noise.__getstate__() for noise in _noises(model)]
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(model, state: dict) -> None:
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['random'])
+    for noise, noise_state in zip(_noises(model), state['noise']):
+        noise.__setstate__(noise_state)
+    if 'cuda' in state:
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    '''
+    write a checkpoint atomically (a crash while saving leaves the previous
+    checkpoint intact)
+    '''
+    tmp = path + '.tmp'
+    torch.save(checkpoint, tmp)
+    os.replace(tmp, path)
+
+
 def fit(dataset: Union[Tensor, DataLoader],
         model: SvgpLvm,
         optimizer=optim.Adam,
@@ -76,8 +123,14 @@ def fit(dataset: Union[Tensor, DataLoader],
         neuron_idxs: Optional[List[int]] = None,
         prior_m=None,
         analytic_kl=False,
+        analytic_lik=False,
         accumulate_gradient=True,
-        batch_mc=None):
+        batch_mc=None,
+        checkpoint: Optional[str] = None,
+        checkpoint_every: Optional[int] = None,
+        checkpoint_time: Optional[float] = None,
+        resume_from: Optional[str] = None,
+        callbacks: Optional[List[Callback]] = None):
     '''
     Parameters
     ----------
@@ -93,6 +146,46 @@ def fit(dataset: Union[Tensor, DataLoader],
         initial learning rate passed to the optimizer
     max_steps : Optional[int], default=1000
         maximum number of training iterations
+    analytic_lik : bool
+        compute the expected log likelihood from the moments of the latents
+        instead of Monte Carlo samples (see Gplvm.elbo)
+    checkpoint : Optional[str]
+        path of the checkpoint file (written at the end of training and
+        as specified by checkpoint_every and checkpoint_time)
+    checkpoint_every : Optional[int]
+        save a checkpoint every checkpoint_every iterations
+    checkpoint_time : Optional[float]
+        save a checkpoint when checkpoint_time seconds have passed since the
+        last one
+    resume_from : Optional[str]
+        path of a checkpoint written by fit to continue training from.
+        The model, optimizer and dataset must be constructed as in the
+        original call, and max_steps is the total number of iterations.
+    stop : Optional[Callable]
+        stop(model, i, loss_val) is called after every iteration and returns
+        True to stop training (e.g. LossMarginStop)
+    callbacks : Optional[List[Callback]]
+        callbacks for the events of the training loop (see optimisers.callbacks),
+        e.g. held-out ELBO evaluation (HeldOutElbo), early stopping
+        (PlateauStop), learning rate decay (ReduceLROnPlateau) and restoring
+        the best parameters (BestModel)
+
+    Returns
+    -------
+    progress : List[float]
+        loss per data point after each iteration
+
+    Notes
+    -----
+    The loss, KL and ELBO of each iteration are accumulated on the device and
+    only copied to the host every print_every iterations (and at the end), so
+    the training loop does not wait for the device after every batch.
+    Callbacks that use the loss (e.g. stop) copy it to the host after every
+    iteration.
+    Checkpoints contain the parameters of the model, the states of the
+    optimizer, the learning rate scheduler, the random number generators and
+    the dataloader (order of shuffled data), the callbacks, and the progress so far, so training resumed from a checkpoint gives the
+    same result as uninterrupted training.
     '''
 
     # set learning rate schedule so sigma updates have a burn-in period
@@ -129,8 +222,44 @@ def fit(dataset: Union[Tensor, DataLoader],
         mc_batches.append(n_mc % batch_mc)
     assert np.sum(mc_batches) == n_mc
 
-    for i in range(max_steps):  #loop over iterations
-        loss_vals, kl_vals, svgp_vals = [], [], []
+    #(loss, kl, svgp_elbo) of each iteration, kept on the device and only
+    #read back when printing (or if a callback needs the loss)
+    history = []
+    start = 0
+    device = next(model.parameters()).device
+    if resume_from is not None:
+        ckpt = torch.load(resume_from, weights_only=False)
+        model.load_state_dict(ckpt['model'])
+        opt.load_state_dict(ckpt['optimizer'])
+        scheduler.load_state_dict(ckpt['scheduler'])
+        set_rng_state(model, ckpt['rng'])
+        dataloader.load_state_dict(ckpt['data'])
+        history = list(ckpt['history'].to(device))
+        start = ckpt['step']
+
+    def save(path: str, step: int):
+        save_checkpoint(
+            path, {
+                'step': step,
+                'model': model.state_dict(),
+                'optimizer': opt.state_dict(),
+                'scheduler': scheduler.state_dict(),
+                'rng': rng_state(model),
+                'data': dataloader.state_dict(),
+                'history': torch.stack(history).cpu(),
+                'callbacks': cb_list.state_dict()
+            })
+
+    cb_list = CallbackList(([] if callbacks is None else list(callbacks)) +
+                           ([] if stop is None else [StopCallback(stop)]))
+    if resume_from is not None:
+        cb_list.load_state_dict(ckpt['callbacks'])
+    cb_list.on_train_begin(model, opt, scheduler)
+
+    last_save = time.time()
+    for i in range(start, max_steps):  #loop over iterations
+        vals = torch.zeros(3, device=device)
+        stop_training = False
         ramp = 1 - np.exp(-i / burnin)
 
         for imc, mc in enumerate(mc_batches):  #loop over mc samples
@@ -148,12 +277,12 @@ def fit(dataset: Union[Tensor, DataLoader],
                                       sample_idxs=sample_idxs,
                                       neuron_idxs=neuron_idxs,
                                       m=prior_m,
-                                      analytic_kl=analytic_kl)
+                                      analytic_kl=analytic_kl,
+                                      analytic_lik=analytic_lik)
 
                 loss = (-svgp_elbo) + (ramp * kl)  # -LL
-                loss_vals.append(weight * loss.item() * mc_weight)
-                kl_vals.append(weight * kl.item() * mc_weight)
-                svgp_vals.append(weight * svgp_elbo.item() * mc_weight)
+                vals = vals + torch.stack([loss, kl, svgp_elbo
+                                          ]).detach() * (weight * mc_weight)
 
                 if accumulate_gradient:
                     loss *= mc_weight
@@ -165,20 +294,40 @@ def fit(dataset: Union[Tensor, DataLoader],
                 if not accumulate_gradient:
                     opt.step()  #update parameters for every batch
                     opt.zero_grad()  #reset gradients
+                    if cb_list.on_step(model, i, loss.detach()):
+                        stop_training = True
 
         if accumulate_gradient:
             opt.step()  #accumulate gradients across all batches, then update
             opt.zero_grad()  #reset gradients after all batches
+            stop_training = cb_list.on_step(model, i, vals[0])
 
         scheduler.step()
-        print_progress(model, n, m, n_samples, i, np.sum(loss_vals),
-                       np.sum(kl_vals), np.sum(svgp_vals), print_every, batch,
-                       None, None)
-        progress.append(np.sum(loss_vals) / (n * m * n_samples))
-        # terminate if stop is True
-        if stop is not None:
-            if stop(model, i, np.sum(loss_vals)):
-                break
+        history.append(vals)
+        if i % print_every == 0:
+            loss_val, kl_val, svgp_elbo_val = vals.tolist()
+            print_progress(model, n, m, n_samples, i, loss_val, kl_val,
+                           svgp_elbo_val, print_every, batch, None, None)
+        # terminate if a callback returns True
+        stop_training = cb_list.on_epoch(model, i, vals[0]) or stop_training
+
+        if checkpoint is not None and not stop_training:
+            if ((checkpoint_every is not None) and
+                ((i + 1) % checkpoint_every == 0)) or (
+                    (checkpoint_time is not None) and
+                    (time.time() - last_save > checkpoint_time)):
+                save(checkpoint, i + 1)
+                last_save = time.time()
+        if stop_training:
+            break
+
+    #after on_train_end so the checkpoint has e.g. the parameters of BestModel
+    cb_list.on_train_end(model)
+    if (checkpoint is not None) and len(history) > 0:
+        save(checkpoint, len(history))
+
+    if len(history) > 0:
+        progress = (torch.stack(history)[:, 0] / (n * m * n_samples)).tolist()
 
     #print('removing hooks')
     for h in hooks:
@@ -1,8 +1,9 @@
 import torch
 import numpy as np
 from torch import nn, Tensor
+import torch.nn.functional as F
 from torch.distributions.multivariate_normal import MultivariateNormal
-from ..utils import softplus, inv_softplus
+from ..utils import softplus, inv_softplus, Noise
 from ..manifolds.base import Manifold
 from .GPbase import GPbase
 from typing import Optional
@@ -19,7 +20,8 @@ class GP_circ(GPbase):
                  n_samples: int,
                  ts: torch.Tensor,
                  _scale=0.9,
-                 ell=None):
+                 ell=None,
+                 noise: Optional[Noise] = None):
         """
         Parameters
         ----------
@@ -31,6 +33,8 @@ class GP_circ(GPbase):
             number of samples
         ts: Tensor
             input timepoints for each sample (n_samples x 1 x m)
+        noise : Optional[mgplvm.utils.Noise]
+            noise source used for sampling (defaults to mgplvm.utils.default_noise)
             
         Notes
         -----
@@ -42,15 +46,24 @@ class GP_circ(GPbase):
                                       n_samples,
                                       ts,
                                       _scale=_scale,
-                                      ell=ell)
+                                      ell=ell,
+                                      noise=noise)
 
         #initialize circulant parameters
-        if self.m % 2 == 0:
-            _c = torch.ones(n_samples, self.d, int(m / 2) + 1)
+        m_grid = self.m_grid
+        if m_grid % 2 == 0:
+            _c = torch.ones(n_samples, self.d, int(m_grid / 2) + 1)
         else:
-            _c = torch.ones(n_samples, self.d, int((m + 1) / 2))
+            _c = torch.ones(n_samples, self.d, int((m_grid + 1) / 2))
         self._c = nn.Parameter(data=inv_softplus(_c), requires_grad=True)
 
+        #multiplicity of each c in the full (symmetric) spectrum of C
+        c_weights = 2 * torch.ones(_c.shape[-1])
+        c_weights[0] = 1
+        if m_grid % 2 == 0:
+            c_weights[-1] = 1
+        self.register_buffer('c_weights', c_weights)
+
     @property
     def c(self) -> torch.Tensor:
         return softplus(self._c)
@@ -75,7 +88,7 @@ class GP_circ(GPbase):
         rv = rfft(v.transpose(-1, -2).to(scale.device))
 
         #inverse fourier transform of product (n_samples x d x m x n_mc)
-        Cv = irfft(c[..., None, :] * rv, n=self.m).transpose(-1, -2)
+        Cv = irfft(c[..., None, :] * rv, n=self.m_grid).transpose(-1, -2)
 
         #multiply by diagonal scale
         SCv = scale[..., None] * Cv
@@ -84,6 +97,40 @@ class GP_circ(GPbase):
 
         return SCv
 
+    def marginal_var(self, sample_idxs=None):
+        """
+        marginal variances diag(Khalf S C C S Khalf) (n_samples x d x m_grid)
+
+        Notes
+        -----
+        Khalf decays on the scale of the length scale, so each variance only
+        involves the time points within 6 length scales (the dropped terms are
+        below exp(-36) of the largest).
+        C C is circulant, so its restriction to the window is the same
+        Toeplitz matrix at every time point, which gives O(m w log w) time and
+        O(m w) memory for a window of w time points.
+        """
+        scale, c = self.scale, self.c
+        if sample_idxs is not None:
+            scale = scale[sample_idxs, ...]  #(n_samples x d x m)
+            c = c[sample_idxs, ...]  #(n_samples x d x m/2)
+        m = self.m_grid
+        K_half = self.K_half(sample_idxs=sample_idxs)  #(1 x d x m)
+
+        #half-width of the window
+        W = int(np.ceil(6 * self.ell.max().item() / self.dt))
+        W = min(W, m - 1)
+        lags = torch.arange(-W, W + 1).to(scale.device)
+
+        #first column of C C restricted to the window (n_samples x d x w)
+        CC = irfft(torch.square(c), n=m)[..., torch.arange(2 * W + 1) % m]
+        #Khalf S around each time point (n_samples x d x m x w)
+        S_w = F.pad(scale, (W, W)).unfold(-1, 2 * W + 1, 1)
+        KS = K_half[..., None, torch.abs(lags)] * S_w
+
+        KS_CC = sym_toeplitz_matmul(CC, KS.transpose(-1, -2))
+        return (KS_CC * KS.transpose(-1, -2)).sum(-2)
+
     def kl(self, batch_idxs=None, sample_idxs=None):
         """
         Compute KL divergence between prior and posterior.
@@ -97,21 +144,17 @@ class GP_circ(GPbase):
             S = S[sample_idxs, ...]
             c = c[sample_idxs, ...]
 
-        #n_samples x d x m
-        Cr = irfft(self.c,
-                   n=self.m)  #first row of C given by inverse Fourier transform
+        #squared norm of the first row of C from Parseval's theorem (n_samples x d)
+        CrSq = (self.c_weights * torch.square(c)).sum(-1) / self.m_grid
 
         #(n_samples x d)
-        TrTerm = torch.square(S).sum(-1) * torch.square(Cr).sum(-1)
+        TrTerm = torch.square(S).sum(-1) * CrSq
         MeanTerm = torch.square(nu).sum(-1)  #(n_samples x d)
         DimTerm = S.shape[-1]
         LogSTerm = 2 * (torch.log(S)).sum(-1)  #(n_samples x d)
 
-        #c[0] + 2*c[1:end] (n_samples x d)
-        LogCTerm = 2 * (torch.log(c)).sum(-1) - torch.log(c[..., 0])
-        if self.m % 2 == 0:
-            #c[0] + c[-1] + 2*c[1:-1]
-            LogCTerm = LogCTerm - torch.log(c[..., -1])
+        #c[0] + 2*c[1:end] (+ c[-1] if m is even) (n_samples x d)
+        LogCTerm = (self.c_weights * torch.log(c)).sum(-1)
         LogCTerm = 2 * LogCTerm  #one for each C
 
         kl = 0.5 * (TrTerm + MeanTerm - DimTerm - LogSTerm - LogCTerm)
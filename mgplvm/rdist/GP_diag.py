@@ -2,7 +2,7 @@ import torch
 import numpy as np
 from torch import nn, Tensor
 from torch.distributions.multivariate_normal import MultivariateNormal
-from ..utils import softplus, inv_softplus
+from ..utils import softplus, inv_softplus, Noise
 from ..manifolds.base import Manifold
 from .GPbase import GPbase
 from typing import Optional
@@ -20,6 +20,7 @@ class GP_diag(GPbase):
         ts: torch.Tensor,
         _scale=0.9,
         ell=None,
+        noise: Optional[Noise] = None,
     ):
         """
         Parameters
@@ -32,6 +33,8 @@ class GP_diag(GPbase):
             number of samples
         ts: Tensor
             input timepoints for each sample (n_samples x 1 x m)
+        noise : Optional[mgplvm.utils.Noise]
+            noise source used for sampling (defaults to mgplvm.utils.default_noise)
             
         Notes
         -----
@@ -42,7 +45,8 @@ class GP_diag(GPbase):
                                       n_samples,
                                       ts,
                                       _scale=_scale,
-                                      ell=ell)
+                                      ell=ell,
+                                      noise=noise)
 
     def I_v(self, v, sample_idxs=None):
         """
@@ -57,6 +61,17 @@ class GP_diag(GPbase):
         Sv = scale[..., None] * v.to(scale.device)
         return Sv
 
+    def marginal_var(self, sample_idxs=None):
+        """
+        marginal variances (Khalf o Khalf) @ scale^2 (n_samples x d x m_grid)
+        """
+        scale = self.scale
+        if sample_idxs is not None:
+            scale = scale[sample_idxs, ...]
+        K_half = self.K_half(sample_idxs=sample_idxs)
+        return sym_toeplitz_matmul(torch.square(K_half),
+                                   torch.square(scale)[..., None])[..., 0]
+
     def kl(self, batch_idxs=None, sample_idxs=None):
         """
         Compute KL divergence between prior and posterior.
@@ -1,8 +1,9 @@
+import warnings
 import torch
 import numpy as np
 from torch import nn, Tensor
 from torch.distributions.multivariate_normal import MultivariateNormal
-from ..utils import softplus, inv_softplus
+from ..utils import softplus, inv_softplus, Noise, default_noise
 from ..manifolds.base import Manifold
 from .common import Rdist
 from typing import Optional
@@ -11,6 +12,7 @@ from ..fast_utils.toeplitz import sym_toeplitz_matmul
 
 class GPbase(Rdist):
     name = "GPbase"  # it is important that child classes have "GP" in their name, this is used in control flow
+    max_grid_ratio = 10  #warn if the regular grid is much larger than the number of timepoints
 
     def __init__(self,
                  manif: Manifold,
@@ -18,7 +20,8 @@ class GPbase(Rdist):
                  n_samples: int,
                  ts: torch.Tensor,
                  _scale=0.9,
-                 ell=None):
+                 ell=None,
+                 noise: Optional[Noise] = None):
         """
         Parameters
         ----------
@@ -30,6 +33,8 @@ class GPbase(Rdist):
             number of samples
         ts: Tensor
             input timepoints for each sample (n_samples x 1 x m)
+        noise : Optional[mgplvm.utils.Noise]
+            noise source used for sampling (defaults to mgplvm.utils.default_noise)
         mu : Optional[np.ndarray]
             initialization of the vartiational means (m x d2)
             
@@ -39,6 +44,15 @@ class GPbase(Rdist):
         We parameterize our posterior as N(K2 v, K2 I^2 K2)
         where K2 K2 = K and I(s) is some inner matrix which can take different forms.
         s is a vector of scale parameters for each time point.
+
+        Irregularly sampled timepoints (e.g. dropped frames or bin widths that are
+        multiples of a base bin width) are embedded in a regular grid with spacing
+        given by the base time difference (see grid_embedding). The variational
+        distribution is defined on the full grid, which keeps the Toeplitz
+        structure, and samples are read out at the observed timepoints. Timepoints that do not lie on
+        such a grid raise an exception, and a warning is given if the grid has
+        more than max_grid_ratio * m points (e.g. because of one very small
+        time difference) since memory and compute scale with the grid size.
         
         """
 
@@ -47,13 +61,29 @@ class GPbase(Rdist):
         self.manif = manif
         self.d = manif.d
         self.m = m
+        self.noise = default_noise if noise is None else noise
+
+        #embed the timepoints in a regular grid (n_samples x m)
+        grid_idxs, self.dt = self.grid_embedding(ts)
+        self.m_grid = int(grid_idxs.max().item()) + 1
+        if self.m_grid > self.max_grid_ratio * m:
+            warnings.warn(
+                "the regular grid of the timepoints has {} points for {} timepoints; "
+                .format(self.m_grid, m) +
+                "the memory and compute of the variational distribution scale with the grid size"
+            )
+        if self.m_grid == m:  #already a regular grid
+            self.grid_idxs = None
+        else:
+            self.register_buffer('grid_idxs', grid_idxs)
 
         #initialize GP mean parameters
-        nu = torch.randn((n_samples, self.d, m)) * 0.01
+        nu = torch.randn((n_samples, self.d, self.m_grid)) * 0.01
         self._nu = nn.Parameter(data=nu, requires_grad=True)  #m in the notes
 
         #initialize covariance parameters
-        _scale = torch.ones(n_samples, self.d, m) * _scale  #n_diag x T
+        _scale = torch.ones(n_samples, self.d,
+                            self.m_grid) * _scale  #n_diag x T
         self._scale = nn.Parameter(data=inv_softplus(_scale),
                                    requires_grad=True)
 
@@ -70,13 +100,85 @@ class GPbase(Rdist):
 
         #pre-compute time differences (only need one row for the toeplitz stuff)
         self.ts = ts
-        dts_sq = torch.square(ts - ts[..., :1])  #(n_samples x 1 x m)
-        #sum over _input_ dimension, add an axis for _output_ dimension
-        dts_sq = dts_sq.sum(-2)[:, None, ...]  #(n_samples x 1 x m)
-        #print('dts sqr:', dts_sq.shape)
+        dts_sq = torch.square(torch.arange(self.m_grid).to(ts.dtype) *
+                              self.dt)  #(m_grid)
+        #add axes for samples and _output_ dimension
+        dts_sq = dts_sq[None, None, :]  #(1 x 1 x m_grid)
         self.dts_sq = nn.Parameter(data=dts_sq, requires_grad=False)
 
-        self.dt = (ts[0, 0, 1] - ts[0, 0, 0]).item()  #scale by dt
+    @staticmethod
+    def grid_embedding(ts: torch.Tensor, tol: float = 1e-3):
+        """
+        Find a regular grid containing the timepoints of every sample.
+
+        Parameters
+        ----------
+        ts : Tensor
+            input timepoints for each sample (n_samples x 1 x m)
+        tol : float
+            tolerance on the grid position in units of the grid spacing
+
+        Returns
+        -------
+        grid_idxs : Tensor
+            index of each timepoint on the grid (n_samples x m)
+        dt : float
+            grid spacing
+
+        Notes
+        -----
+        The grid spacing is the median time difference (or the smallest one if
+        the timepoints are not on a grid with the median spacing), refined by a
+        least-squares fit of the timepoints to their grid indices, which are
+        accumulated from the rounded time differences. The check is
+        done in float64 and also tolerates the rounding error of the timepoints
+        in their own precision, so long recordings in float32 are accepted.
+        """
+        if ts.shape[-2] != 1:
+            raise Exception(
+                "GP variational distributions only support one-dimensional inputs"
+            )
+        eps = torch.finfo(ts.dtype).eps if ts.is_floating_point() else 0.
+        ts = ts[:, 0, :].double()  #(n_samples x m)
+        dts = ts[..., 1:] - ts[..., :-1]
+        if torch.any(dts <= 0):
+            raise Exception("timepoints must be strictly increasing")
+        if dts.numel() == 0:  #a single timepoint
+            return torch.zeros(ts.shape, dtype=torch.long), 1.
+
+        atol = 4 * eps * torch.abs(ts)
+        for dt0 in [dts.median().item(), dts.min().item()]:
+            #rounding each time difference does not accumulate the error of dt0
+            steps = torch.round(dts / dt0)
+            grid_idxs = torch.cat(
+                [torch.zeros_like(ts[..., :1]),
+                 torch.cumsum(steps, dim=-1)],
+                dim=-1)
+            #least-squares fit of ts = t0 + dt * grid_idxs with an offset per sample
+            idxs_c = grid_idxs - grid_idxs.mean(-1, keepdim=True)
+            ts_c = ts - ts.mean(-1, keepdim=True)
+            dt = ((idxs_c * ts_c).sum() / torch.square(idxs_c).sum()).item()
+            t0 = (ts - dt * grid_idxs).mean(-1, keepdim=True)
+            resid = torch.abs(ts - t0 - dt * grid_idxs)
+            if torch.all(steps >= 1) and torch.all(resid <= tol * dt + atol):
+                return grid_idxs.long(), dt
+        raise Exception("timepoints must lie on a regular grid with spacing " +
+                        "{:.3g} (up to missing timepoints)".format(dt0))
+
+    def to_timepoints(self, x, sample_idxs=None):
+        """
+        read out the observed timepoints from a quantity defined on the grid
+        x is (... x n_samples x m_grid x d) and the output is (... x n_samples x m x d)
+        """
+        if self.grid_idxs is None:
+            return x
+        grid_idxs = self.grid_idxs
+        if sample_idxs is not None:
+            grid_idxs = grid_idxs[sample_idxs, ...]
+        n_samples = x.shape[-3]
+        grid_idxs = grid_idxs.expand(n_samples, grid_idxs.shape[-1])
+        sample_range = torch.arange(n_samples).to(x.device)[:, None]
+        return x[..., sample_range, grid_idxs, :]
 
     @property
     def scale(self) -> torch.Tensor:
@@ -102,7 +204,7 @@ class GPbase(Rdist):
         nu = self.nu
         K_half = self.K_half()  #(n_samples x d x m)
         mu = sym_toeplitz_matmul(K_half, nu[..., None])[..., 0]
-        return mu.transpose(-1, -2)  #(n_samples x m x d)
+        return self.to_timepoints(mu.transpose(-1, -2))  #(n_samples x m x d)
 
     def K_half(self, sample_idxs=None):
         """compute one column of the square root of the prior matrix"""
@@ -140,6 +242,37 @@ class GPbase(Rdist):
         """
         pass
 
+    def marginal_var(self, sample_idxs=None):
+        """
+        marginal variances of the latents on the grid (n_samples x d x m_grid),
+        i.e. the diagonal of Khalf @ I @ I @ Khalf
+        This should be implemented for each class separately without forming
+        the m_grid x m_grid covariance (see full_cov)
+        """
+        raise Exception("marginal_var is not implemented for " + self.name)
+
+    def moments(self, batch_idxs=None, sample_idxs=None):
+        """
+        Returns
+        -------
+        mu : Tensor
+            marginal means of the latents (n_samples x m x d)
+        cov : Tensor
+            marginal covariances of the latents (n_samples x m x d x d)
+        """
+        nu = self.nu
+        if sample_idxs is not None:
+            nu = nu[sample_idxs, ...]
+        K_half = self.K_half(sample_idxs=sample_idxs)  #(1 x d x m)
+        mu = sym_toeplitz_matmul(K_half, nu[..., None])[..., 0]
+        mu = self.to_timepoints(mu.transpose(-1, -2), sample_idxs)
+        var = self.marginal_var(sample_idxs=sample_idxs)
+        var = self.to_timepoints(var.transpose(-1, -2), sample_idxs)
+        if batch_idxs is not None:  #only select some time points
+            mu, var = mu[..., batch_idxs, :], var[..., batch_idxs, :]
+        #the latent dimensions are independent
+        return mu, torch.diag_embed(var)
+
     def full_cov(self):
         """Compute the full covariance Khalf @ I @ I @ Khalf"""
         v = torch.diag_embed(torch.ones(
@@ -150,6 +283,15 @@ class GPbase(Rdist):
         Khalf_I = sym_toeplitz_matmul(K_half, I)  #(n_samples x d x m x m)
         K_post = Khalf_I @ Khalf_I.transpose(-1, -2)  #Kpost = Khalf@I@I@Khalf
 
+        if self.grid_idxs is not None:  #only keep the observed timepoints
+            n_samples, d, m_grid, _ = K_post.shape
+            idxs = self.grid_idxs[:, None, :,
+                                  None].expand(n_samples, d, self.m, m_grid)
+            K_post = torch.gather(K_post, -2,
+                                  idxs)  #(n_samples x d x m x m_grid)
+            K_post = torch.gather(K_post, -1, idxs[..., :self.m].transpose(
+                -1, -2))  #(n_samples x d x m x m)
+
         return K_post.detach()
 
     def sample(self,
@@ -168,22 +310,25 @@ class GPbase(Rdist):
         lq = self.kl(batch_idxs=batch_idxs,
                      sample_idxs=sample_idxs)  #(n_samples x d)
 
-        K_half = self.K_half(sample_idxs=sample_idxs)  #(n_samples x d x m)
-        n_samples, d, m = K_half.shape
+        K_half = self.K_half(sample_idxs=sample_idxs)  #(1 x d x m)
+
+        nu = self.nu  #mean parameter (n_samples, d, m)
+        if sample_idxs is not None:
+            nu = nu[sample_idxs, ...]
+        n_samples, d, m = nu.shape
 
         # sample a batch with dims: (n_samples x d x m x n_mc)
-        v = torch.randn(n_samples, d, m, size[0])  # v ~ N(0, 1)
+        v = self.noise.randn((n_samples, d, m, size[0]), nu.device,
+                             nu.dtype)  # v ~ N(0, 1)
         #compute I @ v (n_samples x d x m x n_mc)
         I_v = self.I_v(v, sample_idxs=sample_idxs)
 
-        nu = self.nu  #mean parameter (n_samples, d, m)
-        if sample_idxs is not None:
-            nu = nu[sample_idxs, ...]
         samp = nu[..., None] + I_v  #add mean parameter to each sample
 
         #compute K@(I@v+nu)
         x = sym_toeplitz_matmul(K_half, samp)  #(n_samples x d x m x n_mc)
-        x = x.permute(-1, 0, 2, 1)  #(n_mc x n_samples x m x d)
+        x = x.permute(-1, 0, 2, 1)  #(n_mc x n_samples x m_grid x d)
+        x = self.to_timepoints(x, sample_idxs)  #(n_mc x n_samples x m x d)
 
         if batch_idxs is not None:  #only select some time points
             x = x[..., batch_idxs, :]
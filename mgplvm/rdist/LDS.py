@@ -0,0 +1,251 @@
+import numpy as np
+import torch
+from torch import nn, Tensor
+from torch.distributions import transform_to, constraints
+from ..utils import Noise, default_noise
+from ..manifolds import Euclid
+from ..manifolds.base import Manifold
+from .common import Rdist
+from ..fast_utils.kalman import _associative_scan
+from typing import Optional
+
+
+def _affine_combine(earlier, later):
+    '''
+    composition of the maps z -> z M + c of two segments of the chain, with
+    M (... x k x d x d) and c (... x k x 1 x d)
+    '''
+    M1, c1 = earlier
+    M2, c2 = later
+    return M1 @ M2, c1 @ M2 + c2
+
+
+def _lyapunov_combine(earlier, later):
+    '''
+    composition of the maps P -> M^T P M + C of two segments of the chain,
+    with M, C (... x k x d x d)
+    '''
+    M1, C1 = earlier
+    M2, C2 = later
+    return M1 @ M2, M2.transpose(-1, -2) @ C1 @ M2 + C2
+
+
+class LDS(Rdist):
+    name = "LDS"
+
+    def __init__(self,
+                 manif: Manifold,
+                 m: int,
+                 n_samples: int,
+                 sigma: float = 1.5,
+                 mu: Optional[Tensor] = None,
+                 initialization: Optional[str] = 'random',
+                 Y=None,
+                 noise: Optional[Noise] = None):
+        """
+        Parameters
+        ----------
+        manif: Manifold
+            latent manifold (must be Euclidean)
+        m : int
+            number of conditions/timepoints
+        n_samples: int
+            number of samples
+        sigma : Optional[float]
+            initial diagonal std of the innovations
+        mu : Optional[Tensor]
+            initialization of the variational means (n_samples x m x d)
+        intialization : Optional[str]
+            string to specify type of initialization of the means
+        Y : Optional[np.ndarray]
+            data used to initialize latents (n_samples x n x m)
+        noise : Optional[mgplvm.utils.Noise]
+            noise source used for sampling (defaults to mgplvm.utils.default_noise)
+
+        Notes
+        -----
+        The posterior is a Gauss-Markov chain x = mu + z with
+        z_0 = eps_0 S_0^T and z_t = z_(t-1) B_t + eps_t S_t^T, where the S_t are
+        lower triangular. Its precision is block-tridiagonal with the
+        block-bidiagonal factor given by (S_t, B_t), so sampling, the marginal
+        covariances and the KL divergence to a linear dynamical system prior
+        (lpriors.DS) are all computed in O(m d^3). The recursions over time
+        are evaluated as parallel scans in O(log m) sequential steps.
+        When the prior is lpriors.DS, sample returns the analytic KL divergence
+        instead of log q(x).
+        """
+        if not isinstance(manif, Euclid):
+            raise Exception(
+                "LDS variational distribution only works with Euclidean manifolds"
+            )
+        super(LDS, self).__init__(manif, 1)
+        self.m = m
+        self.noise = default_noise if noise is None else noise
+        d = self.d
+
+        if mu is None:
+            mu = manif.initialize(initialization, n_samples, m, d, Y)
+        else:
+            assert mu.shape == (n_samples, m, d)
+        self.mu = nn.Parameter(data=mu, requires_grad=True)
+
+        #transitions into each time point (n_samples x m-1 x d x d)
+        self.B = nn.Parameter(data=torch.zeros(n_samples, m - 1, d, d),
+                              requires_grad=True)
+
+        #cholesky factors of the innovation covariances (n_samples x m x d x d)
+        S = torch.diag_embed(torch.ones(n_samples, m, d) * sigma)
+        self._S = nn.Parameter(data=transform_to(
+            constraints.lower_cholesky).inv(S),
+                               requires_grad=True)
+
+    @property
+    def S(self) -> Tensor:
+        return transform_to(constraints.lower_cholesky)(self._S)
+
+    @property
+    def prms(self):
+        return self.mu, self.B, self.S
+
+    @property
+    def lat_mu(self):
+        return self.mu
+
+    def transform(self, eps: Tensor, sample_idxs=None) -> Tensor:
+        """
+        map white noise eps (... x n_samples x m x d) to zero-mean samples z
+        """
+        B: Tensor = self.B
+        S: Tensor = self.S
+        if sample_idxs is not None:
+            B, S = B[sample_idxs, ...], S[sample_idxs, ...]
+        #innovations (... x n_samples x m x 1 x d)
+        w = (S @ eps[..., None]).transpose(-1, -2)
+        #z_t = z_(t-1) B_t + w_t as a parallel scan over the affine maps
+        M = torch.cat([torch.zeros_like(B[..., :1, :, :]), B], -3)
+        M = M.expand(w.shape[:-2] + M.shape[-2:])
+        _, z = _associative_scan(_affine_combine, [M, w])
+        return z[..., 0, :]
+
+    def marginal_cov(self, sample_idxs=None) -> Tensor:
+        """
+        marginal covariance of each latent (n_samples x m x d x d)
+        """
+        B: Tensor = self.B
+        S: Tensor = self.S
+        if sample_idxs is not None:
+            B, S = B[sample_idxs, ...], S[sample_idxs, ...]
+        SS = S @ S.transpose(-1, -2)
+        #P_t = B_t^T P_(t-1) B_t + S_t S_t^T as a parallel scan
+        M = torch.cat([torch.zeros_like(B[..., :1, :, :]), B], -3)
+        _, P = _associative_scan(_lyapunov_combine, [M, SS])
+        return P
+
+    def moments(self, batch_idxs=None, sample_idxs=None):
+        """
+        marginal means (n_samples x m x d) and covariances (n_samples x m x d x d)
+        """
+        mu = self.mu if sample_idxs is None else self.mu[sample_idxs, ...]
+        P = self.marginal_cov(sample_idxs=sample_idxs)
+        if batch_idxs is not None:  #only select some time points
+            mu, P = mu[..., batch_idxs, :], P[..., batch_idxs, :, :]
+        return mu, P
+
+    def log_prob(self, x: Tensor, sample_idxs=None) -> Tensor:
+        """
+        log q(x_t | x_(t-1)) for latents x (n_mc x n_samples x m x d)
+        output is (n_mc x n_samples x m) and sums to log q(x)
+        """
+        mu, B, S = self.prms
+        if sample_idxs is not None:
+            mu, B, S = mu[sample_idxs], B[sample_idxs], S[sample_idxs]
+        z = x - mu
+        w = torch.cat([
+            z[..., :1, :], z[..., 1:, :] - (z[..., :-1, None, :] @ B)[..., 0, :]
+        ],
+                      dim=-2)
+        eps = torch.linalg.solve_triangular(S, w[..., None], upper=False)
+        logdet = torch.log(torch.diagonal(S, dim1=-2, dim2=-1)).sum(-1)
+        return -0.5 * (torch.square(eps[..., 0]).sum(-1) +
+                       self.d * np.log(2 * np.pi)) - logdet
+
+    def kl(self, prior, batch_idxs=None, sample_idxs=None):
+        """
+        KL divergence to the linear dynamical system prior
+        x_t = x_(t-1) A + N(0, Q Q^T) (lpriors.DS), computed analytically.
+        As in lpriors.DS, there is no prior over the initial point.
+        Output is (n_samples)
+        """
+        A, Q = prior.prms
+        mu, B, S = self.prms
+        if sample_idxs is not None:
+            mu, B, S = mu[sample_idxs], B[sample_idxs], S[sample_idxs]
+        d, m = self.d, mu.shape[-2]
+        P = self.marginal_cov(sample_idxs=sample_idxs)  #(n_samples x m x d x d)
+
+        Qinv = torch.linalg.solve_triangular(Q,
+                                             torch.eye(d).to(Q.device),
+                                             upper=False)
+        W = Qinv.transpose(-1, -2) @ Qinv  #prior innovation precision
+
+        #mean and covariance of the prior innovations r_t = x_t - x_(t-1) A
+        mr = mu[..., 1:, :] - mu[..., :-1, :] @ A  #(n_samples x m-1 x d)
+        BA = B - A
+        Cr = BA.transpose(-1, -2) @ P[..., :-1, :, :] @ BA + (
+            S @ S.transpose(-1, -2))[..., 1:, :, :]  #(n_samples x m-1 x d x d)
+        Er = (mr[..., None, :] @ W @ mr[..., None])[..., 0, 0] + (
+            W * Cr).sum(-1).sum(-1)  #E[r W r^T] (n_samples x m-1)
+
+        neg_ent = -0.5 * m * d * (1 + np.log(2 * np.pi)) - torch.log(
+            torch.diagonal(S, dim1=-2, dim2=-1)).sum(-1).sum(-1)
+        neg_lp = (m - 1) * (0.5 * d * np.log(2 * np.pi) + torch.log(
+            torch.diagonal(Q)).sum()) + 0.5 * Er.sum(-1)
+        kl = neg_ent + neg_lp
+
+        if batch_idxs is not None:
+            kl = kl * len(batch_idxs) / self.m  #scale by batch size
+
+        return kl
+
+    def sample(self,
+               size,
+               Y=None,
+               batch_idxs=None,
+               sample_idxs=None,
+               kmax=5,
+               analytic_kl=False,
+               prior=None):
+        """
+        generate samples and compute the analytic KL to a DS prior
+        (or log q(x) for other priors)
+        """
+        mu: Tensor = self.mu
+        if sample_idxs is not None:
+            mu = mu[sample_idxs, ...]
+        eps = self.noise.randn((size[0],) + mu.shape, mu.device, mu.dtype)
+        x = mu + self.transform(eps, sample_idxs=sample_idxs)
+
+        if (prior is not None) and (prior.name == "DS"):
+            lq = self.kl(prior, batch_idxs=batch_idxs, sample_idxs=sample_idxs)
+        else:
+            lq = self.log_prob(x, sample_idxs=sample_idxs)
+
+        if batch_idxs is not None:  #only select some time points
+            x = x[..., batch_idxs, :]
+            if lq.dim() > 1:
+                lq = lq[..., batch_idxs]
+
+        #(n_mc x n_samples x m x d), (n_samples) or (n_mc x n_samples x m)
+        return x, lq
+
+    def gmu_parameters(self):
+        return [self.mu]
+
+    def concentration_parameters(self):
+        return [self.B, self._S]
+
+    def msg(self, Y=None, batch_idxs=None, sample_idxs=None):
+        mu_mag = torch.sqrt(torch.mean(self.mu**2)).item()
+        sig = torch.median(torch.diagonal(self.S, dim1=-2, dim2=-1)).item()
+        string = (' |mu| {:.3f} | sig {:.3f} |').format(mu_mag, sig)
+        return string
@@ -1,5 +1,6 @@
 from .common import Rdist
-from .relie import (ReLie, ReLieBase)
+from .relie import (ReLie, ReLieBase, AmortisedReLie)
 from .GPbase import GPbase
 from .GP_circ import GP_circ
 from .GP_diag import GP_diag
+from .LDS import LDS
@@ -1,10 +1,10 @@
 import abc
+import numpy as np
 import torch
 from torch import nn, Tensor
 from torch.distributions.multivariate_normal import MultivariateNormal
-from torch.distributions.normal import Normal
 from torch.distributions import transform_to, constraints
-from ..utils import softplus, inv_softplus
+from ..utils import softplus, inv_softplus, Noise, default_noise
 from ..manifolds.base import Manifold
 from .common import Rdist
 from typing import Optional
@@ -18,10 +18,12 @@ class ReLieBase(Rdist):
                  manif: Manifold,
                  f,
                  kmax: int = 5,
-                 diagonal: bool = False):
+                 diagonal: bool = False,
+                 noise: Optional[Noise] = None):
         super(ReLieBase, self).__init__(manif, kmax)
         self.f = f
         self.diagonal = diagonal
+        self.noise = default_noise if noise is None else noise
 
     def lat_prms(self, Y=None, batch_idxs=None, sample_idxs=None):
         gmu, gamma = self.f(Y, batch_idxs, sample_idxs)
@@ -43,6 +45,49 @@ class ReLieBase(Rdist):
         mu = torch.zeros(n_samples, m, self.d).to(gamma.device)
         return MultivariateNormal(mu, scale_tril=gamma)
 
+    @staticmethod
+    def tril_log_prob(x: Tensor, gamma: Tensor) -> Tensor:
+        """
+        log density of N(0, gamma gamma^T) for lower triangular gamma
+        x is (... x d) and gamma is (... x d x d); the output is (...)
+        """
+        d = x.shape[-1]
+        z = torch.linalg.solve_triangular(gamma, x[..., None], upper=False)
+        logdet = torch.log(torch.diagonal(gamma, dim1=-2, dim2=-1)).sum(-1)
+        return -0.5 * (torch.square(z[..., 0]).sum(-1) +
+                       d * np.log(2 * np.pi)) - logdet
+
+    @staticmethod
+    def diag_log_prob(x: Tensor, sig: Tensor) -> Tensor:
+        """
+        elementwise log density of N(0, sig^2)
+        x and sig have matching trailing dimensions
+        """
+        return -0.5 * (torch.square(x / sig) +
+                       np.log(2 * np.pi)) - torch.log(sig)
+
+    def log_q(self, x: Tensor, gamma: Tensor) -> Tensor:
+        """
+        log density of the variational distribution for samples x
+        x is (n_mc x n_samples x m x d) and gamma is (n_samples x m x d x d)
+        output is (n_mc x n_samples x m)
+        """
+        if self.diagonal:  #each dimension is independent
+            sig = torch.diagonal(gamma, dim1=-2, dim2=-1)  #(n_samples x m x d)
+            return self.manif.log_q(lambda y: self.diag_log_prob(y, sig),
+                                    x,
+                                    self.manif.d,
+                                    self.kmax,
+                                    scale=sig,
+                                    diagonal=True)
+        #compute entropy with full covariance matrix
+        scale = torch.sqrt(torch.square(gamma).sum(-1))  #marginal std
+        return self.manif.log_q(lambda y: self.tril_log_prob(y, gamma),
+                                x,
+                                self.manif.d,
+                                self.kmax,
+                                scale=scale)
+
     def sample(self,
                size,
                Y=None,
@@ -55,22 +100,16 @@ class ReLieBase(Rdist):
         generate samples and computes its log entropy
         """
         gmu, gamma = self.lat_prms(Y, batch_idxs, sample_idxs)
-        q = self.mvn(gamma)
         # sample a batch with dims: (n_mc x n_samples x batch_size x d)
-        x = q.rsample(size)
-        m = x.shape[-2]
-        mu = torch.zeros(m).to(gamma.device)[..., None]
-        if self.diagonal:  #compute diagonal covariance
-            lq = torch.stack([
-                self.manif.log_q(
-                    Normal(mu, gamma[..., j, j][..., None]).log_prob,
-                    x[..., j, None], 1, self.kmax).sum(dim=-1)
-                for j in range(self.d)
-            ]).sum(dim=0)
-        else:  #compute entropy with full covariance matrix
-            lq = self.manif.log_q(q.log_prob, x, self.manif.d, self.kmax)
-
-        gtilde = self.manif.expmap(x)
+        eps = self.noise.randn(
+            torch.Size(size) + gamma.shape[:-1], gamma.device, gamma.dtype)
+        if self.diagonal:
+            x = torch.diagonal(gamma, dim1=-2, dim2=-1) * eps
+        else:
+            x = (gamma @ eps[..., None])[..., 0]
+        lq = self.log_q(x, gamma)
+
+        gtilde = self.manif.expmap(x, noise=self.noise)
         # apply g_mu with dims: (n_mc x m x d)
         g = self.manif.gmul(gmu, gtilde)
         return g, lq
@@ -177,7 +216,8 @@ class ReLie(ReLieBase):
                  diagonal=False,
                  mu=None,
                  initialization: Optional[str] = 'random',
-                 Y=None):
+                 Y=None,
+                 noise: Optional[Noise] = None):
         """
         Parameters
         ----------
@@ -198,6 +238,8 @@ class ReLie(ReLieBase):
             initialization of the vartiational means (n_samples x m x d2)
         Y : Optional[np.ndarray]
             data used to initialize latents (n x m)
+        noise : Optional[mgplvm.utils.Noise]
+            noise source used for sampling (defaults to mgplvm.utils.default_noise)
             
         Notes
         -----
@@ -211,7 +253,149 @@ class ReLie(ReLieBase):
 
         f = _F(manif, m, n_samples, kmax, sigma, gamma, fixed_gamma, diagonal,
                mu, initialization, Y)
-        super(ReLie, self).__init__(manif, f, kmax, diagonal)
+        super(ReLie, self).__init__(manif, f, kmax, diagonal, noise)
+
+    @property
+    def prms(self):
+        return self.f.prms
+
+
+class _Encoder(Module):
+
+    def __init__(self,
+                 manif: Manifold,
+                 n: int,
+                 n_hidden: int = 64,
+                 n_layers: int = 2,
+                 kernel_size: int = 5,
+                 sigma: float = 1.5,
+                 diagonal=False):
+
+        super(_Encoder, self).__init__()
+        self.manif = manif
+        self.diagonal = diagonal
+        d, d2 = manif.d, manif.d2
+        self.n_gamma = d if diagonal else d * (d + 1) // 2
+        self.tril_idxs = torch.tril_indices(d, d)
+
+        #temporal convolutions with the neurons as input channels
+        layers = []
+        for i in range(n_layers):
+            layers += [
+                nn.Conv1d(n if i == 0 else n_hidden,
+                          n_hidden,
+                          kernel_size,
+                          padding=kernel_size // 2),
+                nn.ReLU()
+            ]
+        self.net = nn.Sequential(*layers)
+        self.mu_layer = nn.Conv1d(n_hidden, d2, 1)
+        self.gamma_layer = nn.Conv1d(n_hidden, self.n_gamma, 1)
+
+        #initialize close to gamma = sigma I
+        bias = self.gamma_layer.bias
+        assert (bias is not None)
+        with torch.no_grad():
+            self.gamma_layer.weight.mul_(0.01)
+            bias.zero_()
+            if diagonal:  #softplus
+                bias.fill_(inv_softplus(torch.tensor(sigma)))
+            else:  #the diagonal of constraints.lower_cholesky is exp
+                diag = (self.tril_idxs[0] == self.tril_idxs[1])
+                bias[diag] = np.log(sigma)
+
+    def forward(self, Y=None, batch_idxs=None, sample_idxs=None):
+        """
+        Y is the data of the samples and time points being fitted
+        (len(sample_idxs) x n x len(batch_idxs))
+        """
+        if Y is None:
+            raise Exception("the encoder requires data Y (n_samples x n x m)")
+        if (sample_idxs is not None) and (Y.shape[0] != len(sample_idxs)):
+            raise Exception("Y must only contain the samples in sample_idxs")
+        if batch_idxs is not None:
+            if Y.shape[-1] != len(batch_idxs):
+                raise Exception(
+                    "Y must only contain the time points in batch_idxs")
+            if np.any(np.diff(np.array(batch_idxs)) != 1):
+                raise Exception(
+                    "the encoder requires batches of consecutive time points (e.g. BatchDataLoader without shuffle_batch)"
+                )
+        #(n_samples x c x m) -> (n_samples x m x c)
+        h = self.net(Y)
+        gmu = self.manif.parameterise(self.mu_layer(h).transpose(-1, -2))
+        gamma = self.gamma_layer(h).transpose(-1, -2)
+
+        if self.diagonal:
+            gamma = torch.diag_embed(softplus(gamma))
+        else:
+            tril = torch.zeros(gamma.shape[:-1] + (self.manif.d, self.manif.d))
+            tril = tril.to(gamma)
+            tril[..., self.tril_idxs[0], self.tril_idxs[1]] = gamma
+            gamma = transform_to(constraints.lower_cholesky)(tril)
+        return gmu, gamma
+
+    @property
+    def prms(self):
+        return list(self.parameters())
+
+    def gmu_parameters(self):
+        return list(self.net.parameters()) + list(self.mu_layer.parameters())
+
+    def concentration_parameters(self):
+        return list(self.gamma_layer.parameters())
+
+
+class AmortisedReLie(ReLieBase):
+    name = "AmortisedReLie"
+
+    def __init__(self,
+                 manif: Manifold,
+                 n: int,
+                 kmax: int = 5,
+                 sigma: float = 1.5,
+                 diagonal=False,
+                 n_hidden: int = 64,
+                 n_layers: int = 2,
+                 kernel_size: int = 5,
+                 noise: Optional[Noise] = None):
+        """
+        Parameters
+        ----------
+        manif: Manifold
+            manifold of ReLie
+        n : int
+            number of neurons (input channels of the encoder)
+        kmax : Optional[int]
+            number of terms used in the ReLie approximation is (2kmax+1)
+        sigma : Optional[float]
+            initial diagonal std of the variational distribution
+        diagonal : bool
+            if True, constrain the covariance to be diagonal
+        n_hidden : int
+            number of channels of the hidden layers
+        n_layers : int
+            number of temporal convolution layers
+        kernel_size : int
+            width of the temporal convolutions (odd)
+        noise : Optional[mgplvm.utils.Noise]
+            noise source used for sampling (defaults to mgplvm.utils.default_noise)
+
+        Notes
+        -----
+        The variational parameters (gmu, gamma) of each time point are the
+        output of a temporal convolutional network applied to the data
+        (n_samples x n x m), so the number of parameters does not depend on
+        the number of samples or time points and latents of new data are
+        inferred with a single forward pass (lat_prms(Y)).
+        The receptive field of each time point is n_layers * (kernel_size-1) + 1
+        time points, and the data is zero-padded at the edges of each batch.
+        Batches must therefore consist of consecutive time points (the
+        default of BatchDataLoader) and the data passed in is the data of the
+        batch.
+        """
+        f = _Encoder(manif, n, n_hidden, n_layers, kernel_size, sigma, diagonal)
+        super(AmortisedReLie, self).__init__(manif, f, kmax, diagonal, noise)
 
     @property
     def prms(self):
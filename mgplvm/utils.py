@@ -1,5 +1,5 @@
 import torch
-from typing import Optional
+from typing import Dict, Optional
 
 default_jitter = 1E-8
 
@@ -21,3 +21,73 @@ def get_device(device: str = "cuda"):
         import os
         os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
     return mydevice
+
+
+class Noise:
+
+    def __init__(self, seed: Optional[int] = None):
+        """
+        Source of standard normal noise generated directly on the target device
+
+        Parameters
+        ----------
+        seed : Optional[int]
+            seed for the random number generators
+            if None, the global torch random number generators are used
+
+        Notes
+        -----
+        A seeded instance keeps a separate torch.Generator for each device so that
+        models holding their own Noise instance are reproducible independently of
+        each other and of the global random state.
+        """
+        self.seed = seed
+        self.generators: Dict[torch.device, torch.Generator] = {}
+
+    def __getstate__(self):
+        #generators cannot be pickled but their states can
+        states = {
+            str(device): gen.get_state()
+            for device, gen in self.generators.items()
+        }
+        return {'seed': self.seed, 'states': states}
+
+    def __setstate__(self, state):
+        self.seed = state['seed']
+        self.generators = {}
+        for device, gen_state in state['states'].items():
+            gen = torch.Generator(device=device)
+            gen.set_state(gen_state)
+            self.generators[torch.device(device)] = gen
+
+    def manual_seed(self, seed: int):
+        """reseed the generators on all devices"""
+        self.seed = seed
+        for gen in self.generators.values():
+            gen.manual_seed(seed)
+
+    def generator(self, device) -> Optional[torch.Generator]:
+        if self.seed is None:
+            return None  #global generator
+        device = torch.device(device)
+        if device not in self.generators:
+            gen = torch.Generator(device=device)
+            gen.manual_seed(self.seed)
+            self.generators[device] = gen
+        return self.generators[device]
+
+    def randn(self,
+              shape,
+              device=None,
+              dtype: Optional[torch.dtype] = None) -> torch.Tensor:
+        """
+        draw N(0, 1) noise of a given shape on device
+        """
+        device = torch.device('cpu') if device is None else torch.device(device)
+        dtype = torch.get_default_dtype() if dtype is None else dtype
+        shape = torch.Size(shape)
+        gen = self.generator(device)
+        return torch.randn(shape, generator=gen, device=device, dtype=dtype)
+
+
+default_noise = Noise()
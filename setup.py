@@ -8,6 +8,6 @@ setup(name='mGPLVM',
       description='Pytorch implementation of mGPLVM and bGPFA',
       license='MIT',
       install_requires=[
-          'numpy', 'torch==1.7.1', 'scipy>=1.0.0', 'scikit-learn', 'matplotlib'
+          'numpy', 'torch==1.13.1', 'scipy>=1.0.0', 'scikit-learn', 'matplotlib'
       ],
       packages=find_packages())
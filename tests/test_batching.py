@@ -4,6 +4,9 @@ from torch import optim
 import mgplvm as mgp
 import matplotlib.pyplot as plt
 import scipy.stats
+import copy
+import os
+import tempfile
 
 torch.manual_seed(1)
 np.random.seed(0)
@@ -200,7 +203,61 @@ def test_svgp_batching():
         assert err < 1e-3
 
 
+def test_fit_distributed():
+    """
+    test that data-parallel training over trials gives the same parameters
+    as training in a single process (with a deterministic loss)
+    """
+    d, n, m, n_samples = 2, 8, 15, 3
+    Y = np.random.normal(0, 1, (n_samples, n, m))
+    data = torch.tensor(Y, dtype=torch.get_default_dtype())
+    ts = torch.arange(m)[None, None, :].repeat(n_samples, 1, 1).to(data)
+    manif = mgp.manifolds.Euclid(m, d)
+    lat_dist = mgp.rdist.GP_diag(manif, m, n_samples, ts)
+    mod = mgp.models.Lvgplvm(n, m, d, n_samples, lat_dist,
+                             mgp.lpriors.Null(manif),
+                             mgp.likelihoods.Gaussian(n))
+    mod_dist = copy.deepcopy(mod)
+    kwargs = dict(max_steps=10,
+                  n_mc=1,
+                  lrate=5e-2,
+                  analytic_lik=True,
+                  print_every=1000)
+
+    progress = mgp.optimisers.svgp.fit(data, mod, **kwargs)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ckpt.pt')
+        #uneven shards of trials and batches of time points
+        progress_dist = mgp.optimisers.fit_distributed(data,
+                                                       mod_dist,
+                                                       world_size=2,
+                                                       batch_size=m,
+                                                       checkpoint=path,
+                                                       checkpoint_every=4,
+                                                       **kwargs)
+        #only the first worker writes the checkpoint, with all trials
+        ckpt = torch.load(path, weights_only=False)
+        assert sorted(os.listdir(tmp)) == ['ckpt.pt']
+    assert np.allclose(progress, progress_dist)
+    for (name, p), p_dist in zip(mod.named_parameters(), mod_dist.parameters()):
+        assert torch.allclose(p, p_dist), name
+    assert ckpt['step'] == 10
+    for (name, p) in mod_dist.state_dict().items():
+        assert torch.equal(p, ckpt['model'][name]), name
+
+    #callbacks would act on the shard of each worker
+    try:
+        mgp.optimisers.fit_distributed(data,
+                                       mod_dist,
+                                       callbacks=[mgp.optimisers.PlateauStop()],
+                                       **kwargs)
+        raise AssertionError('fit_distributed ran with a callback')
+    except Exception as e:
+        assert 'callbacks are not supported' in str(e)
+
+
 if __name__ == '__main__':
     test_svgp_batching()
     test_svgplvm_batching()
     test_batch_training()
+    test_fit_distributed()
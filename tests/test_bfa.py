@@ -1,5 +1,6 @@
 import torch
 import mgplvm as mgp
+from torch.distributions import transform_to, constraints
 
 
 def test_fa():
@@ -77,6 +78,24 @@ def test_bfa_cov():
     assert torch.allclose(slow_cov, cov)
 
 
+def test_bfa_log_prob():
+    n_mc, n_samples, m, n, d = 3, 2, 30, 5, 3
+    bfa = mgp.models.Bfa(n,
+                         d,
+                         sigma=torch.rand(n) + 0.5,
+                         learn_neuron_scale=True,
+                         ard=True)
+    with torch.no_grad():
+        bfa._neuron_scale.normal_()
+        bfa._dim_scale.normal_()
+    x = torch.randn(n_mc, n_samples, d, m)
+    y = torch.randn(n_samples, n, m)
+    lp = bfa.log_prob(y, x)
+    assert lp.shape == (n_mc, n_samples, n)
+    #compare with the low rank MVN over time points
+    assert torch.allclose(lp, bfa._dist(x).log_prob(y), rtol=1e-4)
+
+
 def test_bvfa():
     n_samples = 2
     m = 200
@@ -114,8 +133,105 @@ def test_bvfa():
     assert (err < 5e-3)
 
 
+def test_bvfa_moments():
+    n_samples, m, n, d = 2, 20, 5, 3
+    lik = mgp.likelihoods.Gaussian(n)
+    for tied in [True, False]:
+        model = mgp.models.Bvfa(n,
+                                d,
+                                m,
+                                n_samples,
+                                lik,
+                                tied_samples=tied,
+                                learn_neuron_scale=True,
+                                ard=True)
+        with torch.no_grad():
+            model._q_mu.normal_()
+            model._q_sqrt.normal_(std=0.3)
+            model._neuron_scale.normal_()
+            model._dim_scale.normal_()
+
+        #closed form KL
+        q_mu, q_sqrt = model.prms
+        q = torch.distributions.MultivariateNormal(q_mu, scale_tril=q_sqrt)
+        p = torch.distributions.MultivariateNormal(torch.zeros(n, d),
+                                                   scale_tril=torch.eye(d))
+        kl = torch.distributions.kl_divergence(q, p)
+        assert torch.allclose(model.prior_kl(), kl, rtol=1e-4)
+
+        y = torch.randn(n_samples, n, m)
+        x_mu = torch.randn(n_samples, d, m)
+        L = torch.randn(n_samples, m, d, d) * 0.3
+        x_cov = L @ L.transpose(-1, -2)
+
+        #deterministic latents
+        lik_mom, kl_mom = model.elbo_moments(y, x_mu, 0 * x_cov)
+        lik_mc, kl_mc = model.elbo(y, x_mu[None, ...])
+        assert torch.allclose(lik_mom, lik_mc[0], rtol=1e-4)
+        assert torch.allclose(kl_mom, kl_mc)
+
+        #Monte Carlo average over Gaussian latents
+        eps = torch.randn(20000, n_samples, m, d, 1)
+        x = x_mu + (L[None, ...] @ eps)[..., 0].transpose(-1, -2)
+        lik_mom, _ = model.elbo_moments(y, x_mu, x_cov)
+        lik_mc, _ = model.elbo(y, x)
+        assert torch.allclose(lik_mom, lik_mc.mean(0), rtol=1e-2)
+
+
+def test_bvfa_streaming():
+    """
+    with the exact posterior of a first chunk as prior, the ELBO of a second
+    chunk differs from the ELBO of both chunks by a constant (log p(y1))
+    """
+    m1, m2, n, d = 15, 10, 4, 2
+    lik = mgp.likelihoods.Gaussian(n, learn_sigma=False)
+    sig2 = lik.prms[:, None, None]  #(n x 1 x 1)
+    x1, x2 = torch.randn(1, d, m1), torch.randn(1, d, m2)
+    y1, y2 = torch.randn(1, n, m1), torch.randn(1, n, m2)
+
+    stream = mgp.models.Bvfa(n, d, m1, 1, lik)
+    joint = mgp.models.Bvfa(n, d, m1 + m2, 1, lik)
+
+    #exact posterior over the loadings given the first chunk
+    with torch.no_grad():
+        a = stream.scale * stream.dim_scale
+        xs = a * x1[0]  #(d x m1)
+        prec = torch.eye(d) + xs @ xs.T / sig2  #(n x d x d)
+        cov = torch.linalg.inv(prec)
+        mu = (cov @ (xs @ y1[0].T).T[..., None] / sig2)[..., 0]
+        stream._q_mu.data = mu[None, ...]
+        stream._q_sqrt.data = transform_to(constraints.lower_cholesky).inv(
+            torch.linalg.cholesky(cov))[None, ...]
+    stream.posterior_as_prior()
+    assert torch.allclose(stream.prior_kl(), torch.zeros(1, n), atol=1e-5)
+    stream.m = m2
+
+    diffs = []
+    for i in range(2):
+        q_mu, q_sqrt = torch.randn(1, n, d), torch.randn(1, n, d, d)
+        for mod in [stream, joint]:
+            mod._q_mu.data = q_mu
+            mod._q_sqrt.data = q_sqrt
+        lik_s, kl_s = stream.elbo(y2, x2[None, ...])
+        lik_j, kl_j = joint.elbo(torch.cat([y1, y2], -1),
+                                 torch.cat([x1, x2], -1)[None, ...])
+        diffs.append((lik_s - kl_s) - (lik_j - kl_j))
+    assert torch.allclose(diffs[0], diffs[1], rtol=1e-4)
+
+    #the prior is saved and restored with the state dict
+    new = mgp.models.Bvfa(n, d, m2, 1, lik)
+    new.load_state_dict(stream.state_dict())
+    assert torch.allclose(new.prior_kl(), stream.prior_kl())
+    #and removed when loading a state without a prior
+    new.load_state_dict(joint.state_dict())
+    assert new.prior_mu is None and new.prior_sqrt is None
+
+
 if __name__ == '__main__':
     test_fa()
     test_bfa()
     test_bfa_cov()
+    test_bfa_log_prob()
+    test_bvfa_moments()
+    test_bvfa_streaming()
     test_bvfa()
@@ -140,9 +140,50 @@ def test_s3(kmax=5, savefig=False):
     assert np.abs(H[0] - Hgauss[0]) < std[0]  # adhere to lower bound
 
 
+def test_relie_log_q(kmax=3):
+    """compare the fused ReLie entropy to torch.distributions"""
+    m, n_samples, n_mc = 10, 2, 5
+    for manif_type in [Euclid, Torus, So3]:
+        for diagonal in ([False] if manif_type == So3 else [True, False]):
+            manif = manif_type(m, 3)
+            sigmas = torch.rand(n_samples, m, manif.d) + 0.2
+            lat_dist = rdist.ReLie(manif,
+                                   m,
+                                   n_samples,
+                                   kmax=kmax,
+                                   diagonal=diagonal,
+                                   gamma=sigmas)
+            if not diagonal:  #add off-diagonal elements
+                lat_dist.f.gamma.data += 0.2 * torch.tril(
+                    torch.randn(n_samples, m, manif.d, manif.d), -1)
+            gamma = lat_dist.lat_gamma()
+            q = lat_dist.mvn(gamma)
+            x = q.rsample(torch.Size([n_mc]))
+
+            if diagonal:
+                lq_ref = torch.stack([
+                    manif.log_q(
+                        torch.distributions.Normal(0, gamma[..., j, j,
+                                                            None]).log_prob,
+                        x[..., j, None], 1, kmax).sum(-1)
+                    for j in range(manif.d)
+                ]).sum(0)
+            else:
+                lq_ref = manif.log_q(q.log_prob, x, manif.d, kmax)
+
+            lq = lat_dist.log_q(x, gamma)
+            assert lq.shape == (n_mc, n_samples, m)
+            assert torch.allclose(lq, lq_ref)
+
+            g, lq = lat_dist.sample(torch.Size([n_mc]))
+            assert g.shape == (n_mc, n_samples, m, manif.d2)
+            assert lq.shape == (n_mc, n_samples, m)
+
+
 if __name__ == "__main__":
     test_euclid()
     test_torus()
     test_so3()
     test_s3()
+    test_relie_log_q()
     print('Tested entropies')
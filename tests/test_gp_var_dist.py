@@ -1,3 +1,5 @@
+import pickle
+import warnings
 import matplotlib.pyplot as plt
 import numpy as np
 import torch
@@ -40,6 +42,144 @@ def test_K_half():
     return
 
 
+def test_irregular_ts():
+    """check that dropped timepoints are read out of the regular grid"""
+    n_samples, m, d, n_mc = 2, 30, 2, 3
+    ts = torch.arange(2 * m)[None, None, :].repeat(n_samples, 1, 1)
+    ts = ts.to(torch.get_default_dtype())
+    #drop frames and use a double-width bin for each sample
+    keep = [np.sort(np.random.permutation(m)[:m - 6]) for _ in range(n_samples)]
+    ts_irr = torch.stack([ts[i, :, keep[i]] for i in range(n_samples)])
+    ts_irr[:, :, -1] = ts_irr[:, :, -2] + 2
+    m_irr = ts_irr.shape[-1]
+    manif = mgp.manifolds.Euclid(m, d)
+
+    for lat_type in [mgp.rdist.GP_circ, mgp.rdist.GP_diag]:
+        lat_irr = lat_type(manif, m_irr, n_samples, ts_irr, ell=4.)
+        grid_idxs = (ts_irr - ts_irr[..., :1])[:, 0, :].long()
+        m_grid = grid_idxs.max().item() + 1
+        assert lat_irr.m_grid == m_grid
+        #the same distribution on the full grid
+        lat = lat_type(manif, m_grid, n_samples, ts[..., :m_grid], ell=4.)
+        lat.load_state_dict(lat_irr.state_dict(), strict=False)
+
+        g, _ = lat_irr.sample(torch.Size([n_mc]))
+        assert g.shape == (n_mc, n_samples, m_irr, d)
+        for i in range(n_samples):
+            mu = lat.lat_mu[i, grid_idxs[i], :]
+            assert torch.allclose(lat_irr.lat_mu[i], mu)
+            cov = lat.full_cov()[i][:, grid_idxs[i], :][..., grid_idxs[i]]
+            assert torch.allclose(lat_irr.full_cov()[i], cov)
+        assert torch.allclose(lat_irr.kl(), lat.kl())
+
+        #noise is drawn independently for each trial
+        lat._nu.data = torch.zeros(lat._nu.shape)
+        g, _ = lat.sample(torch.Size([n_mc]))
+        assert not torch.allclose(g[:, 0, ...], g[:, 1, ...])
+
+    #timepoints that are not on a regular grid are not supported
+    ts_bad = ts[..., :m].clone()
+    ts_bad[..., -1] = ts_bad[..., -2] + 1.5
+    try:
+        mgp.rdist.GP_circ(manif, m, n_samples, ts_bad)
+        raise AssertionError('irregular timepoints were not detected')
+    except Exception as e:
+        assert 'regular grid' in str(e)
+
+
+def test_grid_embedding():
+    """check the grid embedding of long float32 recordings"""
+    m = 30000
+    ts = (torch.arange(m, dtype=torch.float64) / 30).float()  #30 Hz
+    keep = np.sort(np.random.permutation(m)[:m - 300])
+    keep[0] = 0
+    for idxs in [np.arange(m), keep]:
+        grid_idxs, dt = mgp.rdist.GPbase.grid_embedding(ts[None, None, idxs])
+        assert torch.equal(grid_idxs[0], torch.tensor(idxs))
+        assert np.abs(dt - 1 / 30) < 1e-9
+
+    #a single small time difference gives a large grid
+    ts = torch.cat([torch.zeros(1), 1e-3 + torch.arange(20.)])[None, None, :]
+    manif = mgp.manifolds.Euclid(21, 1)
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter('always')
+        mgp.rdist.GP_diag(manif, 21, 1, ts)
+    assert any('regular grid' in str(wi.message) for wi in w)
+
+
+def test_circ_kl():
+    """check the circulant KL against a dense computation for a subset of samples"""
+    n_samples, d = 4, 2
+    sample_idxs = [1, 3]
+    for m in [20, 21]:
+        ts = torch.arange(m)[None, None, :].repeat(n_samples, 1, 1)
+        manif = mgp.manifolds.Euclid(m, d)
+        lat_dist = mgp.rdist.GP_circ(manif,
+                                     m,
+                                     n_samples,
+                                     ts.to(torch.get_default_dtype()),
+                                     ell=3.)
+        lat_dist._c.data = torch.randn(lat_dist._c.shape)
+        lat_dist._scale.data = torch.randn(lat_dist._scale.shape)
+        lat_dist._nu.data = torch.randn(lat_dist._nu.shape)
+
+        #KL(N(nu, I I^T) || N(0, 1)) since the K_half terms cancel
+        I = lat_dist.I_v(torch.diag_embed(torch.ones(n_samples, d, m)))
+        q = torch.distributions.MultivariateNormal(lat_dist.nu,
+                                                   I @ I.transpose(-1, -2))
+        p = torch.distributions.MultivariateNormal(torch.zeros(m), torch.eye(m))
+        kl_true = torch.distributions.kl.kl_divergence(q, p)
+
+        kl = lat_dist.kl(sample_idxs=sample_idxs)
+        assert kl.shape == (len(sample_idxs), d)
+        assert torch.allclose(kl, kl_true[sample_idxs, ...])
+
+
+def test_seeded_noise():
+    """check that models with a seeded noise source sample reproducibly"""
+    n_samples, m, d, n_mc = 2, 20, 2, 5
+    ts = torch.arange(m)[None, None, :].repeat(n_samples, 1, 1)
+    ts = ts.to(torch.get_default_dtype())
+    manif = mgp.manifolds.Euclid(m, d)
+    gs = []
+    for _ in range(2):
+        lat_dist = mgp.rdist.GP_circ(manif,
+                                     m,
+                                     n_samples,
+                                     ts,
+                                     noise=mgp.utils.Noise(seed=1))
+        lat_dist._nu.data = torch.zeros(lat_dist._nu.shape)
+        torch.randn(10)  #global random state does not matter
+        gs.append(lat_dist.sample(torch.Size([n_mc]))[0])
+    assert torch.allclose(gs[0], gs[1])
+
+    q = mgp.manifolds.So3.expmap(torch.zeros(n_mc, 3),
+                                 noise=mgp.utils.Noise(seed=1))
+    assert torch.allclose(torch.norm(q, dim=-1), torch.ones(n_mc))
+
+    #including the jitter of the SO(3) expmap, also in product manifolds
+    so3 = mgp.manifolds.So3(m, 3)
+    for manif in [
+            so3, mgp.manifolds.Product([so3, mgp.manifolds.Euclid(m, d)])
+    ]:
+        gs = []
+        for seed in range(2):
+            torch.manual_seed(0)  #same initialization
+            lat_dist = mgp.rdist.ReLie(manif,
+                                       m,
+                                       n_samples,
+                                       noise=mgp.utils.Noise(seed=1))
+            torch.manual_seed(seed)
+            gs.append(lat_dist.sample(torch.Size([n_mc]))[0])
+        assert torch.equal(gs[0], gs[1])
+
+    #pickled noise continues the same random sequence
+    noise = mgp.utils.Noise(seed=1)
+    noise.randn((n_mc, 3))
+    noise_copy = pickle.loads(pickle.dumps(noise))
+    assert torch.allclose(noise.randn((n_mc, 3)), noise_copy.randn((n_mc, 3)))
+
+
 def test_GP_lat_prior():
     device = mgp.utils.get_device("cuda")  # get_device("cpu")
     d = 2  # dims of latent space
@@ -140,6 +280,90 @@ def test_GP_lat_prior():
         assert torch.allclose(kl, kl_true)
 
 
+def test_LDS_kl():
+    """compare the recursive LDS computations with dense Gaussians"""
+    n_samples, m, d, n = 2, 6, 2, 5
+    manif = mgp.manifolds.Euclid(m, d)
+    lat = mgp.rdist.LDS(manif, m, n_samples)
+    with torch.no_grad():
+        lat.mu.normal_()
+        lat.B.normal_(std=0.5)
+        lat._S.normal_(std=0.3)
+    prior = mgp.lpriors.DS(manif)
+    with torch.no_grad():
+        prior._W.normal_()
+        prior._lam.normal_()
+    A, Q = prior.prms
+
+    #dense covariance from the linear map eps -> z (n_samples x md x md)
+    eye = torch.eye(m * d).reshape(m * d, 1, m, d).repeat(1, n_samples, 1, 1)
+    J = lat.transform(eye).reshape(m * d, n_samples, m * d).permute(1, 2, 0)
+    cov = J @ J.transpose(-1, -2)
+    P = lat.marginal_cov()
+    for t in range(m):
+        assert torch.allclose(P[:, t], cov[:, t * d:(t + 1) * d,
+                                           t * d:(t + 1) * d])
+
+    #the parallel scans match the sequential recursions over time
+    for m_seq in [6, 7]:
+        lat_seq = mgp.rdist.LDS(mgp.manifolds.Euclid(m_seq, d), m_seq,
+                                n_samples)
+        with torch.no_grad():
+            lat_seq.B.normal_(std=0.5)
+            lat_seq._S.normal_(std=0.3)
+        B, S = lat_seq.B[[1]], lat_seq.S[[1]]
+        eps = torch.randn(3, 1, m_seq, d)
+        w = (S @ eps[..., None])[..., 0]
+        zs, Ps = [w[..., 0, :]], [S[:, 0] @ S[:, 0].transpose(-1, -2)]
+        for t in range(1, m_seq):
+            zs.append((zs[-1][..., None, :] @ B[:, t - 1])[..., 0, :] +
+                      w[..., t, :])
+            Ps.append(B[:, t - 1].transpose(-1, -2) @ Ps[-1] @ B[:, t - 1] +
+                      S[:, t] @ S[:, t].transpose(-1, -2))
+        assert torch.allclose(lat_seq.transform(eps, sample_idxs=[1]),
+                              torch.stack(zs, -2))
+        assert torch.allclose(lat_seq.marginal_cov(sample_idxs=[1]),
+                              torch.stack(Ps, -3))
+
+    #log q(x) matches the dense Gaussian
+    mu = lat.mu.reshape(n_samples, m * d)
+    q = torch.distributions.MultivariateNormal(mu, cov)
+    x = q.sample(torch.Size([3]))
+    lq = lat.log_prob(x.reshape(3, n_samples, m, d)).sum(-1)
+    assert torch.allclose(lq, q.log_prob(x))
+
+    #KL to the (improper) DS prior from its dense precision
+    R = torch.eye(m * d).reshape(m * d, m, d)
+    R = (R[:, 1:, :] - R[:, :-1, :] @ A).reshape(m * d, (m - 1) * d)
+    W = torch.block_diag(*[torch.inverse(Q @ Q.T)] * (m - 1))
+    prec = R @ W @ R.T
+    neg_lp = (m - 1) * (0.5 * d * np.log(2 * np.pi) + torch.log(
+        torch.diagonal(Q)).sum()) + 0.5 * (
+            (mu[..., None, :] @ prec @ mu[..., None])[..., 0, 0] +
+            (prec * cov).sum(-1).sum(-1))
+    kl_dense = neg_lp - q.entropy()
+    assert torch.allclose(lat.kl(prior), kl_dense)
+
+    #the LDS posterior can be fitted with a DS prior
+    Y = np.random.normal(0, 1, (n_samples, n, m))
+    data = torch.tensor(Y)
+    kernel = mgp.kernels.QuadExp(n, manif.distance, Y=Y)
+    lik = mgp.likelihoods.Gaussian(n)
+    z = manif.inducing_points(n, 4)
+    mod = mgp.models.SvgpLvm(n, m, n_samples, z, kernel, lik, lat, prior)
+    mgp.optimisers.svgp.fit(data,
+                            mod,
+                            optimizer=optim.Adam,
+                            n_mc=4,
+                            max_steps=5,
+                            print_every=1000)
+
+
 if __name__ == '__main__':
     test_K_half()
+    test_irregular_ts()
+    test_grid_embedding()
+    test_circ_kl()
+    test_seeded_noise()
+    test_LDS_kl()
     test_GP_lat_prior()
@@ -173,6 +173,72 @@ def test_linear_kernel():
     assert np.allclose(K_, K)
 
 
+def test_quad_exp_manifold_distances():
+    """check the in-place kernel evaluation and its gradients on each manifold"""
+    n, mx, my = 4, 6, 5
+    references = {
+        'Euclid':
+            lambda x, y: ((x[..., None] - y[..., None, :])**2).sum(-3),
+        'Torus':
+            lambda x, y:
+            (2 - 2 * torch.cos(x[..., None] - y[..., None, :])).sum(-3),
+        'So3':
+            lambda x, y: 4 * (1 - (x.transpose(-1, -2) @ y)**2),
+        'S3':
+            lambda x, y: 2 * (1 - x.transpose(-1, -2) @ y),
+    }
+    for manif in [
+            mgplvm.manifolds.Euclid(mx, 2),
+            mgplvm.manifolds.Torus(mx, 2),
+            mgplvm.manifolds.So3(mx),
+            mgplvm.manifolds.S3(mx)
+    ]:
+        name = type(manif).__name__
+        x = manif.expmap(torch.randn(n, mx, manif.d)).transpose(-1, -2)
+        y = manif.expmap(torch.randn(n, my, manif.d)).transpose(-1, -2)
+        x.requires_grad_()
+        kernel = QuadExp(n, manif.distance, scale=np.random.rand(n) + 0.5)
+        K = kernel(x, y)
+
+        scale_sqr, ell = kernel.prms
+        dist = references[name](x, y) / ell[:, None, None]**2
+        Kref = scale_sqr[:, None, None] * torch.exp(-0.5 * dist)
+        assert torch.allclose(K, Kref)
+
+        grads = torch.autograd.grad(K.sum(), [x, kernel._scale_sqr])
+        grads_ref = torch.autograd.grad(Kref.sum(), [x, kernel._scale_sqr])
+        for g, g_ref in zip(grads, grads_ref):
+            assert torch.allclose(g, g_ref)
+
+
+def test_combination_kernels():
+    """product and sum kernels on the factors of a product manifold"""
+    n, mx, my = 4, 6, 5
+    t2, so3 = mgplvm.manifolds.Torus(mx, 2), mgplvm.manifolds.So3(mx)
+    manif = mgplvm.manifolds.Product([t2, so3])
+    x = manif.expmap(torch.randn(n, mx, manif.d)).transpose(-1, -2)
+    y = manif.expmap(torch.randn(n, my, manif.d)).transpose(-1, -2)
+    k1 = QuadExp(n, t2.distance, scale=np.ones(n))
+    k2 = QuadExp(n, so3.distance, scale=np.random.rand(n) + 0.5)
+    K1, K2 = k1(x[..., :2, :], y[..., :2, :]), k2(x[..., 2:, :], y[..., 2:, :])
+
+    kprod = mgplvm.kernels.Product([k1, k2], dims=manif.d2s)
+    ksum = mgplvm.kernels.Sum([k1, k2], dims=manif.d2s)
+    assert torch.allclose(kprod(x, y), K1 * K2)
+    assert torch.allclose(ksum(x, y), K1 + K2)
+    for kernel in [kprod, ksum]:
+        assert torch.allclose(kernel.diagK(x),
+                              torch.diagonal(kernel(x, x), dim1=-2, dim2=-1))
+        assert len(list(kernel.parameters())) == 4
+
+    #with shared hyperparameters the product kernel is a kernel on the product manifold
+    kernel = QuadExp(n, manif.distance, scale=np.ones(n))
+    assert torch.allclose(
+        kernel(x, y),
+        K1 * QuadExp(n, so3.distance, scale=np.ones(n))(x[..., 2:, :],
+                                                        y[..., 2:, :]))
+
+
 if __name__ == '__main__':
     test_quad_exp_kernel()
     test_matern_kernel()
@@ -181,4 +247,6 @@ if __name__ == '__main__':
     test_quad_exp_trK()
     test_kernels_diagK()
     test_kernels_run()
+    test_quad_exp_manifold_distances()
+    test_combination_kernels()
     print('Tested kernels')
@@ -123,13 +123,195 @@ def test_s3_distance():
     assert torch.allclose(slow_dist, dist)
 
 
+def test_torus_log_q():
+    """check that truncated and factorised wrapped sums match the full sum"""
+    n_mc, m, d, kmax = 10, 8, 3, 3
+    t3 = manifolds.Torus(m, d)
+    sig = torch.rand(m, d) * 2 + 0.05
+    base = torch.distributions.Normal(0, sig)
+    x = base.sample(torch.Size([n_mc]))
+
+    lq_full = t3.log_q(lambda y: base.log_prob(y).sum(-1), x, d, kmax)
+    lq_adaptive = t3.log_q(lambda y: base.log_prob(y).sum(-1),
+                           x,
+                           d,
+                           kmax,
+                           scale=sig)
+    lq_diag = t3.log_q(base.log_prob, x, d, kmax, scale=sig, diagonal=True)
+
+    assert lq_full.shape == (n_mc, m)
+    assert torch.allclose(lq_adaptive, lq_full)
+    assert torch.allclose(lq_diag, lq_full)
+
+    #narrow distributions need no wrapped copies
+    assert t3.wrap_kmax(x * 1e-3, d, kmax, scale=sig * 1e-3) == [0, 0, 0]
+
+
+def test_rotation_log_q():
+    """check that truncating the shells of So3 and S3 does not change log_q"""
+    n_mc, m, kmax = 10, 8, 5
+    for manif_type in [manifolds.So3, manifolds.S3]:
+        manif = manif_type(m)
+        for sig in [0.05, 1.]:
+            scale = torch.ones(m, 3) * sig
+            base = torch.distributions.Normal(0, scale)
+            x = base.sample(torch.Size([n_mc]))
+            lq_full = manif.log_q(lambda y: base.log_prob(y).sum(-1), x, 3,
+                                  kmax)
+            lq = manif.log_q(lambda y: base.log_prob(y).sum(-1),
+                             x,
+                             3,
+                             kmax,
+                             scale=scale)
+            assert torch.allclose(lq, lq_full)
+
+        #concentrated distributions only need a single shell
+        theta = torch.norm(x * 1e-2, dim=-1, keepdim=True)
+        assert manifolds.base.shell_kmax(theta, kmax, np.pi,
+                                         scale=scale * 1e-2) == 0
+
+
+def test_product_log_q():
+    """check that wrapping a product manifold factorises for independent factors"""
+    n_mc, m, kmax = 10, 8, 3
+    t1, so3 = manifolds.Torus(m, 2), manifolds.So3(m)
+    manif = manifolds.Product([t1, so3])
+    assert (manif.d, manif.d2) == (5, 6)
+
+    scale = torch.rand(m, 5) + 0.5
+    base = torch.distributions.Normal(0, scale)
+    x = base.sample(torch.Size([n_mc]))
+    g = manif.expmap(x)
+    assert g.shape == (n_mc, m, 6)
+    e = torch.tensor([0., 0., 1., 0., 0., 0.])  #identity element
+    assert torch.allclose(manif.gmul(manif.inverse(g), g), e.expand(g.shape))
+
+    #joint and per-dimension base densities give the same log_q
+    lq_joint = manif.log_q(lambda y: base.log_prob(y).sum(-1),
+                           x,
+                           manif.d,
+                           kmax,
+                           scale=scale)
+    lq_diag = manif.log_q(base.log_prob,
+                          x,
+                          manif.d,
+                          kmax,
+                          scale=scale,
+                          diagonal=True)
+    #which is the sum of the log_q of each factor
+    base1 = torch.distributions.Normal(0, scale[:, :2])
+    base2 = torch.distributions.Normal(0, scale[:, 2:])
+    lq1 = t1.log_q(base1.log_prob, x[..., :2], 2, kmax, diagonal=True)
+    lq2 = so3.log_q(lambda y: base2.log_prob(y).sum(-1), x[..., 2:], 3, kmax)
+    assert lq_joint.shape == (n_mc, m)
+    assert torch.allclose(lq_joint, lq1 + lq2)
+    assert torch.allclose(lq_diag, lq1 + lq2)
+
+    #distances add up
+    gx, gy = g.transpose(-1, -2), g.flip(0).transpose(-1, -2)
+    dist = manif.distance(gx, gy)
+    assert torch.allclose(
+        dist,
+        t1.distance(gx[..., :2, :], gy[..., :2, :]) +
+        so3.distance(gx[..., 2:, :], gy[..., 2:, :]))
+
+
+def test_quaternion_ops():
+    """check the compiled quaternion ops against their definitions"""
+    x, y = torch.randn(2, 5, 7, 4).unbind(0)
+    #product(x, y) is the hamilton product y x of the quaternions
+    table = torch.tensor([[[1., 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0],
+                           [0, 0, 0, 1]],
+                          [[0., 1, 0, 0], [-1, 0, 0, 0], [0, 0, 0, 1],
+                           [0, 0, -1, 0]],
+                          [[0., 0, 1, 0], [0, 0, 0, -1], [-1, 0, 0, 0],
+                           [0, 1, 0, 0]],
+                          [[0., 0, 0, 1], [0, 0, 1, 0], [0, -1, 0, 0],
+                           [-1, 0, 0, 0]]])
+    ref = torch.einsum('...a,...b,abc->...c', y, x, table)
+    assert torch.allclose(manifolds.quaternion.product(x, y), ref)
+    assert torch.allclose(manifolds.quaternion.conj(x),
+                          x * torch.tensor([1., -1, -1, -1]))
+    assert torch.allclose(
+        manifolds.quaternion.conj_product(x, y),
+        manifolds.quaternion.product(manifolds.quaternion.conj(x), y))
+
+    #exp and log are inverses for |v| < pi
+    v = torch.randn(5, 7, 3)
+    v = v / torch.norm(v, dim=-1, keepdim=True) * torch.rand(5, 7, 1) * 3
+    q = manifolds.quaternion.exp(v)
+    assert torch.allclose(torch.norm(q, dim=-1), torch.ones(5, 7))
+    assert torch.allclose(manifolds.quaternion.log(q), v)
+    for manif in [manifolds.So3(7), manifolds.S3(7)]:
+        g = manif.expmap(v)
+        assert torch.allclose(manif.inverse_gmul(g, q),
+                              manif.gmul(manif.inverse(g), q))
+
+
+def test_sphere():
+    """check the group-like operations and wrapped density on spheres"""
+    m, kmax = 8, 3
+    s2 = manifolds.Sphere(m, 2)
+    x = torch.randn(10, m, 2)
+    g = s2.expmap(x)
+    assert torch.allclose(torch.norm(g, dim=-1), torch.ones(10, m))
+    e = torch.tensor([1., 0, 0])  #pole
+    assert torch.allclose(s2.gmul(s2.inverse(g), g), e.expand(g.shape))
+    gmu = s2.expmap(torch.randn(m, 2))
+    assert torch.allclose(s2.gmul(gmu, e.expand(m, 3)), gmu)
+    #reflections are isometries
+    gmu = gmu[:1]
+    assert torch.allclose(
+        s2.distance(g.transpose(-1, -2), g.transpose(-1, -2)),
+        s2.distance(
+            s2.gmul(gmu, g).transpose(-1, -2),
+            s2.gmul(gmu, g).transpose(-1, -2)))
+    small = x / torch.norm(x, dim=-1, keepdim=True) * 3
+    assert torch.allclose(s2.logmap(s2.expmap(small)), small)
+
+    #the wrapped density integrates to one on S^2
+    phi, psi = torch.meshgrid(torch.linspace(0, np.pi, 401)[1:-1],
+                              torch.linspace(0, 2 * np.pi, 801)[:-1],
+                              indexing='ij')
+    y = torch.stack([
+        torch.cos(phi),
+        torch.sin(phi) * torch.cos(psi),
+        torch.sin(phi) * torch.sin(psi)
+    ],
+                    dim=-1)
+    base = torch.distributions.Normal(torch.tensor([0.3, -0.2]),
+                                      torch.tensor([1., 0.5]))
+    lq = s2.log_q(base.log_prob, s2.logmap(y), 2, kmax, diagonal=True)
+    dA = torch.sin(phi) * (np.pi / 400) * (2 * np.pi / 800)
+    assert torch.isclose((torch.exp(lq) * dA).sum(),
+                         torch.tensor(1.),
+                         atol=1e-2)
+
+    #S^3 matches the quaternion manifold
+    scale = torch.ones(m, 3) * 0.7
+    base = torch.distributions.Normal(0, scale)
+    x = base.sample(torch.Size([10]))
+    lq = manifolds.Sphere(m, 3).log_q(base.log_prob, x, 3, kmax, diagonal=True)
+    lq_s3 = manifolds.S3(m).log_q(base.log_prob, x, 3, kmax, diagonal=True)
+    #the Jacobians are regularised differently at |x| = pi
+    far = torch.abs(torch.norm(x, dim=-1) - np.pi) > 0.5
+    assert torch.allclose(lq[far], lq_s3[far], rtol=1e-3)
+
+
 def test_manifs_runs():
     m, d, n, n_z, n_samples = 10, 3, 5, 5, 2
     Y = np.random.normal(0, 1, (n_samples, n, m))
     data = torch.tensor(Y, dtype=torch.get_default_dtype(), device=device)
-    for i, manif_type in enumerate(
-        [manifolds.Torus, manifolds.So3, manifolds.S3]):
-        manif = manif_type(m, d)
+    for i, manif_type in enumerate([
+            manifolds.Torus, manifolds.So3, manifolds.S3, manifolds.Product,
+            manifolds.Sphere
+    ]):
+        if manif_type is manifolds.Product:
+            manif = manif_type([manifolds.Torus(m, 1), manifolds.So3(m)])
+        elif manif_type is manifolds.Sphere:
+            manif = manif_type(m, 2)
+        else:
+            manif = manif_type(m, d)
         print(manif.name)
         lat_dist = mgplvm.rdist.ReLie(manif,
                                       m,
@@ -168,4 +350,9 @@ if __name__ == '__main__':
     test_torus_distance()
     test_so3_distance()
     test_s3_distance()
+    test_torus_log_q()
+    test_rotation_log_q()
+    test_product_log_q()
+    test_quaternion_ops()
+    test_sphere()
     test_manifs_runs()
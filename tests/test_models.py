@@ -1,3 +1,6 @@
+import os
+import copy
+import tempfile
 import numpy as np
 import torch
 from torch import optim
@@ -122,6 +125,394 @@ def test_lgplvm_LL():
         assert elbo < LL
 
 
+def test_lgplvm_em():
+    """
+    test that fit_em increases the exact ELBO monotonically and that the
+    exact ELBO matches the Monte Carlo estimate of the model
+    """
+    d, n, m, n_samples = 2, 8, 30, 2
+    gen = mgp.syndata.Gen(mgp.syndata.Euclid(d),
+                          n,
+                          m,
+                          variability=0.25,
+                          n_samples=n_samples)
+    Y = gen.gen_data()
+    data = torch.tensor(Y, device=device, dtype=torch.get_default_dtype())
+    #regular and irregularly sampled time points
+    ts = torch.arange(m)[None, None, :].repeat(n_samples, 1, 1).to(data)
+    ts_irr = ts.clone()
+    ts_irr[1, 0, 10:] += 3
+    for ts, lat in zip(
+        [ts, ts_irr, ts],
+        [mgp.rdist.GP_diag, mgp.rdist.GP_diag, mgp.rdist.GP_circ]):
+        manif = mgp.manifolds.Euclid(m, d)
+        lat_dist = lat(manif, m, n_samples, ts, ell=3.)
+        lprior = mgp.lpriors.Null(manif)
+        mod = mgp.models.Lgplvm(n,
+                                m,
+                                d,
+                                n_samples,
+                                lat_dist,
+                                lprior,
+                                Bayesian=False,
+                                Y=Y).to(device)
+
+        progress = mgp.optimisers.fit_em(data,
+                                         mod,
+                                         max_steps=20,
+                                         tol=0,
+                                         print_every=1000)
+        assert np.all(np.diff(progress) > -1e-8)
+
+        #Monte Carlo estimate of the same ELBO (per data point)
+        svgp_elbo, kl = mod.forward(data, 1000)
+        elbo = (svgp_elbo.sum(-1) - kl).mean().item() / np.prod(Y.shape)
+        assert np.abs(elbo - progress[-1]) < 1e-3
+
+
+def test_lvgplvm_analytic_lik():
+    """
+    test that the moment-based ELBO of a Bayesian GPFA model matches its
+    Monte Carlo estimate
+    """
+    d, n, m, n_samples = 2, 8, 15, 2
+    Y = np.random.normal(0, 1, (n_samples, n, m))
+    data = torch.tensor(Y, device=device, dtype=torch.get_default_dtype())
+    ts = torch.arange(m)[None, None, :].repeat(n_samples, 1, 1).to(data)
+    for lat in [mgp.rdist.GP_diag, mgp.rdist.GP_circ]:
+        manif = mgp.manifolds.Euclid(m, d)
+        lat_dist = lat(manif, m, n_samples, ts, ell=3.)
+        with torch.no_grad():
+            lat_dist._nu.normal_()
+            lat_dist._scale.normal_()
+            if hasattr(lat_dist, '_c'):
+                lat_dist._c.normal_()
+        #the marginal variances match the full covariance
+        var = torch.diagonal(lat_dist.full_cov(), dim1=-1, dim2=-2)
+        assert torch.allclose(lat_dist.marginal_var(), var)
+        #also when the length scale is short compared to the time series
+        short = lat(manif, m, n_samples, ts, ell=1.)
+        var = torch.diagonal(short.full_cov(), dim1=-1, dim2=-2)
+        assert torch.allclose(short.marginal_var(), var)
+
+        lik = mgp.likelihoods.Gaussian(n)
+        lprior = mgp.lpriors.Null(manif)
+        mod = mgp.models.Lvgplvm(n, m, d, n_samples, lat_dist, lprior,
+                                 lik).to(device)
+        with torch.no_grad():
+            mod.obs._q_mu.normal_()
+        svgp_elbo, kl = mod.forward(data, 1, analytic_lik=True)
+        svgp_mc, kl_mc = mod.forward(data, 20000)
+        assert torch.allclose(kl, kl_mc)
+        assert torch.allclose(svgp_elbo, svgp_mc, rtol=1e-2)
+
+        #only the batch is used
+        svgp_batch, _ = mod.forward(data[..., :5],
+                                    1,
+                                    batch_idxs=np.arange(5),
+                                    analytic_lik=True)
+        svgp_batch_mc, _ = mod.forward(data[..., :5],
+                                       20000,
+                                       batch_idxs=np.arange(5))
+        assert torch.allclose(svgp_batch, svgp_batch_mc, rtol=1e-2)
+
+
+def test_lvgplvm_new_trials():
+    """
+    test that a Bayesian GPFA model can be updated with new trials
+    """
+    d, n, m, n_samples = 2, 8, 15, 2
+    Y = np.random.normal(0, 1, (2 * n_samples, n, m))
+    data = torch.tensor(Y, device=device, dtype=torch.get_default_dtype())
+    ts = torch.arange(m)[None, None, :].repeat(n_samples, 1, 1).to(data)
+    manif = mgp.manifolds.Euclid(m, d)
+    lat_dist = mgp.rdist.GP_diag(manif, m, n_samples, ts)
+    lik = mgp.likelihoods.Gaussian(n)
+    mod = mgp.models.Lvgplvm(n, m, d, n_samples, lat_dist,
+                             mgp.lpriors.Null(manif), lik).to(device)
+    for i in range(2):
+        if i > 0:  #the next chunk of trials
+            lat_dist = mgp.rdist.GP_diag(manif, m, n_samples, ts).to(device)
+            mod.new_trials(m, n_samples, lat_dist, mgp.lpriors.Null(manif))
+            #the prior is the previous posterior
+            assert torch.allclose(mod.obs.prior_kl(),
+                                  torch.zeros(1, n).to(device))
+        mgp.optimisers.svgp.fit(data[i * n_samples:(i + 1) * n_samples],
+                                mod,
+                                optimizer=optim.Adam,
+                                max_steps=5,
+                                n_mc=4,
+                                print_every=1000)
+
+
+def test_infer_latents():
+    """
+    test that the latents of new trials can be inferred with a fixed
+    observation model, in closed form for GPFA and with L-BFGS otherwise
+    """
+    d, n, m, n_samples = 2, 8, 15, 2
+    Y = np.random.normal(0, 1, (n_samples + 1, n, m))
+    data = torch.tensor(Y, device=device, dtype=torch.get_default_dtype())
+    ts = torch.arange(m)[None, None, :].repeat(n_samples, 1, 1).to(data)
+    manif = mgp.manifolds.Euclid(m, d)
+
+    #closed form (Fa)
+    lat_dist = mgp.rdist.GP_diag(manif, m, n_samples, ts, ell=3.)
+    mod = mgp.models.Lgplvm(n,
+                            m,
+                            d,
+                            n_samples,
+                            lat_dist,
+                            mgp.lpriors.Null(manif),
+                            Bayesian=False).to(device)
+    mgp.optimisers.fit_em(data[:n_samples], mod, max_steps=5, print_every=1000)
+    nu = mod.lat_dist.nu.detach().clone()
+    new = mgp.rdist.GP_diag(manif, m, 1, ts[:1], ell=1.).to(device)
+    new = mod.infer_latents(data[n_samples:], lat_dist=new)
+    assert torch.allclose(mod.lat_dist.nu, nu)  #the model is unchanged
+    assert torch.allclose(new.ell, mod.lat_dist.ell)
+    with torch.no_grad():  #the closed form update is a fixed point of EM
+        old = new.nu.clone()
+        mod.infer_latents(data[n_samples:], lat_dist=new)
+        assert torch.allclose(new.nu, old, atol=1e-5)
+
+    #L-BFGS (Bayesian observation model)
+    lat_dist = mgp.rdist.GP_diag(manif, m, n_samples, ts)
+    mod = mgp.models.Lvgplvm(n, m, d, n_samples, lat_dist,
+                             mgp.lpriors.Null(manif),
+                             mgp.likelihoods.Gaussian(n)).to(device)
+    mgp.optimisers.svgp.fit(data[:n_samples],
+                            mod,
+                            optimizer=optim.Adam,
+                            max_steps=5,
+                            n_mc=4,
+                            print_every=1000)
+    obs = [p.detach().clone() for p in mod.obs.parameters()]
+    grads = [p.requires_grad for p in mod.parameters()]
+
+    def elbo(lat_dist):
+        lat_dist.noise = mgp.utils.Noise(0)
+        svgp_elbo, kl = mod.forward(data[:n_samples], 100)
+        lat_dist.noise = mgp.utils.default_noise
+        return (svgp_elbo - kl).sum().item()
+
+    elbo0 = elbo(mod.lat_dist)
+    new = mod.infer_latents(data[:n_samples], n_mc=8, max_steps=20)
+    assert new is not mod.lat_dist
+    mod.lat_dist, old = new, mod.lat_dist
+    assert elbo(new) > elbo0
+    mod.lat_dist = old
+    assert all(torch.equal(p, q) for (p, q) in zip(mod.obs.parameters(), obs))
+    assert grads == [p.requires_grad for p in mod.parameters()]
+
+
+def test_amortised_relie():
+    """
+    test that an amortised ReLie can be fitted with batches and infers the
+    latents of new data with a forward pass
+    """
+    d, n, m, n_z, n_samples = 2, 8, 20, 5, 2
+    Y = np.random.normal(0, 1, (n_samples, n, m))
+    data = torch.tensor(Y, device=device, dtype=torch.get_default_dtype())
+    for manif, diagonal in [(mgp.manifolds.Euclid(m, d), False),
+                            (mgp.manifolds.Torus(m, d), True)]:
+        lat_dist = mgp.rdist.AmortisedReLie(manif,
+                                            n,
+                                            sigma=0.5,
+                                            diagonal=diagonal,
+                                            n_hidden=16)
+        mod = mgp.models.SvgpLvm(n, m, n_samples, manif.inducing_points(n, n_z),
+                                 mgp.kernels.QuadExp(n, manif.distance),
+                                 mgp.likelihoods.Gaussian(n), lat_dist,
+                                 mgp.lpriors.Uniform(manif)).to(device)
+        gmu, gamma = lat_dist.lat_prms(data)
+        assert gmu.shape == (n_samples, m, manif.d2)
+        assert torch.allclose(gamma, 0.5 * torch.eye(d).to(gamma), atol=0.1)
+        #the data of a batch of consecutive time points is encoded
+        gmu_b, _ = lat_dist.lat_prms(data[[1]],
+                                     batch_idxs=list(range(m)),
+                                     sample_idxs=[1])
+        assert torch.allclose(gmu_b, gmu[[1]])
+        for batch_idxs in [[4, 3], [3, 5]]:
+            try:
+                lat_dist.lat_prms(data[..., batch_idxs], batch_idxs=batch_idxs)
+                raise AssertionError('a non-consecutive batch was encoded')
+            except Exception as e:
+                assert 'consecutive' in str(e)
+
+        dataloader = mgp.optimisers.data.BatchDataLoader(data, batch_size=10)
+        mgp.optimisers.svgp.fit(dataloader,
+                                mod,
+                                optimizer=optim.Adam,
+                                max_steps=5,
+                                n_mc=4,
+                                print_every=1000)
+
+        #new data with a different number of samples and time points
+        gmu, gamma = lat_dist.lat_prms(data[:1, :, :7])
+        assert gmu.shape == (1, 7, manif.d2)
+        assert gamma.shape == (1, 7, d, d)
+
+
+def test_fit_checkpoint():
+    """
+    test that training resumed from a checkpoint gives the same result as
+    uninterrupted training
+    """
+    d, n, m, n_z, n_samples = 1, 8, 20, 5, 4
+    Y = np.random.normal(0, 1, (n_samples, n, m))
+    data = torch.tensor(Y, device=device, dtype=torch.get_default_dtype())
+    manif = mgp.manifolds.Euclid(m, d)
+    lat_dist = mgp.rdist.ReLie(manif, m, n_samples)
+    mod = mgp.models.SvgpLvm(n, m, n_samples, manif.inducing_points(n, n_z),
+                             mgp.kernels.QuadExp(n, manif.distance),
+                             mgp.likelihoods.Gaussian(n), lat_dist,
+                             mgp.lpriors.Uniform(manif)).to(device)
+    mods = [copy.deepcopy(mod) for _ in range(3)]
+    kwargs = dict(n_mc=4, lrate=5e-2, print_every=1000, batch_mc=2)
+
+    def loader():
+        return mgp.optimisers.data.BatchDataLoader(data,
+                                                   batch_size=7,
+                                                   sample_size=3,
+                                                   shuffle_batch=True,
+                                                   shuffle_sample=True)
+
+    #the state of the callbacks is saved in the checkpoint
+    stops = [
+        mgp.optimisers.PlateauStop(patience=100, smoothing=0.5)
+        for _ in range(3)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ckpt.pt')
+        torch.manual_seed(0)
+        np.random.seed(0)
+        progress = mgp.optimisers.svgp.fit(loader(),
+                                           mods[0],
+                                           max_steps=8,
+                                           callbacks=[stops[0]],
+                                           **kwargs)
+        #interrupted after 5 steps (the checkpoint is written every 2 steps)
+        torch.manual_seed(0)
+        np.random.seed(0)
+        mgp.optimisers.svgp.fit(loader(),
+                                mods[1],
+                                max_steps=5,
+                                checkpoint=path,
+                                checkpoint_every=2,
+                                callbacks=[stops[1]],
+                                **kwargs)
+        assert torch.load(path, weights_only=False)['step'] == 5
+        torch.manual_seed(1)  #the random state is restored
+        resumed = mgp.optimisers.svgp.fit(loader(),
+                                          mods[2],
+                                          max_steps=8,
+                                          resume_from=path,
+                                          callbacks=[stops[2]],
+                                          **kwargs)
+
+        #the final checkpoint has the parameters restored by BestModel (the
+        #loss is not monotonic with a large learning rate)
+        best = mgp.optimisers.BestModel(monitor='loss')
+        mgp.optimisers.svgp.fit(loader(),
+                                mods[1],
+                                max_steps=6,
+                                checkpoint=path,
+                                callbacks=[best],
+                                **dict(kwargs, lrate=2))
+        ckpt = torch.load(path, weights_only=False)
+
+    assert np.allclose(progress, resumed, rtol=0, atol=0)
+    for p, q in zip(mods[0].parameters(), mods[2].parameters()):
+        assert torch.equal(p, q)
+    assert (stops[0].smoothed, stops[0].best,
+            stops[0].wait) == (stops[2].smoothed, stops[2].best, stops[2].wait)
+    for (name, p) in best.state.items():
+        assert torch.equal(p, ckpt['model'][name])
+
+
+def test_fit_callbacks():
+    """
+    test the events of the training loop and the built-in callbacks
+    """
+    d, n, m, n_z, n_samples = 1, 8, 20, 5, 2
+    Y = np.random.normal(0, 1, (n_samples, n, m))
+    data = torch.tensor(Y, device=device, dtype=torch.get_default_dtype())
+    manif = mgp.manifolds.Euclid(m, d)
+    lat_dist = mgp.rdist.ReLie(manif, m, n_samples)
+    mod = mgp.models.SvgpLvm(n, m, n_samples, manif.inducing_points(n, n_z),
+                             mgp.kernels.QuadExp(n, manif.distance),
+                             mgp.likelihoods.Gaussian(n), lat_dist,
+                             mgp.lpriors.Uniform(manif)).to(device)
+    #train on 15 time points and evaluate the ELBO on the rest
+    train = mgp.optimisers.data.BatchDataLoader(data,
+                                                batch_pool=list(range(15)))
+    val = mgp.optimisers.data.BatchDataLoader(data,
+                                              batch_pool=list(range(15, m)))
+
+    class Counter(mgp.optimisers.Callback):
+
+        def __init__(self):
+            self.counts = {'step': 0, 'epoch': 0, 'eval': 0}
+
+        def on_step(self, model, i, loss):
+            self.counts['step'] += 1
+
+        def on_epoch(self, model, i, loss):
+            self.counts['epoch'] += 1
+
+        def on_eval(self, model, i, elbo):
+            self.counts['eval'] += 1
+
+    counter = Counter()
+    held_out = mgp.optimisers.HeldOutElbo(val, every=2, n_mc=8)
+    best = mgp.optimisers.BestModel(monitor='elbo')
+    #no relative improvement is large enough, so the training loss plateaus
+    #from the second iteration
+    reduce_lr = mgp.optimisers.ReduceLROnPlateau(patience=1, rel_tol=10)
+    stop = mgp.optimisers.PlateauStop(patience=5, rel_tol=10)
+    progress = mgp.optimisers.svgp.fit(
+        train,
+        mod,
+        max_steps=100,
+        n_mc=4,
+        lrate=5e-2,
+        print_every=1000,
+        callbacks=[counter, held_out, best, reduce_lr, stop])
+
+    assert len(progress) == 6  #stopped after 5 iterations without improvement
+    assert counter.counts == {'step': 6, 'epoch': 6, 'eval': 3}
+    assert len(held_out.elbos) == 3
+    assert np.allclose(reduce_lr.scheduler.base_lrs, 5e-2 * 0.5**5)
+
+    #the parameters with the highest held-out ELBO are restored
+    assert best.best == -max(held_out.elbos)
+    for (name, p) in mod.state_dict().items():
+        assert torch.equal(p, best.state[name])
+
+    #training stops at the end of the iteration in which on_step returns True
+    class StepStop(mgp.optimisers.Callback):
+
+        def on_step(self, model, i, loss):
+            return i == 2
+
+    progress = mgp.optimisers.svgp.fit(train,
+                                       mod,
+                                       max_steps=100,
+                                       n_mc=4,
+                                       print_every=1000,
+                                       callbacks=[StepStop()])
+    assert len(progress) == 3
+
+
 if __name__ == '__main__':
     test_lgplvm_LL()
     test_svgplvm_LL()
+    test_lgplvm_em()
+    test_lvgplvm_analytic_lik()
+    test_lvgplvm_new_trials()
+    test_infer_latents()
+    test_amortised_relie()
+    test_fit_checkpoint()
+    test_fit_callbacks()
@@ -2,6 +2,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import torch
 from torch import optim
+import torch.distributions as dists
 import mgplvm as mgp
 
 torch.set_default_dtype(torch.float64)
@@ -147,6 +148,76 @@ def test_ARP_runs():
                                 print_every=1000)
 
 
+def test_SSGP_prior():
+    n_mc, n_samples, m, d = 2, 2, 30, 2
+    #irregularly spaced timepoints
+    ts = torch.sort(torch.rand(n_samples, 1, m) * 20, dim=-1)[0]
+    manif = mgp.manifolds.Euclid(m, d)
+    for nu in [0.5, 1.5, 2.5]:
+        kernel = mgp.kernels.Matern(d,
+                                    mgp.manifolds.Euclid.distance,
+                                    nu=nu,
+                                    ell=np.array([1.5, 3.]),
+                                    scale=np.array([1., 0.7]))
+        lprior = mgp.lpriors.SSGP(manif, kernel, ts, jitter=1e-6)
+
+        #dense computation of the prior
+        ts_d = ts[:, None, ...].repeat(1, d, 1, 1)
+        K = kernel(ts_d, ts_d) + 1e-6 * torch.eye(m)  #(n_samples x d x m x m)
+        prior = torch.distributions.MultivariateNormal(torch.zeros(m), K)
+        x = prior.sample(torch.Size([n_mc])).transpose(-1, -2)
+        lp_dense = prior.log_prob(x.transpose(-1, -2)).sum(-1).sum(-1)
+
+        lp = lprior(x)
+        assert torch.allclose(lp, lp_dense, rtol=1e-3)
+
+        #streaming the time series in chunks gives the same result
+        x.requires_grad_()
+        prms = [x] + list(kernel.parameters())
+        lprior.chunk_size = None
+        lprior(x).sum().backward()
+        grads = [p.grad.clone() for p in prms]
+        for p in prms:
+            p.grad = None
+        lprior.chunk_size = 7
+        lp_chunk = lprior(x)
+        assert torch.allclose(lp_chunk, lp)
+        lp_chunk.sum().backward()
+        for p, g in zip(prms, grads):
+            assert torch.allclose(p.grad, g)
+
+
+def test_ARP_log_prob():
+    """compare the vectorised AR(p) prior with a direct evaluation"""
+    n_mc, n_samples, m, d, p = 3, 2, 20, 2, 4
+    for manif in [mgp.manifolds.Euclid(m, d), mgp.manifolds.Torus(m, d)]:
+        ar_phi = torch.randn(d, p) * 0.3
+        ar_eta = torch.rand(d) * 0.5 + 0.1
+        ar_c = torch.randn(d) * 0.1
+        lprior = mgp.lpriors.ARP(p,
+                                 manif,
+                                 ar_phi=ar_phi,
+                                 ar_eta=ar_eta,
+                                 ar_c=ar_c,
+                                 kmax=3)
+        g = manif.expmap(torch.randn(n_mc, n_samples, m, d))
+        lp = lprior(g)
+
+        dx = manif.logmap(g[..., 1:, :] - g[..., :-1, :])
+        lp_ref = 0
+        for t in range(p, m - 1):
+            y = dx[..., t, :] - sum(
+                [ar_phi[:, j] * dx[..., t - j - 1, :] for j in range(p)])
+            ks = [0] if manif.name.startswith('Euclid') else range(-3, 4)
+            q = sum([
+                torch.exp(
+                    torch.distributions.Normal(
+                        ar_c, ar_eta).log_prob(y + 2 * np.pi * k)) for k in ks
+            ])  #wrapped copies on the torus
+            lp_ref = lp_ref + torch.log(q).sum(-1).sum(-1)
+        assert torch.allclose(lp, lp_ref)
+
+
 def fio_id(x):
     return x
 
@@ -159,6 +230,67 @@ def fio_tanh(x):
     return torch.tanh(x)
 
 
+def test_circular_AR_log_prob():
+    m, d, p, n_samples, n_mc = 10, 2, 3, 2, 4
+    manif = mgp.manifolds.Torus(m, d)
+    g = torch.rand(n_mc, n_samples, m, d) * 2 * np.pi
+    for link in ['logits', 'atan']:
+        iarp = mgp.lpriors.torus.IARP(p,
+                                      manif,
+                                      mu=torch.rand(d),
+                                      phi=torch.randn(d, p),
+                                      concentration=torch.rand(d) + 0.5,
+                                      link=link)
+        larp = mgp.lpriors.torus.LARP(p,
+                                      manif,
+                                      mu=torch.rand(d),
+                                      phi=torch.randn(d, p),
+                                      eta=torch.rand(d) + 0.5,
+                                      link=link)
+        for lprior in [iarp, larp]:
+            mu, phi, scale = lprior.prms
+            #lags built one at a time
+            x = (g - mu) % (2 * np.pi)
+            hat = sum([
+                phi[:, j] * lprior.inv_link(x[..., p - j - 1:-j - 1, :])
+                for j in range(p)
+            ])
+            if lprior.name == 'IARP':
+                dist = dists.VonMises(lprior.link(hat), scale)
+            else:
+                dist = dists.Normal(hat, torch.sqrt(scale))
+            lp = dists.Independent(dist, 1).log_prob(x[..., p:, :])
+            assert torch.allclose(lprior(g), lp, atol=1e-5)
+
+
+def test_DS_log_prob():
+    m, d, n_samples, n_mc = 10, 3, 2, 4
+    manif = mgp.manifolds.Euclid(m, d)
+    lprior = mgp.lpriors.DS(manif)
+    with torch.no_grad():
+        lprior._W.normal_()
+        lprior._lam.normal_()
+    A, Q = lprior.prms
+    #the rotation is orthogonal
+    O = torch.diag(1 / lprior._lam) @ A @ torch.diag(
+        torch.sqrt(torch.square(lprior._lam) + 1))
+    assert torch.allclose(O @ O.T, torch.eye(d), atol=1e-6)
+
+    #compare with a full Gaussian
+    x = torch.randn(n_mc, n_samples, m, d)
+    normal = dists.MultivariateNormal(torch.zeros(d), scale_tril=Q)
+    lp = normal.log_prob(x[..., 1:, :] - x[..., :-1, :] @ A).sum(-1).sum(-1)
+    assert torch.allclose(lprior(x), lp)
+
+    #A is cached without gradients until the parameters change
+    with torch.no_grad():
+        A1, _ = lprior.prms
+        assert lprior.prms[0] is A1
+        lprior._lam.add_(0.1)
+        assert lprior.prms[0] is not A1
+    assert lprior.prms[0].requires_grad
+
+
 def test_LDS_prior_runs():
     m, d, n, n_z, p = 10, 3, 5, 5, 1
     n_samples = 2
@@ -208,5 +340,9 @@ def test_LDS_prior_runs():
 if __name__ == '__main__':
     #test_GP_prior()
     test_ARP_runs()
+    test_ARP_log_prob()
+    test_circular_AR_log_prob()
+    test_DS_log_prob()
     test_LDS_prior_runs()
+    test_SSGP_prior()
     print('Tested priors')